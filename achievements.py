@@ -0,0 +1,459 @@
+"""Badges, points and leaderboards maintained incrementally from game logs
+
+Every game log earns up to POINTS_PER_GAME points. apply_log_achievements()
+runs in the same transaction as the game_logs insert, like the rollups: it
+adds the new points to student_rewards, advances the day streak, moves the
+student on the school, district and grade leaderboards and checks only the
+badges the student does not hold yet against the new logs and the
+student's running totals. History is never rescanned.
+
+A leaderboard is the (scope_key, points DESC, student_id) index on
+leaderboard_entries, so the top N is an index range read. For ranks,
+leaderboard_buckets counts the students of each scope per points bucket:
+a student's rank is the number of students in higher buckets plus the few
+in their own bucket with more points. Buckets are one point wide up to
+LINEAR_BUCKETS points and then widen geometrically (512 per doubling),
+which keeps both the bucket sum and the in-bucket count small.
+"""
+import datetime
+from collections import namedtuple
+
+POINTS_PER_GAME = 10
+LINEAR_BUCKETS = 1024
+DEFAULT_TOP_N = 10
+MAX_TOP_N = 100
+SCOPES = ('school', 'district', 'grade')
+
+MAX_ACHIEVEMENT_BATCH = 500
+MAX_BADGE_NAME_LENGTH = 100
+CLIENT_BADGE_TYPE = 'client'
+
+MATH_SUBJECTS = ('Mathematics', 'Maths', 'Math')
+SCIENCE_SUBJECTS = ('Science', 'Physics', 'Chemistry', 'Biology')
+
+# rule: 'games' (total games), 'points', 'streak' (days in a row), 'perfect'
+# (a log with full marks), 'fast' (a log finished in under threshold
+# seconds), 'subject_games' (games in subjects), 'subject_topics' (distinct
+# games played in subjects)
+Badge = namedtuple('Badge', 'name badge_type description icon rule threshold subjects')
+
+BADGES = (
+    Badge('First Steps', 'milestone', 'Play your first game', '🎯', 'games', 1, None),
+    Badge('Century', 'milestone', 'Play 100 games', '💯', 'games', 100, None),
+    Badge('Rising Star', 'milestone', 'Earn 1000 points', '⭐', 'points', 1000, None),
+    Badge('Perfect Score', 'performance', 'Get 100% in any game or quiz', '🏆', 'perfect', 1, None),
+    Badge('Speed Demon', 'performance', 'Complete a game in under 1 minute', '⚡', 'fast', 60, None),
+    Badge('7-Day Streak', 'streak', 'Learn for 7 consecutive days', '🔥', 'streak', 7, None),
+    Badge('Math Master', 'subject', 'Complete 10 math games', '🧮', 'subject_games', 10, MATH_SUBJECTS),
+    Badge('Science Explorer', 'subject', 'Explore 5 science topics', '🔬', 'subject_topics', 5,
+          SCIENCE_SUBJECTS),
+)
+# Only apply_log_achievements() may award these; clients posting them are refused
+RESERVED_BADGE_NAMES = frozenset(badge.name.casefold() for badge in BADGES)
+
+STUDENT_SCOPE_SQL = '''
+    SELECT s.udise_code, COALESCE(u.district, s.district), s.grade FROM students s
+    LEFT JOIN udise_schools u ON u.udise_code = s.udise_code
+    WHERE s.id = ?
+'''
+
+UPSERT_REWARDS_SQL = '''
+    INSERT INTO student_rewards (student_id, points, current_streak, best_streak, last_active_day)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (student_id) DO UPDATE SET
+        points = excluded.points,
+        current_streak = excluded.current_streak,
+        best_streak = excluded.best_streak,
+        last_active_day = excluded.last_active_day
+'''
+
+UPSERT_ENTRY_SQL = '''
+    INSERT INTO leaderboard_entries (scope_key, student_id, points) VALUES (?, ?, ?)
+    ON CONFLICT (scope_key, student_id) DO UPDATE SET points = excluded.points
+'''
+
+ADD_TO_BUCKET_SQL = '''
+    INSERT INTO leaderboard_buckets (scope_key, bucket, students) VALUES (?, ?, ?)
+    ON CONFLICT (scope_key, bucket) DO UPDATE SET students = students + excluded.students
+'''
+
+INSERT_ACHIEVEMENT_SQL = '''
+    INSERT INTO achievements (student_id, badge_name, badge_type, description, icon_path, awarded_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (student_id, badge_name) DO NOTHING
+'''
+
+
+class AchievementValidationError(ValueError):
+    """Raised when a client-submitted achievement is malformed"""
+
+
+def scope_key(scope, value):
+    return f'{scope}:{value}'
+
+
+def scope_keys(udise_code, district, grade):
+    """Leaderboards a student with this school, district and grade belongs to"""
+    keys = []
+    if udise_code:
+        keys.append(scope_key('school', udise_code))
+    if district:
+        keys.append(scope_key('district', district))
+    if grade is not None:
+        keys.append(scope_key('grade', grade))
+    return keys
+
+
+def log_points(score, max_score):
+    return round(POINTS_PER_GAME * min(score / max_score, 1.0))
+
+
+def bucket_of(points):
+    """Rank bucket of a points total; monotonic in points"""
+    if points < LINEAR_BUCKETS:
+        return points
+    shift = points.bit_length() - LINEAR_BUCKETS.bit_length() + 1
+    return LINEAR_BUCKETS + (shift - 1) * (LINEAR_BUCKETS // 2) + (points >> shift) - LINEAR_BUCKETS // 2
+
+
+def bucket_end(bucket):
+    """Smallest points total that falls in a higher bucket"""
+    if bucket < LINEAR_BUCKETS:
+        return bucket + 1
+    shift, offset = divmod(bucket - LINEAR_BUCKETS, LINEAR_BUCKETS // 2)
+    return (offset + LINEAR_BUCKETS // 2 + 1) << (shift + 1)
+
+
+def _day(played_at):
+    try:
+        return datetime.date.fromisoformat(str(played_at)[:10])
+    except ValueError:
+        return None
+
+
+def advance_streak(current, best, last_day, days):
+    """Fold sorted active days into (current, best, last_day)
+
+    Days before the last active one (logs synced late) cannot extend a
+    streak retroactively and are ignored.
+    """
+    for day in days:
+        if last_day is not None and day <= last_day:
+            continue
+        if last_day is not None and (day - last_day).days == 1:
+            current += 1
+        else:
+            current = 1
+        best = max(best, current)
+        last_day = day
+    return current, best, last_day
+
+
+def move_on_leaderboards(conn, student_id, keys, points):
+    """Set the student's points on each leaderboard, keeping bucket counts in step"""
+    new_bucket = bucket_of(points)
+    for key in keys:
+        row = conn.execute(
+            'SELECT points FROM leaderboard_entries WHERE scope_key = ? AND student_id = ?',
+            (key, student_id)
+        ).fetchone()
+        old_bucket = None if row is None else bucket_of(row[0])
+        conn.execute(UPSERT_ENTRY_SQL, (key, student_id, points))
+        if old_bucket == new_bucket:
+            continue
+        if old_bucket is not None:
+            conn.execute(
+                'UPDATE leaderboard_buckets SET students = students - 1 WHERE scope_key = ? AND bucket = ?',
+                (key, old_bucket)
+            )
+        conn.execute(ADD_TO_BUCKET_SQL, (key, new_bucket, 1))
+
+
+def _count(conn, sql, params):
+    return conn.execute(sql, params).fetchone()[0] or 0
+
+
+def _pending_badges(conn, student_id, rows, rewards):
+    """Badges not yet held that the new rows or updated totals qualify for"""
+    held = {r[0] for r in conn.execute('SELECT badge_name FROM achievements WHERE student_id = ?',
+                                       (student_id,))}
+    subjects = {row[0] for row in rows}
+    earned = []
+    for badge in BADGES:
+        if badge.name in held:
+            continue
+        if badge.subjects is not None and not subjects.intersection(badge.subjects):
+            # Nothing in this batch can have changed the subject's totals
+            continue
+        placeholders = ','.join('?' * len(badge.subjects or ()))
+        if badge.rule == 'games':
+            value = _count(conn, 'SELECT total_games FROM student_stats WHERE student_id = ?', (student_id,))
+        elif badge.rule == 'points':
+            value = rewards['points']
+        elif badge.rule == 'streak':
+            value = rewards['current_streak']
+        elif badge.rule == 'perfect':
+            value = sum(1 for row in rows if row[5] >= row[6])
+        elif badge.rule == 'fast':
+            value = 1 if any(0 < (row[7] or 0) < badge.threshold for row in rows) else 0
+        elif badge.rule == 'subject_games':
+            value = _count(conn, f'''
+                SELECT SUM(total_games) FROM student_subject_stats
+                WHERE student_id = ? AND subject IN ({placeholders})
+            ''', (student_id,) + badge.subjects)
+        elif badge.rule == 'subject_topics':
+            value = _count(conn, f'''
+                SELECT COUNT(*) FROM student_progress
+                WHERE student_id = ? AND subject IN ({placeholders})
+            ''', (student_id,) + badge.subjects)
+        else:
+            continue
+        if badge.rule == 'fast':
+            qualifies = value > 0
+        else:
+            qualifies = value >= badge.threshold
+        if qualifies:
+            earned.append(badge)
+    return earned
+
+
+def apply_log_achievements(conn, student_id, rows):
+    """Fold newly inserted game_logs rows into points, streaks, leaderboards and badges
+
+    rows are validated tuples as produced by ingest.validate_log(). The
+    caller owns the transaction; the rollups and mastery for the same rows
+    must already be applied. Returns the names of newly awarded badges.
+    """
+    if not rows:
+        return []
+    rewards = conn.execute('''
+        SELECT points, current_streak, best_streak, last_active_day FROM student_rewards
+        WHERE student_id = ?
+    ''', (student_id,)).fetchone()
+    points, current, best, last_day = rewards if rewards is not None else (0, 0, 0, None)
+    last_day = _day(last_day) if last_day else None
+
+    points += sum(log_points(row[5], row[6]) for row in rows)
+    days = sorted({day for day in (_day(row[8]) for row in rows) if day is not None})
+    current, best, last_day = advance_streak(current, best, last_day, days)
+    conn.execute(UPSERT_REWARDS_SQL, (student_id, points, current, best,
+                                      last_day.isoformat() if last_day else None))
+
+    location = conn.execute(STUDENT_SCOPE_SQL, (student_id,)).fetchone()
+    if location is not None:
+        move_on_leaderboards(conn, student_id, scope_keys(*location), points)
+
+    earned = _pending_badges(conn, student_id, rows,
+                             {'points': points, 'current_streak': current})
+    awarded_at = max(row[8] for row in rows)
+    conn.executemany(INSERT_ACHIEVEMENT_SQL, [
+        (student_id, badge.name, badge.badge_type, badge.description, badge.icon, awarded_at)
+        for badge in earned
+    ])
+    return [badge.name for badge in earned]
+
+
+def recompute_achievements(conn, source='game_logs'):
+    """Rebuild points, streaks and leaderboards from game_logs and award missing badges
+
+    Achievements already stored, including ones synced from devices, are
+    kept; rule badges are only added.
+    """
+    for table in ('student_rewards', 'leaderboard_entries', 'leaderboard_buckets'):
+        conn.execute(f'DELETE FROM {table}')
+    reader = conn.cursor()
+    reader.execute(f'''
+        SELECT student_id, subject, grade, game_id, game_type, level, score, max_score,
+               time_spent, played_at, client_log_id
+        FROM {source}
+        ORDER BY student_id, played_at
+    ''')
+    students = 0
+    student_id = None
+    rows = []
+    for row in reader:
+        if row[0] != student_id:
+            if rows:
+                apply_log_achievements(conn, student_id, rows)
+                students += 1
+            student_id = row[0]
+            rows = []
+        rows.append(tuple(row[1:]))
+    if rows:
+        apply_log_achievements(conn, student_id, rows)
+        students += 1
+    return students
+
+
+def rebuild_achievements(conn, source='game_logs'):
+    """Recompute points and leaderboards from game_logs in one transaction"""
+    with conn:
+        return recompute_achievements(conn, source)
+
+
+def recount_buckets(conn, keys):
+    """Recount the bucket sizes of these leaderboards from their entries"""
+    for key in keys:
+        conn.execute('DELETE FROM leaderboard_buckets WHERE scope_key = ?', (key,))
+        counts = {}
+        for (points,) in conn.execute('SELECT points FROM leaderboard_entries WHERE scope_key = ?', (key,)):
+            bucket = bucket_of(points)
+            counts[bucket] = counts.get(bucket, 0) + 1
+        conn.executemany(ADD_TO_BUCKET_SQL, [(key, bucket, count) for bucket, count in counts.items()])
+
+
+def _count_above(conn, key, points):
+    """Students on a leaderboard with more than `points`"""
+    bucket = bucket_of(points)
+    above = _count(conn, '''
+        SELECT SUM(students) FROM leaderboard_buckets WHERE scope_key = ? AND bucket > ?
+    ''', (key, bucket))
+    within = _count(conn, '''
+        SELECT COUNT(*) FROM leaderboard_entries
+        WHERE scope_key = ? AND points > ? AND points < ?
+    ''', (key, points, bucket_end(bucket)))
+    return above + within
+
+
+def rank(conn, key, student_id, others=()):
+    """(rank, points, students on the board) of a student, or None if not on it
+
+    Students with equal points share a rank. A leaderboard spread over
+    several shards passes the connections of the other shards as `others`.
+    """
+    row = conn.execute(
+        'SELECT points FROM leaderboard_entries WHERE scope_key = ? AND student_id = ?',
+        (key, student_id)
+    ).fetchone()
+    if row is None:
+        return None
+    points = row[0]
+    boards = [conn] + list(others)
+    above = sum(_count_above(board, key, points) for board in boards)
+    total = sum(_count(board, 'SELECT SUM(students) FROM leaderboard_buckets WHERE scope_key = ?', (key,))
+                for board in boards)
+    return above + 1, points, total
+
+
+def top(conn, key, limit=DEFAULT_TOP_N):
+    """The best `limit` students of a leaderboard with competition ranks"""
+    leaders = []
+    previous = None
+    for position, (student_id, points, first_name, last_name, grade, school_name) in enumerate(conn.execute('''
+        SELECT e.student_id, e.points, s.first_name, s.last_name, s.grade, s.school_name
+        FROM leaderboard_entries e
+        JOIN students s ON s.id = e.student_id
+        WHERE e.scope_key = ?
+        ORDER BY e.points DESC, e.student_id
+        LIMIT ?
+    ''', (key, limit)), start=1):
+        if previous is None or points != previous[1]:
+            previous = (position, points)
+        leaders.append({
+            'rank': previous[0],
+            'student_id': student_id,
+            # Students are minors; boards show first names and an initial only
+            'name': f"{first_name} {last_name[:1]}.".strip() if last_name else first_name,
+            'grade': grade,
+            'school_name': school_name,
+            'points': points,
+        })
+    return leaders
+
+
+def merge_top(boards, limit=DEFAULT_TOP_N):
+    """One top list from the top() lists of the shards a leaderboard is spread over"""
+    leaders = sorted((dict(leader) for board in boards for leader in board),
+                     key=lambda leader: (-leader['points'], leader['student_id']))[:limit]
+    previous = None
+    for position, leader in enumerate(leaders, start=1):
+        if previous is None or leader['points'] != previous[1]:
+            previous = (position, leader['points'])
+        leader['rank'] = previous[0]
+    return leaders
+
+
+def student_rewards(conn, student_id):
+    """Points and streaks of a student"""
+    row = conn.execute('''
+        SELECT points, current_streak, best_streak, last_active_day FROM student_rewards
+        WHERE student_id = ?
+    ''', (student_id,)).fetchone()
+    if row is None:
+        return {'points': 0, 'current_streak': 0, 'best_streak': 0, 'last_active_day': None}
+    return {'points': row[0], 'current_streak': row[1], 'best_streak': row[2], 'last_active_day': row[3]}
+
+
+def _awarded_at(item):
+    # ingest imports this module, so its timestamp helpers are imported late
+    from ingest import format_timestamp, parse_timestamp
+
+    if item.get('awarded_at'):
+        awarded_at = parse_timestamp(item['awarded_at'])
+        if awarded_at is None:
+            raise AchievementValidationError('awarded_at must be an ISO 8601 date and time')
+        return format_timestamp(awarded_at)
+    timestamp = item.get('timestamp')
+    if timestamp is None:
+        return format_timestamp(datetime.datetime.now())
+    if isinstance(timestamp, bool) or not isinstance(timestamp, (int, float)) or timestamp < 0:
+        raise AchievementValidationError('timestamp must be Date.now() milliseconds')
+    try:
+        return format_timestamp(datetime.datetime.fromtimestamp(timestamp / 1000))
+    except (OverflowError, ValueError, OSError):
+        raise AchievementValidationError('timestamp is out of range')
+
+
+def validate_achievement(item):
+    """Normalise one achievement posted by db_sync.js into an achievements row (without student_id)"""
+    if not isinstance(item, dict):
+        raise AchievementValidationError('achievement must be an object')
+    name = item.get('badge_name') or item.get('name')
+    if not isinstance(name, str) or not name.strip():
+        raise AchievementValidationError('badge_name is required')
+    if len(name) > MAX_BADGE_NAME_LENGTH:
+        raise AchievementValidationError(f'badge_name is longer than {MAX_BADGE_NAME_LENGTH} characters')
+    if name.strip().casefold() in RESERVED_BADGE_NAMES:
+        raise AchievementValidationError(f'{name.strip()} is awarded by the server')
+    optional = []
+    for field, alias in (('badge_type', 'type'), ('description', None), ('icon_path', 'icon')):
+        value = item.get(field) or (item.get(alias) if alias else None)
+        if value is not None and not isinstance(value, str):
+            raise AchievementValidationError(f'{field} must be a string')
+        optional.append(value[:500] if value else None)
+    badge_type, description, icon_path = optional
+    return name.strip(), badge_type or CLIENT_BADGE_TYPE, description, icon_path, _awarded_at(item)
+
+
+def store_achievements(conn, student_id, items):
+    """Validate and insert client achievements in one transaction
+
+    A badge a student already holds is reported as 'duplicate', so retried
+    syncs are harmless. Returns one result per item, in order.
+    """
+    results = [None] * len(items)
+    candidates = []
+    for index, item in enumerate(items):
+        try:
+            candidates.append((index, validate_achievement(item)))
+        except AchievementValidationError as e:
+            results[index] = {'index': index, 'status': 'rejected', 'error': str(e)}
+
+    if candidates:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            held = {r[0] for r in conn.execute('SELECT badge_name FROM achievements WHERE student_id = ?',
+                                               (student_id,))}
+            accepted = []
+            for index, row in candidates:
+                status = 'duplicate' if row[0] in held else 'accepted'
+                if status == 'accepted':
+                    held.add(row[0])
+                    accepted.append(row)
+                results[index] = {'index': index, 'badge_name': row[0], 'status': status}
+            conn.executemany(INSERT_ACHIEVEMENT_SQL, [(student_id,) + row for row in accepted])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return results
@@ -0,0 +1,431 @@
+"""Time-bucketed teacher analytics over game logs
+
+Every game_logs insert adds its score to daily and weekly buckets per school,
+grade and subject, and to the same buckets of the school's district, in the
+same transaction (like the dashboard rollups). Trend and district queries
+read only these buckets, never game_logs, so a district report costs the same
+after a year of logs as after a week.
+
+Each insert also bumps a version counter of the school and its district in
+analytics_versions. ResultCache keeps computed responses per worker keyed by
+their filters and serves them only while those versions are unchanged, so a
+new log from any worker invalidates exactly the cached results it affects.
+"""
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+from school_search import decode_cursor, encode_cursor
+
+PERIODS = ('day', 'week')
+DEFAULT_TREND_DAYS = {'day': 30, 'week': 182}
+MAX_TREND_DAYS = 731
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+STUDENT_PAGE_COLUMNS = ('id', 'first_name', 'last_name', 'grade', 'school_name', 'district',
+                        'total_games', 'avg_score', 'last_activity')
+# A student counts as active with a game in this many days
+ACTIVE_DAYS = 7
+# Explicit school lists in one district rollup
+MAX_UDISE_CODES = 1000
+
+DEFAULT_CACHE_ENTRIES = 2000
+DEFAULT_CACHE_TTL_SECONDS = 600
+
+UPSERT_BUCKET_SQL = '''
+    INSERT INTO activity_buckets
+    (scope, scope_key, period, bucket_start, grade, subject, attempts, score_pct_sum, time_spent)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (scope, scope_key, period, bucket_start, grade, subject) DO UPDATE SET
+        attempts = attempts + excluded.attempts,
+        score_pct_sum = score_pct_sum + excluded.score_pct_sum,
+        time_spent = time_spent + excluded.time_spent
+'''
+
+BUMP_VERSION_SQL = '''
+    INSERT INTO analytics_versions (scope_key, version) VALUES (?, 1)
+    ON CONFLICT (scope_key) DO UPDATE SET version = version + 1
+'''
+
+# Same location lookup as the backfill below: the district of a student's
+# school comes from the UDISE register, falling back to the student's own
+STUDENT_LOCATION_SQL = '''
+    SELECT s.udise_code, COALESCE(u.district, s.district) FROM students s
+    LEFT JOIN udise_schools u ON u.udise_code = s.udise_code
+    WHERE s.id = ?
+'''
+
+
+def school_key(udise_code):
+    return f'school:{udise_code}'
+
+
+def district_key(district):
+    return f'district:{district}'
+
+
+def bucket_starts(played_at):
+    """(day, week) bucket dates of a played_at timestamp, or None if unparseable"""
+    try:
+        day = datetime.date.fromisoformat(str(played_at)[:10])
+    except ValueError:
+        return None
+    # Weeks start on Monday, as in the SQL backfill
+    return day.isoformat(), (day - datetime.timedelta(days=day.weekday())).isoformat()
+
+
+def bump_versions(conn, keys):
+    """Invalidate cached results that depend on any of these version keys"""
+    conn.executemany(BUMP_VERSION_SQL, [(key,) for key in keys])
+
+
+def apply_log_analytics(conn, student_id, rows):
+    """Fold newly inserted game_logs rows into the activity buckets
+
+    rows are validated tuples as produced by ingest.validate_log(). The
+    caller owns the transaction. Rows whose played_at is not a date are
+    left out of the buckets.
+    """
+    if not rows:
+        return
+    location = conn.execute(STUDENT_LOCATION_SQL, (student_id,)).fetchone()
+    if location is None or location[0] is None:
+        return
+    udise_code, district = location
+
+    buckets = {}
+    for subject, grade, _game_id, _game_type, _level, score, max_score, time_spent, played_at, _client_id in rows:
+        starts = bucket_starts(played_at)
+        if starts is None:
+            continue
+        for period, start in zip(PERIODS, starts):
+            totals = buckets.setdefault((period, start, grade, subject), [0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += score * 100.0 / max_score
+            totals[2] += time_spent or 0
+
+    scopes = [('school', udise_code)]
+    if district:
+        scopes.append(('district', district))
+    conn.executemany(UPSERT_BUCKET_SQL, [
+        (scope, scope_key, period, start, grade, subject, attempts, pct_sum, spent)
+        for scope, scope_key in scopes
+        for (period, start, grade, subject), (attempts, pct_sum, spent) in buckets.items()
+    ])
+    bump_versions(conn, [school_key(udise_code)] + ([district_key(district)] if district else []))
+
+
+def recompute_analytics(conn, source='game_logs'):
+    """Rebuild every activity bucket from game_logs (or a view including archived logs)"""
+    conn.execute('DELETE FROM activity_buckets')
+    for period, start_sql in (
+        ('day', "date(substr(gl.played_at, 1, 10))"),
+        ('week', "date(substr(gl.played_at, 1, 10), 'weekday 0', '-6 days')"),
+    ):
+        for scope, key_sql in (
+            ('school', 's.udise_code'),
+            ('district', 'COALESCE(u.district, s.district)'),
+        ):
+            conn.execute(f'''
+                INSERT INTO activity_buckets
+                (scope, scope_key, period, bucket_start, grade, subject, attempts, score_pct_sum, time_spent)
+                SELECT '{scope}', {key_sql}, '{period}', {start_sql}, gl.grade, gl.subject,
+                       COUNT(*), SUM(gl.score * 100.0 / gl.max_score), SUM(COALESCE(gl.time_spent, 0))
+                FROM {source} gl
+                JOIN students s ON gl.student_id = s.id
+                LEFT JOIN udise_schools u ON u.udise_code = s.udise_code
+                WHERE {start_sql} IS NOT NULL AND {key_sql} IS NOT NULL
+                GROUP BY 2, 4, 5, 6
+            ''')
+    # Any result cached before the rebuild is stale
+    conn.execute('UPDATE analytics_versions SET version = version + 1')
+    return conn.execute("SELECT COUNT(DISTINCT scope_key) FROM activity_buckets WHERE scope = 'school'").fetchone()[0]
+
+
+def rebuild_analytics(conn, source='game_logs'):
+    """Recompute the activity buckets from game_logs in one transaction"""
+    with conn:
+        return recompute_analytics(conn, source)
+
+
+def school_district(conn, udise_code, fallback=None):
+    """District of a school in the UDISE register, or fallback if it is not listed"""
+    row = conn.execute('SELECT district FROM udise_schools WHERE udise_code = ?', (udise_code,)).fetchone()
+    return row[0] if row is not None else fallback
+
+
+def schools_in_district(conn, district, udise_codes):
+    """The given UDISE codes that belong to a district, in input order"""
+    codes = list(dict.fromkeys(udise_codes))
+    if len(codes) > MAX_UDISE_CODES:
+        raise ValueError(f'At most {MAX_UDISE_CODES} UDISE codes per request')
+    found = set()
+    for start in range(0, len(codes), 500):
+        chunk = codes[start:start + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        found.update(row[0] for row in conn.execute(f'''
+            SELECT udise_code FROM udise_schools
+            WHERE district = ? AND udise_code IN ({placeholders})
+        ''', [district] + chunk))
+    return [code for code in codes if code in found]
+
+
+def _date_range(period, since, until):
+    if period not in PERIODS:
+        raise ValueError(f'period must be one of {", ".join(PERIODS)}')
+    try:
+        until_date = datetime.date.fromisoformat(until) if until else datetime.date.today()
+        since_date = (datetime.date.fromisoformat(since) if since
+                      else until_date - datetime.timedelta(days=DEFAULT_TREND_DAYS[period]))
+    except ValueError:
+        raise ValueError('since and until must be dates (YYYY-MM-DD)')
+    if since_date > until_date:
+        raise ValueError('since must not be after until')
+    if (until_date - since_date).days > MAX_TREND_DAYS:
+        raise ValueError(f'At most {MAX_TREND_DAYS} days per request')
+    if period == 'week':
+        since_date -= datetime.timedelta(days=since_date.weekday())
+    return since_date.isoformat(), until_date.isoformat()
+
+
+def trend_totals(conn, scope, scope_keys, period='week', since=None, until=None, grade=None, subject=None):
+    """(bucket_start, subject, attempts, score_pct_sum, time_spent) rows summed over scope_keys
+
+    The raw sums behind trends(); a report over several shards adds up the
+    rows of each with merge_trends().
+    """
+    since, until = _date_range(period, since, until)
+    keys = list(scope_keys)
+    if not keys:
+        return []
+    placeholders = ', '.join('?' * len(keys))
+    sql = f'''
+        SELECT bucket_start, subject, SUM(attempts), SUM(score_pct_sum), SUM(time_spent)
+        FROM activity_buckets
+        WHERE scope = ? AND scope_key IN ({placeholders}) AND period = ?
+          AND bucket_start BETWEEN ? AND ?
+    '''
+    params = [scope] + keys + [period, since, until]
+    if grade is not None:
+        sql += ' AND grade = ?'
+        params.append(grade)
+    if subject:
+        sql += ' AND subject = ?'
+        params.append(subject)
+    sql += ' GROUP BY bucket_start, subject ORDER BY bucket_start, subject'
+    return [tuple(r) for r in conn.execute(sql, params)]
+
+
+def merge_trends(parts):
+    """trends() entries from the trend_totals() rows of one or more shards"""
+    totals = {}
+    for rows in parts:
+        for bucket_start, subject, attempts, pct_sum, spent in rows:
+            entry = totals.setdefault((bucket_start, subject), [0, 0.0, 0])
+            entry[0] += attempts
+            entry[1] += pct_sum
+            entry[2] += spent
+    return [
+        {'bucket_start': bucket_start, 'subject': subject, 'attempts': attempts,
+         'avg_score': round(pct_sum / attempts, 2), 'time_spent': spent}
+        for (bucket_start, subject), (attempts, pct_sum, spent) in sorted(totals.items())
+    ]
+
+
+def trends(conn, scope, scope_keys, period='week', since=None, until=None, grade=None, subject=None):
+    """Attempts and average score per bucket and subject, summed over scope_keys
+
+    scope is 'school' (scope_keys are UDISE codes) or 'district'.
+    """
+    return merge_trends([trend_totals(conn, scope, scope_keys, period, since, until, grade, subject)])
+
+
+def district_school_totals(conn, district, period='week', since=None, until=None):
+    """(udise_code, school_name, block, attempts, score_pct_sum, time_spent) of a district's schools
+
+    CROSS JOIN keeps udise_schools as the outer loop, so the buckets are read
+    by primary key for the district's schools only.
+    """
+    since, until = _date_range(period, since, until)
+    return [tuple(r) for r in conn.execute('''
+        SELECT u.udise_code, u.school_name, u.block,
+               SUM(b.attempts), SUM(b.score_pct_sum), SUM(b.time_spent)
+        FROM udise_schools u
+        CROSS JOIN activity_buckets b
+          ON b.scope = 'school' AND b.scope_key = u.udise_code AND b.period = ?
+         AND b.bucket_start BETWEEN ? AND ?
+        WHERE u.district = ?
+        GROUP BY u.udise_code
+    ''', (period, since, until, district))]
+
+
+def merge_district_schools(parts):
+    """district_schools() entries from the district_school_totals() rows of one or more shards"""
+    totals = {}
+    for rows in parts:
+        for udise_code, school_name, block, attempts, pct_sum, spent in rows:
+            entry = totals.setdefault(udise_code, [school_name, block, 0, 0.0, 0])
+            entry[2] += attempts
+            entry[3] += pct_sum
+            entry[4] += spent
+    ranked = sorted(totals.items(), key=lambda item: (-item[1][2], item[0]))
+    return [
+        {'udise_code': udise_code, 'school_name': school_name, 'block': block, 'attempts': attempts,
+         'avg_score': round(pct_sum / attempts, 2), 'time_spent': spent}
+        for udise_code, (school_name, block, attempts, pct_sum, spent) in ranked
+    ]
+
+
+def district_schools(conn, district, period='week', since=None, until=None):
+    """Per-school totals of a district over a date range, busiest schools first"""
+    return merge_district_schools([district_school_totals(conn, district, period, since, until)])
+
+
+def school_summary(conn, udise_code, grade=None, today=None):
+    """Student count, active students and average score of a school from the rollups"""
+    today = today or datetime.date.today()
+    active_since = (today - datetime.timedelta(days=ACTIVE_DAYS)).isoformat()
+    # Upper bound so an unparseable played_at (sorting after digits) is not "active"
+    active_until = (today + datetime.timedelta(days=1)).isoformat() + ' 99'
+    sql = '''
+        SELECT COUNT(*), SUM(st.last_activity >= ? AND st.last_activity <= ?),
+               AVG(st.score_pct_sum / st.total_games)
+        FROM students s
+        LEFT JOIN student_stats st ON st.student_id = s.id
+        WHERE s.udise_code = ?
+    '''
+    params = [active_since, active_until, udise_code]
+    if grade is not None:
+        sql += ' AND s.grade = ?'
+        params.append(grade)
+    total, active, avg_score = conn.execute(sql, params).fetchone()
+    return {
+        'total_students': total,
+        'active_students': active or 0,
+        'active_days': ACTIVE_DAYS,
+        'avg_score': round(avg_score, 2) if avg_score is not None else None,
+    }
+
+
+def student_page_rows(conn, udise_code, grade=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """One page of a school's students ordered by grade and name
+
+    Returns (rows, next_cursor) with rows as tuples of STUDENT_PAGE_COLUMNS;
+    the cursor is the (grade, first_name, id) of the last row, so every page
+    is an index range scan.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    sql = '''
+        SELECT s.id, s.first_name, s.last_name, s.grade, s.school_name, s.district,
+               COALESCE(st.total_games, 0), st.score_pct_sum / st.total_games, st.last_activity
+        FROM students s
+        LEFT JOIN student_stats st ON st.student_id = s.id
+        WHERE s.udise_code = ?
+    '''
+    params = [udise_code]
+    if grade is not None:
+        sql += ' AND s.grade = ?'
+        params.append(grade)
+    if cursor:
+        after = decode_cursor(cursor)
+        if len(after) != 3:
+            raise ValueError('Invalid cursor')
+        sql += ' AND (s.grade, s.first_name, s.id) > (?, ?, ?)'
+        params.extend(after)
+    sql += ' ORDER BY s.grade, s.first_name, s.id LIMIT ?'
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][3], rows[-1][1], rows[-1][0]])
+    return [tuple(r) for r in rows], next_cursor
+
+
+def student_page(conn, udise_code, grade=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """student_page_rows() with each student as a dict"""
+    rows, next_cursor = student_page_rows(conn, udise_code, grade, cursor, limit)
+    return [dict(zip(STUDENT_PAGE_COLUMNS, row)) for row in rows], next_cursor
+
+
+def subject_performance(conn, udise_code, grade=None):
+    """Average score and attempts per subject of a school from the rollups"""
+    sql = '''
+        SELECT subject, SUM(score_pct_sum) / SUM(total_attempts), SUM(total_attempts)
+        FROM school_subject_stats
+        WHERE udise_code = ?
+    '''
+    params = [udise_code]
+    if grade is not None:
+        sql += ' AND grade = ?'
+        params.append(grade)
+    sql += ' GROUP BY subject'
+    return [{'subject': r[0], 'avg_score': r[1], 'total_attempts': r[2]}
+            for r in conn.execute(sql, params)]
+
+
+def current_versions(conn, keys):
+    """Version of each key; keys never written to are at version 0"""
+    keys = sorted(set(keys))
+    placeholders = ', '.join('?' * len(keys))
+    found = dict(conn.execute(
+        f'SELECT scope_key, version FROM analytics_versions WHERE scope_key IN ({placeholders})', keys
+    ).fetchall())
+    return tuple(found.get(key, 0) for key in keys)
+
+
+class ResultCache:
+    """Per-worker LRU of analytics results, valid while their version keys are unchanged
+
+    The TTL only bounds how long an entry lives; freshness comes from the
+    versions, which are read on every lookup (one primary-key query).
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES, ttl=DEFAULT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0}
+
+    def get(self, conn, key, version_keys, compute):
+        """Cached result of compute() for key, recomputed when any version moved
+
+        conn may also be a list of connections, one per shard the result
+        was computed from; the versions of every shard must be unchanged.
+        """
+        if isinstance(conn, (list, tuple)):
+            versions = tuple(v for shard_conn in conn for v in current_versions(shard_conn, version_keys))
+        else:
+            versions = current_versions(conn, version_keys)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == versions and entry[1] > now:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[2]
+            self._stats['stale' if entry is not None else 'misses'] += 1
+        result = compute()
+        with self._lock:
+            self._entries[key] = (versions, now + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Snapshot of cache counters for monitoring"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        stats['max_entries'] = self.max_entries
+        stats['ttl'] = self.ttl
+        return stats
@@ -1,30 +1,306 @@
-from flask import Flask, jsonify, request, render_template, session, redirect, url_for
+from flask import Flask, jsonify, request, render_template, session, redirect, url_for, g, Response, send_file
 from flask_cors import CORS
-import sqlite3
-import hashlib
-import secrets
+from jinja2 import pass_context
+from werkzeug.http import unquote_etag
 import datetime
-import json
+import functools
+import gzip
+import hashlib
+import hmac
+import itertools
 import os
+import re
+import sqlite3
+
+import achievements
+import analytics
+import change_feed
+import cold_storage
+from database import DB_PATH, SCHEMA_VERSION, connect, prepare_database
+from db_pool import ConnectionPool
+from game_catalog import GameCatalog, serve_entry
+from game_manifest import GameManifests, bundle_response, parse_have
+from identity_cache import IdentityCache, load_profile
+from ingest import MAX_SYNC_BATCH, LogValidationError, ingest_logs, summarize, validate_log
+from instrumentation import Instrumentation, StartupTimer, profiler_from_env
+from localization import DEFAULT_FRAGMENT_CACHE_SIZE, FragmentCache, LocaleCatalog
+import mastery
+import otp_store
+import reports
+import response_codec
+import sharding
+from write_behind import QueueFull, queue_from_env
+import school_search
+import sync_codec
+import udise_index
 
 app = Flask(__name__)
 app.secret_key = 'shiksha-leap-secret-key-2024'
+# jsonify() through orjson when installed, compact stdlib JSON otherwise
+app.json = response_codec.JSONProvider(app)
 CORS(app)
 
+# Cold start phases up to readiness; cache warmup stops after the budget
+startup = StartupTimer(budget=float(os.environ.get('SHIKSHA_WARMUP_BUDGET_SECONDS', '20')))
+
+# Bring the schema up to date (and load the UDISE register into a new
+# database) before serving; a no-op once done, whichever process did it
+with startup.phase('database'):
+    prepare_database(DB_PATH, os.environ.get('SHIKSHA_UDISE_CSV', 'a.csv') or None)
+
+db_pool = ConnectionPool(DB_PATH)
+# Student data lives in shard files when SHIKSHA_SHARD_DIR is set; otherwise
+# every shard name below is None, meaning the main database
+shards = sharding.shards_from_env(DB_PATH)
+
+with startup.phase('game_catalog'):
+    game_catalog = GameCatalog(
+        os.path.join(app.root_path, 'games'),
+        poll_interval=float(os.environ.get('GAME_CATALOG_POLL_SECONDS', '2'))
+    )
+    game_catalog.reload()
+    game_manifests = GameManifests(game_catalog)
+
+# Locale files are read once and frozen; page parts that only vary by grade
+# and language are rendered once per content version
+with startup.phase('locales'):
+    locales = LocaleCatalog(os.path.join(app.root_path, 'static', 'locales')).load()
+fragment_cache = FragmentCache(
+    max_entries=int(os.environ.get('FRAGMENT_CACHE_SIZE', DEFAULT_FRAGMENT_CACHE_SIZE))
+)
+
+@pass_context
+def translate(context, key, default=None):
+    """Jinja t(key): the message for the page's lang, English when it has none"""
+    return locales.translate(context.get('lang'), key, default)
+
+app.jinja_env.globals['t'] = translate
+
+instrumentation = Instrumentation(app, profiler=profiler_from_env())
+# Registered after instrumentation so it runs first and the response size
+# metrics count bytes on the wire
+compressor = response_codec.compressor_from_env()
+compressor.init_app(app)
+instrumentation.metrics.gauge(
+    'shiksha_json_encoding', 'JSON response encoding counters for this worker',
+    lambda: {k: v for k, v in app.json.stats().items() if k != 'encoder'},
+    labels=('stat',))
+instrumentation.metrics.gauge(
+    'shiksha_compression', 'Response compression counters for this worker',
+    lambda: {k: v for k, v in compressor.stats().items() if k not in ('encodings', 'min_bytes')},
+    labels=('stat',))
+POOL_GAUGE_STATS = ('created', 'reused', 'rollbacks', 'discarded', 'open')
+instrumentation.metrics.gauge(
+    'shiksha_db_pool', 'Connection pool counters for this worker',
+    lambda: {k: v for k, v in db_pool.stats().items() if k in POOL_GAUGE_STATS},
+    labels=('stat',))
+instrumentation.metrics.gauge(
+    'shiksha_shards', 'Shard routing and scatter-gather counters for this worker',
+    lambda: {k: v for k, v in shards.stats().items()
+             if k in ('reloads', 'gathers', 'gathered_in_processes', 'routes', 'epoch')},
+    labels=('stat',))
+instrumentation.metrics.gauge(
+    'shiksha_game_catalog_files', 'Game files loaded in memory', lambda: game_catalog.stats()['files'])
+
+write_commit_seconds = instrumentation.metrics.histogram(
+    'shiksha_write_behind_commit_seconds', 'Group commit latency of the game log writer')
+write_batch_size = instrumentation.metrics.histogram(
+    'shiksha_write_behind_batch_size', 'Game logs per group commit',
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+# Long-polling /api/sync/changes requests wait here for logs stored by this worker
+change_notifier = change_feed.notifier_from_env()
+instrumentation.metrics.gauge(
+    'shiksha_change_feed', 'Change feed long-poll counters for this worker',
+    lambda: {k: v for k, v in change_notifier.stats().items() if k != 'max_waiters'},
+    labels=('stat',))
+
+def _observe_group_commit(size, seconds):
+    write_commit_seconds.observe((), seconds)
+    write_batch_size.observe((), size)
+    change_notifier.notify()
+
+# /api/game-log enqueues here; SHIKSHA_WRITE_BEHIND=0 writes synchronously instead
+game_log_queue = queue_from_env(DB_PATH, on_commit=_observe_group_commit,
+                                shards=shards if shards.enabled else None)
+if game_log_queue is not None:
+    WRITE_QUEUE_GAUGE_STATS = ('depth', 'pending', 'submitted', 'committed', 'duplicates',
+                               'rejected_full', 'replayed', 'dropped', 'commit_retries', 'rerouted')
+    instrumentation.metrics.gauge(
+        'shiksha_write_behind', 'Game log write queue counters for this worker',
+        lambda: {k: v for k, v in game_log_queue.stats().items() if k in WRITE_QUEUE_GAUGE_STATS},
+        labels=('stat',))
+
+def load_identity(conn, role, user_id):
+    """Profile plus the shard holding the student's data, or their school's for a teacher"""
+    if not shards.enabled:
+        return load_profile(conn, role, user_id)
+    if role == 'student':
+        student_id, shard = shards.user_shard(conn, user_id)
+        if student_id is None:
+            return None
+        profile = load_profile(get_shard_connection(shard), role, user_id)
+    else:
+        profile = load_profile(conn, role, user_id)
+        if profile is not None:
+            shard = shards.shard_for(profile['udise_code'],
+                                     analytics.school_district(conn, profile['udise_code'], profile['district']))
+    if profile is not None:
+        profile['shard'] = shard
+    return profile
+
+identity_cache = IdentityCache(
+    max_entries=int(os.environ.get('IDENTITY_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('IDENTITY_CACHE_TTL_SECONDS', '300')),
+    loader=load_identity
+)
+
+instrumentation.metrics.gauge(
+    'shiksha_identity_cache', 'Identity cache counters for this worker',
+    lambda: {k: v for k, v in identity_cache.stats().items() if k not in ('max_entries', 'ttl')},
+    labels=('stat',))
+
+analytics_cache = analytics.ResultCache(
+    max_entries=int(os.environ.get('ANALYTICS_CACHE_SIZE', '2000')),
+    ttl=float(os.environ.get('ANALYTICS_CACHE_TTL_SECONDS', '600'))
+)
+instrumentation.metrics.gauge(
+    'shiksha_analytics_cache', 'Analytics result cache counters for this worker',
+    lambda: {k: v for k, v in analytics_cache.stats().items() if k not in ('max_entries', 'ttl')},
+    labels=('stat',))
+instrumentation.metrics.gauge(
+    'shiksha_fragment_cache', 'Rendered page fragment cache counters for this worker',
+    lambda: {k: v for k, v in fragment_cache.stats().items() if k != 'max_entries'},
+    labels=('stat',))
+
+# UDISE code lookups; loaded during warmup so preloaded workers share it copy-on-write
+udise_lookup = udise_index.UdiseIndex(
+    poll_interval=float(os.environ.get('UDISE_INDEX_POLL_SECONDS', udise_index.DEFAULT_POLL_SECONDS))
+)
+instrumentation.metrics.gauge(
+    'shiksha_udise_index', 'UDISE lookup index size and counters for this worker',
+    lambda: {k: v for k, v in udise_lookup.stats().items() if k in ('loads', 'lookups', 'hits', 'schools', 'bytes')},
+    labels=('stat',))
+
+otps = otp_store.store_from_env(app.secret_key, DB_PATH)
+instrumentation.metrics.gauge(
+    'shiksha_otp', 'OTP issue/verify counters for this worker',
+    lambda: otps.stats(), labels=('stat',))
+
+# Old game logs move to archive files; SHIKSHA_ARCHIVE_INTERVAL_HOURS runs it in every worker
+# (one archiver per shard, each with the shard's own archive catalog)
+cold_stores = {
+    name: cold_storage.storage_from_env(shards.path(name), None if name is None else DB_PATH)
+    for name in shards.names()
+}
+
+# Large report exports run in background threads; their state is shared through the main database
+export_jobs = reports.jobs_from_env(DB_PATH)
+EXPORT_STREAM_MAX_ROWS = int(os.environ.get('SHIKSHA_EXPORT_STREAM_MAX_ROWS', reports.DEFAULT_STREAM_MAX_ROWS))
+instrumentation.metrics.gauge(
+    'shiksha_export_jobs', 'Background report export counters for this worker',
+    lambda: {k: v for k, v in export_jobs.stats().items() if k != 'workers'},
+    labels=('stat',))
+
+@app.before_request
+def start_archiver():
+    for store in cold_stores.values():
+        store.ensure_archiver()
+
+@app.before_request
+def follow_shard_moves():
+    """Pick up routes changed by a shard split; cached profiles may point at the old shard"""
+    if shards.enabled and shards.poll(get_db_connection()):
+        identity_cache.clear()
+        analytics_cache.clear()
+
 def get_db_connection():
-    """Get database connection with row factory"""
-    conn = sqlite3.connect('shiksha_leap.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get this request's pooled database connection with row factory"""
+    if 'db' not in g:
+        g.db = instrumentation.wrap(db_pool.acquire())
+    return g.db
+
+def get_shard_connection(shard):
+    """This request's pooled connection to a shard; the main database for None"""
+    if shard is None:
+        return get_db_connection()
+    if 'shard_dbs' not in g:
+        g.shard_dbs = {}
+    if shard not in g.shard_dbs:
+        g.shard_dbs[shard] = instrumentation.wrap(shards.pool(shard).acquire())
+    return g.shard_dbs[shard]
+
+# Operational endpoints (every *-stats route and metrics) answer a bearer
+# token when one is configured, otherwise only direct loopback requests
+OPS_TOKEN = os.environ.get('SHIKSHA_OPS_TOKEN') or None
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')
+
+def ops_denied():
+    """403 unless the request may read operational endpoints, else None"""
+    if OPS_TOKEN is not None:
+        supplied = request.headers.get('Authorization', '').encode()
+        if hmac.compare_digest(supplied, f'Bearer {OPS_TOKEN}'.encode()):
+            return None
+    elif (request.remote_addr in LOOPBACK_ADDRESSES
+          and 'X-Forwarded-For' not in request.headers and 'Forwarded' not in request.headers):
+        # A reverse proxy on the same host would also connect from loopback
+        return None
+    return jsonify({'error': 'Not authorized'}), 403
+
+def ops_only(view):
+    """Route decorator answering ops_denied() before the view; for every stats route"""
+    @functools.wraps(view)
+    def guarded(*args, **kwargs):
+        denied = ops_denied()
+        if denied:
+            return denied
+        return view(*args, **kwargs)
+    return guarded
+
+def shard_unavailable():
+    """503 for a write that reached a shard the student has just moved away from"""
+    identity_cache.invalidate(session['user_id'])
+    shards.poll(get_db_connection(), force=True)
+    response = jsonify({'error': 'Student data is being moved, please retry'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def current_profile(role):
+    """Cached student or teacher profile of the logged-in user, or None"""
+    return identity_cache.get(role, session['user_id'], get_db_connection)
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    """Return the request's connection to the pool"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.close()
+    for shard_conn in g.pop('shard_dbs', {}).values():
+        shard_conn.close()
+
+def render_fragment(template, grade, lang, **context):
+    """Render a template that depends only on grade and language, once per content version"""
+    key = (template, grade, lang, locales.version, game_catalog.current_version())
+    return fragment_cache.get(
+        key, lambda: render_template(template, grade=grade, lang=lang, **context))
+
+def grade_subjects(grade):
+    """Subjects of a grade's catalog games with their game counts, in catalog order"""
+    counts = {}
+    for entry in game_catalog.entries(grade):
+        subject = entry.data['subject']
+        counts[subject] = counts.get(subject, 0) + 1
+    return [
+        {'id': subject.lower().replace(' ', '_'), 'name': subject, 'gameCount': count}
+        for subject, count in counts.items()
+    ]
+
+app.jinja_env.globals['grade_subjects'] = grade_subjects
 
 def hash_password(password):
     """Hash password using SHA-256"""
     return hashlib.sha256(password.encode()).hexdigest()
 
-def generate_otp():
-    """Generate 6-digit OTP"""
-    return str(secrets.randbelow(900000) + 100000)
-
 def send_otp(contact, otp):
     """Mock OTP sending - in production, integrate with SMS/Email service"""
     print(f"OTP for {contact}: {otp}")
@@ -57,15 +333,15 @@ def student_dashboard():
     if 'user_id' not in session or session.get('role') != 'student':
         return redirect(url_for('index'))
     
-    conn = get_db_connection()
-    student = conn.execute('''
-        SELECT s.*, u.email FROM students s 
-        JOIN users u ON s.user_id = u.id 
-        WHERE s.user_id = ?
-    ''', (session['user_id'],)).fetchone()
-    conn.close()
+    student = current_profile('student')
+    if not student:
+        # Logged in but registration was never completed
+        return redirect(url_for('registration'))
+    lang = locales.language_for(request, student)
+    sections = render_fragment('fragments/student_dashboard_sections.html', student['grade'], lang,
+                               student_grade=student['grade'])
     
-    return render_template('student_dashboard.html', student=student)
+    return render_template('student_dashboard.html', student=student, lang=lang, sections=sections)
 
 @app.route('/student/grade/<int:grade>')
 def grade_view(grade):
@@ -73,7 +349,9 @@ def grade_view(grade):
     if 'user_id' not in session or session.get('role') != 'student':
         return redirect(url_for('index'))
     
-    return render_template('grade_view.html', grade=grade)
+    # The whole page is the same for every student of a grade and language
+    lang = locales.language_for(request, current_profile('student'))
+    return render_fragment('grade_view.html', grade, lang)
 
 @app.route('/game/<path:game_path>')
 def game_player(game_path):
@@ -85,17 +363,51 @@ def game_player(game_path):
 
 @app.route('/games/grade_<int:grade>/<game_file>')
 def serve_game_file(grade, game_file):
-    """Serve game JSON files"""
-    try:
-        game_file_path = f'games/grade_{grade}/{game_file}'
-        if os.path.exists(game_file_path):
-            with open(game_file_path, 'r', encoding='utf-8') as f:
-                game_data = json.load(f)
-            return jsonify(game_data)
-        else:
-            return jsonify({'error': 'Game not found'}), 404
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    """Serve game JSON files from the in-memory catalog"""
+    entry = game_catalog.get(grade, game_file)
+    if entry is None:
+        return jsonify({'error': 'Game not found'}), 404
+    return game_catalog.serve(entry, request)
+
+@app.route('/api/games/manifest/<int:grade>')
+def game_manifest(grade):
+    """List a grade's games with content hashes and sizes"""
+    manifest = game_manifests.manifest(grade, request.args.get('medium') or None)
+    response = jsonify(manifest)
+    response.set_etag(manifest['version'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/games/bundle/<int:grade>')
+def game_bundle(grade):
+    """All of a grade's game JSONs in one compressed response"""
+    version, _, body, _ = game_manifests.bundle(grade, request.args.get('medium') or None)
+    return bundle_response(request, version, body)
+
+@app.route('/api/games/delta/<int:grade>', methods=['GET', 'POST'])
+def game_bundle_delta(grade):
+    """Only the games that differ from the client's {file: hash} map"""
+    medium = request.args.get('medium') or None
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            have = parse_have(data.get('have'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        version, since, body, _ = game_manifests.bundle(grade, medium, have=have)
+    else:
+        # A version alone only tells whether anything changed
+        version, since, body, _ = game_manifests.bundle(grade, medium, request.args.get('since') or None)
+    return bundle_response(request, version, body, since)
+
+@app.route('/api/locales')
+def locale_bundle():
+    """Every locale merged into one document with content hashes, or one with ?lang="""
+    lang = request.args.get('lang') or None
+    bundle = locales.bundle(lang)
+    if bundle is None:
+        return jsonify({'error': f'Unknown language {lang}'}), 404
+    return serve_entry(bundle, request)
 
 @app.route('/quiz/<path:quiz_path>')
 def quiz_player(quiz_path):
@@ -111,20 +423,21 @@ def student_profile():
     if 'user_id' not in session or session.get('role') != 'student':
         return redirect(url_for('index'))
     
-    conn = get_db_connection()
-    student = conn.execute('''
-        SELECT s.*, u.email FROM students s 
-        JOIN users u ON s.user_id = u.id 
-        WHERE s.user_id = ?
-    ''', (session['user_id'],)).fetchone()
+    student = current_profile('student')
+    if not student:
+        return redirect(url_for('registration'))
     
+    conn = get_shard_connection(student.get('shard'))
     achievements = conn.execute('''
         SELECT * FROM achievements WHERE student_id = ? ORDER BY awarded_at DESC
     ''', (student['id'],)).fetchall()
     
     conn.close()
     
-    return render_template('profile.html', student=student, achievements=achievements)
+    lang = locales.language_for(request, student)
+    sections = render_fragment('fragments/profile_sections.html', None, lang)
+    return render_template('profile.html', student=student, achievements=achievements,
+                           lang=lang, sections=sections)
 
 @app.route('/teacher/dashboard')
 def teacher_dashboard():
@@ -132,13 +445,7 @@ def teacher_dashboard():
     if 'user_id' not in session or session.get('role') != 'teacher':
         return redirect(url_for('index'))
     
-    conn = get_db_connection()
-    teacher = conn.execute('''
-        SELECT t.*, u.email FROM teachers t 
-        JOIN users u ON t.user_id = u.id 
-        WHERE t.user_id = ?
-    ''', (session['user_id'],)).fetchone()
-    conn.close()
+    teacher = current_profile('teacher')
     
     return render_template('teacher_dashboard.html', teacher=teacher)
 
@@ -153,19 +460,15 @@ def send_otp_api():
     if not contact:
         return jsonify({'error': 'Contact is required'}), 400
     
-    # Generate OTP
-    otp = generate_otp()
-    otp_hash = hash_password(otp)
-    expires_at = datetime.datetime.now() + datetime.timedelta(minutes=10)
-    
-    # Store OTP in database
     conn = get_db_connection()
-    conn.execute('''
-        INSERT INTO otp_verifications (contact, otp_code, otp_hash, expires_at)
-        VALUES (?, ?, ?, ?)
-    ''', (contact, otp, otp_hash, expires_at))
-    conn.commit()
-    conn.close()
+    try:
+        otp = otps.issue(conn, contact, request.remote_addr)
+    except otp_store.RateLimited as e:
+        response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    finally:
+        conn.close()
     
     # Send OTP (mock implementation)
     if send_otp(contact, otp):
@@ -185,20 +488,15 @@ def verify_otp_api():
     
     conn = get_db_connection()
     
-    # Verify OTP
-    otp_record = conn.execute('''
-        SELECT * FROM otp_verifications 
-        WHERE contact = ? AND otp_code = ? AND expires_at > ? AND verified = 0
-        ORDER BY created_at DESC LIMIT 1
-    ''', (contact, otp, datetime.datetime.now())).fetchone()
-    
-    if not otp_record:
+    # Verify OTP; a code works once
+    status = otps.verify(conn, contact, otp)
+    if status == otp_store.TOO_MANY_ATTEMPTS:
+        conn.close()
+        return jsonify({'error': 'Too many wrong attempts, request a new OTP'}), 429
+    if status != otp_store.VERIFIED:
         conn.close()
         return jsonify({'error': 'Invalid or expired OTP'}), 400
     
-    # Mark OTP as verified
-    conn.execute('UPDATE otp_verifications SET verified = 1 WHERE id = ?', (otp_record['id'],))
-    
     # Check if user exists
     user = conn.execute('SELECT * FROM users WHERE email = ? OR mobile = ?', (contact, contact)).fetchone()
     
@@ -207,6 +505,8 @@ def verify_otp_api():
         session['user_id'] = user['id']
         session['role'] = user['role']
         conn.commit()
+        # Resolve the profile now so the first requests after login skip the lookup
+        identity_cache.refresh(conn, user['role'], user['id'])
         conn.close()
         
         if user['role'] == 'student':
@@ -238,34 +538,75 @@ def verify_otp_api():
 @app.route('/api/school-info/<udise_code>')
 def get_school_info(udise_code):
     """Get school information by UDISE code"""
-    conn = get_db_connection()
-    school = conn.execute('''
-        SELECT * FROM udise_schools WHERE udise_code = ?
-    ''', (udise_code,)).fetchone()
-    conn.close()
+    udise_lookup.refresh(get_db_connection())
+    school = udise_lookup.get(udise_code)
     
     if school:
-        return jsonify(dict(school))
+        return jsonify(school)
     else:
         return jsonify({'error': 'UDISE code not found'}), 404
 
+@app.route('/api/schools/resolve', methods=['GET', 'POST'])
+def resolve_schools():
+    """Schools of many UDISE codes at once: ?codes=a,b,c or {"udise_codes": [...]}"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        codes = data.get('udise_codes')
+        if not isinstance(codes, list):
+            return jsonify({'error': 'udise_codes must be a list'}), 400
+    else:
+        codes = [code for code in request.args.get('codes', '').split(',') if code.strip()]
+    if len(codes) > udise_index.MAX_RESOLVE_CODES:
+        return jsonify({'error': f'At most {udise_index.MAX_RESOLVE_CODES} codes per request'}), 400
+    
+    udise_lookup.refresh(get_db_connection())
+    rows = udise_lookup.resolve_rows(codes)
+    missing = [code for code in dict.fromkeys(str(code).strip() for code in codes) if code not in rows]
+    
+    if response_codec.wants_table():
+        schools = response_codec.table(udise_index.COLUMNS, rows.values())
+    else:
+        schools = response_codec.records(udise_index.COLUMNS, rows.values())
+    return jsonify({'schools': schools, 'missing': missing})
+
 @app.route('/api/school-search')
 def search_schools():
-    """Search schools by name or UDISE code"""
+    """Search schools by name or UDISE code; a list of schools, or a table with ?shape=table"""
     query = request.args.get('q', '').strip()
     
-    if len(query) < 3:
-        return jsonify([])
-    
     conn = get_db_connection()
-    schools = conn.execute('''
-        SELECT * FROM udise_schools 
-        WHERE udise_code LIKE ? OR school_name LIKE ? OR district LIKE ?
-        LIMIT 20
-    ''', (f'%{query}%', f'%{query}%', f'%{query}%')).fetchall()
+    rows, _ = school_search.search_school_rows(conn, query)
     conn.close()
     
-    return jsonify([dict(school) for school in schools])
+    if response_codec.wants_table():
+        return jsonify(response_codec.table(school_search.SCHOOL_COLUMNS, rows))
+    return jsonify(response_codec.records(school_search.SCHOOL_COLUMNS, rows))
+
+@app.route('/api/schools/search')
+def search_schools_paged():
+    """Ranked school search with district/block filters and keyset pagination"""
+    query = request.args.get('q', '').strip()
+    
+    conn = get_db_connection()
+    try:
+        rows, next_cursor = school_search.search_school_rows(
+            conn,
+            query,
+            district=request.args.get('district'),
+            block=request.args.get('block'),
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', school_search.DEFAULT_LIMIT, type=int)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    
+    if response_codec.wants_table():
+        schools = response_codec.table(school_search.SCHOOL_COLUMNS, rows)
+    else:
+        schools = response_codec.records(school_search.SCHOOL_COLUMNS, rows)
+    return jsonify({'schools': schools, 'next_cursor': next_cursor})
 
 @app.route('/api/register-student', methods=['POST'])
 def register_student():
@@ -276,11 +617,19 @@ def register_student():
     data = request.get_json()
     
     conn = get_db_connection()
-    conn.execute('''
+    # With sharding the directory assigns the id and picks the school's shard
+    student_id, shard = shards.place_student(conn, session['user_id'], data['udise_code'], data['district'])
+    # Update user role if needed
+    conn.execute('UPDATE users SET role = ? WHERE id = ?', ('student', session['user_id']))
+    conn.commit()
+    
+    shard_conn = get_shard_connection(shard)
+    shard_conn.execute('''
         INSERT INTO students 
-        (user_id, first_name, last_name, dob, grade, school_name, district, state, udise_code, medium)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        (id, user_id, first_name, last_name, dob, grade, school_name, district, state, udise_code, medium)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (
+        student_id,
         session['user_id'],
         data['first_name'],
         data['last_name'],
@@ -293,10 +642,12 @@ def register_student():
         data['medium']
     ))
     
-    # Update user role if needed
-    conn.execute('UPDATE users SET role = ? WHERE id = ?', ('student', session['user_id']))
+    # The school's cached student lists no longer include everyone
+    analytics.bump_versions(shard_conn, [analytics.school_key(data['udise_code'])])
     
-    conn.commit()
+    shard_conn.commit()
+    identity_cache.invalidate(session['user_id'])
+    identity_cache.refresh(conn, 'student', session['user_id'])
     conn.close()
     
     session['role'] = 'student'
@@ -334,6 +685,8 @@ def register_teacher():
     conn.execute('UPDATE users SET role = ? WHERE id = ?', ('teacher', session['user_id']))
     
     conn.commit()
+    identity_cache.invalidate(session['user_id'])
+    identity_cache.refresh(conn, 'teacher', session['user_id'])
     conn.close()
     
     session['role'] = 'teacher'
@@ -343,58 +696,365 @@ def register_teacher():
 
 @app.route('/api/teacher/dashboard-data')
 def teacher_dashboard_data():
-    """Get teacher dashboard data"""
+    """Get teacher dashboard data: school summary and one page of students
+
+    With ?shape=table students come as {'columns': [...], 'rows': [[...]]}.
+    """
+    if 'user_id' not in session or session.get('role') != 'teacher':
+        return jsonify({'error': 'Not authorized'}), 403
+    
+    grade = request.args.get('grade', type=int)
+    cursor = request.args.get('cursor') or None
+    limit = request.args.get('limit', analytics.DEFAULT_PAGE_SIZE, type=int)
+    
+    teacher = current_profile('teacher')
+    if not teacher:
+        return jsonify({'error': 'Teacher not found'}), 404
+    
+    udise_code = teacher['udise_code']
+    conn = get_shard_connection(teacher.get('shard'))
+    
+    def compute():
+        rows, next_cursor = analytics.student_page_rows(conn, udise_code, grade, cursor, limit)
+        return {
+            'students': response_codec.table(analytics.STUDENT_PAGE_COLUMNS, rows),
+            'next_cursor': next_cursor,
+            'summary': analytics.school_summary(conn, udise_code, grade),
+            'subject_performance': analytics.subject_performance(conn, udise_code, grade),
+        }
+    
+    try:
+        data = analytics_cache.get(
+            conn, ('dashboard', udise_code, grade, cursor, limit),
+            [analytics.school_key(udise_code)], compute
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    
+    students = data['students']
+    if not response_codec.wants_table():
+        students = response_codec.records(students['columns'], students['rows'])
+    return jsonify(dict(data, students=students, teacher=dict(teacher)))
+
+def _analytics_scope(conn, teacher):
+    """(scope, keys, district) for an analytics request of a teacher
+
+    Teachers see their own school, their school's district, or any list of
+    schools within that district (udise_codes=a,b,c).
+    """
+    district = analytics.school_district(conn, teacher['udise_code'], teacher['district'])
+    scope = request.args.get('scope', 'school')
+    if scope == 'school':
+        codes = request.args.get('udise_codes')
+        if not codes:
+            return 'school', [teacher['udise_code']], district
+        codes = [c.strip() for c in codes.split(',') if c.strip()]
+        schools = analytics.schools_in_district(conn, district, codes)
+        if len(schools) != len(set(codes)):
+            raise PermissionError('UDISE codes must belong to your district')
+        return 'school', schools, district
+    if scope == 'district':
+        requested = request.args.get('district')
+        if requested and requested != district:
+            raise PermissionError('Only your own district is available')
+        return 'district', [district], district
+    raise ValueError('scope must be school or district')
+
+def _scope_shards(scope, keys, district):
+    """Shards holding the students an analytics scope covers"""
+    if scope == 'district':
+        return shards.shards_for_district(district)
+    return tuple(sorted({shards.shard_for(code, district) for code in keys}, key=str))
+
+@app.route('/api/analytics/trends')
+def analytics_trends():
+    """Daily or weekly attempts and average score per subject from the activity buckets"""
     if 'user_id' not in session or session.get('role') != 'teacher':
         return jsonify({'error': 'Not authorized'}), 403
     
-    # Get filters
-    grade_filter = request.args.get('grade')
-    school_filter = request.args.get('school')
-    district_filter = request.args.get('district')
+    teacher = current_profile('teacher')
+    if not teacher:
+        return jsonify({'error': 'Teacher not found'}), 404
+    
+    period = request.args.get('period', 'week')
+    since = request.args.get('since') or None
+    until = request.args.get('until') or None
+    grade = request.args.get('grade', type=int)
+    subject = request.args.get('subject') or None
     
     conn = get_db_connection()
+    try:
+        scope, keys, district = _analytics_scope(conn, teacher)
+        version_keys = ([analytics.district_key(district)] if scope == 'district'
+                        else [analytics.school_key(code) for code in keys])
+        names = _scope_shards(scope, keys, district)
+        buckets = analytics_cache.get(
+            [get_shard_connection(name) for name in names],
+            ('trends', scope, tuple(keys), period, since, until, grade, subject),
+            version_keys,
+            lambda: analytics.merge_trends(shards.gather(
+                analytics.trend_totals, (scope, keys, period, since, until, grade, subject),
+                names, get_shard_connection))
+        )
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    
+    return jsonify({'scope': scope, 'keys': keys, 'period': period, 'buckets': buckets})
+
+@app.route('/api/analytics/district-schools')
+def analytics_district_schools():
+    """Per-school totals across the teacher's district from the activity buckets"""
+    if 'user_id' not in session or session.get('role') != 'teacher':
+        return jsonify({'error': 'Not authorized'}), 403
+    
+    teacher = current_profile('teacher')
+    if not teacher:
+        return jsonify({'error': 'Teacher not found'}), 404
+    
+    period = request.args.get('period', 'week')
+    since = request.args.get('since') or None
+    until = request.args.get('until') or None
+    
+    conn = get_db_connection()
+    try:
+        district = analytics.school_district(conn, teacher['udise_code'], teacher['district'])
+        names = shards.shards_for_district(district)
+        schools = analytics_cache.get(
+            [get_shard_connection(name) for name in names],
+            ('district-schools', district, period, since, until),
+            [analytics.district_key(district)],
+            lambda: analytics.merge_district_schools(shards.gather(
+                analytics.district_school_totals, (district, period, since, until),
+                names, get_shard_connection))
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    
+    return jsonify({'district': district, 'period': period, 'schools': schools})
+
+@app.route('/api/teacher/students/<int:student_id>/logs')
+def teacher_student_logs(student_id):
+    """Game logs of one student of the teacher's school, including archived ones"""
+    if 'user_id' not in session or session.get('role') != 'teacher':
+        return jsonify({'error': 'Not authorized'}), 403
+    
+    teacher = current_profile('teacher')
+    if not teacher:
+        return jsonify({'error': 'Teacher not found'}), 404
     
-    # Get teacher info
-    teacher = conn.execute('''
-        SELECT * FROM teachers WHERE user_id = ?
-    ''', (session['user_id'],)).fetchone()
-    
-    # Build query for students in same school/district
-    query = '''
-        SELECT s.id, s.first_name, s.last_name, s.grade, s.school_name, s.district,
-               COUNT(gl.id) as total_games,
-               AVG(gl.score * 100.0 / gl.max_score) as avg_score,
-               MAX(gl.played_at) as last_activity
-        FROM students s
-        LEFT JOIN game_logs gl ON s.id = gl.student_id
-        WHERE s.udise_code = ?
-    '''
-    params = [teacher['udise_code']]
-    
-    if grade_filter:
-        query += ' AND s.grade = ?'
-        params.append(grade_filter)
-    
-    query += ' GROUP BY s.id ORDER BY s.grade, s.first_name'
-    
-    students = conn.execute(query, params).fetchall()
-    
-    # Get subject-wise performance
-    subject_performance = conn.execute('''
-        SELECT gl.subject, AVG(gl.score * 100.0 / gl.max_score) as avg_score, COUNT(*) as total_attempts
-        FROM game_logs gl
-        JOIN students s ON gl.student_id = s.id
-        WHERE s.udise_code = ?
-        GROUP BY gl.subject
-    ''', (teacher['udise_code'],)).fetchall()
+    since = request.args.get('since') or None
+    until = request.args.get('until') or None
+    limit = max(1, min(request.args.get('limit', 1000, type=int), 10000))
     
+    # Students of the teacher's school are on the school's shard
+    conn = get_shard_connection(teacher.get('shard'))
+    student = conn.execute(
+        'SELECT udise_code FROM students WHERE id = ?', (student_id,)
+    ).fetchone()
+    if student is None or student['udise_code'] != teacher['udise_code']:
+        conn.close()
+        return jsonify({'error': 'Student not found'}), 404
+    
+    logs = list(itertools.islice(
+        cold_storage.query_logs(conn, cold_stores[teacher.get('shard')], student_id=student_id,
+                                since=since, until=until), limit + 1
+    ))
     conn.close()
     
-    return jsonify({
-        'students': [dict(student) for student in students],
-        'subject_performance': [dict(perf) for perf in subject_performance],
-        'teacher': dict(teacher)
-    })
+    return jsonify({'logs': logs[:limit], 'truncated': len(logs) > limit})
+
+def _export_plan(conn, teacher, scope, keys, district):
+    """[(shard, udise codes)] an export covers: the listed schools, or every school of the district"""
+    if scope == 'district':
+        codes = [row[0] for row in conn.execute(
+            'SELECT udise_code FROM udise_schools WHERE district = ? ORDER BY udise_code', (district,)
+        )]
+        # A school missing from the UDISE register still exports its own students
+        if teacher['udise_code'] not in codes:
+            codes.append(teacher['udise_code'])
+    else:
+        codes = keys
+    plan = {}
+    for code in codes:
+        plan.setdefault(shards.shard_for(code, district), []).append(code)
+    return sorted(plan.items(), key=lambda item: str(item[0]))
+
+def _export_parts(plan):
+    """(conn, cold storage, udise codes) of each shard of an export plan, on connections of its own
+
+    The export outlives the request when streamed or run as a job, so it
+    does not use the request's pooled connections.
+    """
+    for name, codes in plan:
+        conn = shards.connect(name)
+        try:
+            yield conn, cold_stores[name], codes
+        finally:
+            conn.close()
+
+def _export_request(teacher):
+    """Validated export parameters of the request with its shard plan and row estimate"""
+    report, file_format, grade, since, until = reports.export_params(request.args)
+    conn = get_db_connection()
+    scope, keys, district = _analytics_scope(conn, teacher)
+    plan = _export_plan(conn, teacher, scope, keys, district)
+    estimate = sum(reports.estimate_rows(get_shard_connection(name), report, codes, grade) for name, codes in plan)
+    if file_format == 'xlsx' and estimate >= reports.XLSX_MAX_ROWS:
+        raise ValueError(f'About {estimate} rows do not fit in one worksheet, export as CSV')
+    label = keys[0] if scope == 'school' and len(keys) == 1 else ('schools' if scope == 'school' else district)
+    label = re.sub(r'[^A-Za-z0-9_-]+', '_', str(label)).strip('_') or scope
+    extension = 'xlsx' if file_format == 'xlsx' else 'csv'
+    return {
+        'report': report, 'format': file_format, 'grade': grade, 'since': since, 'until': until,
+        'district': district, 'plan': plan, 'estimate': estimate,
+        'download_name': f'{report}-{label}-{datetime.date.today().isoformat()}.{extension}',
+    }
+
+def _export_chunks(export, progress=None):
+    rows = reports.export_rows(export['report'], _export_parts(export['plan']), export['district'],
+                               export['grade'], export['since'], export['until'])
+    if progress is not None:
+        rows = reports.counted(rows, progress)
+    return reports.file_chunks(reports.REPORT_COLUMNS[export['report']], rows, export['format'])
+
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+@app.route('/api/reports/export')
+def export_report():
+    """Stream a students, subjects or games report of the teacher's scope as CSV or XLSX"""
+    if 'user_id' not in session or session.get('role') != 'teacher':
+        return jsonify({'error': 'Not authorized'}), 403
+    
+    teacher = current_profile('teacher')
+    if not teacher:
+        return jsonify({'error': 'Teacher not found'}), 404
+    
+    try:
+        export = _export_request(teacher)
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if export['estimate'] > EXPORT_STREAM_MAX_ROWS:
+        return jsonify({
+            'error': 'This export is too large to download directly, start an export job instead',
+            'rows_estimate': export['estimate'],
+            'jobs_url': url_for('start_export_job'),
+        }), 413
+    
+    chunks = _export_chunks(export)
+    # XLSX is a zip file already
+    compress = export['format'] == 'csv' and bool(request.accept_encodings['gzip'])
+    response = Response(reports.gzip_chunks(chunks) if compress else chunks,
+                        mimetype=EXPORT_MIMETYPES[export['format']])
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.headers['Content-Disposition'] = f'attachment; filename="{export["download_name"]}"'
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Rows-Estimate'] = str(export['estimate'])
+    return response
+
+def _job_view(job):
+    view = {k: v for k, v in job.items() if k not in ('file_name', 'updated_at')}
+    view['status_url'] = url_for('export_job_status', job_id=job['id'])
+    if job['status'] == 'done':
+        view['download_url'] = url_for('download_export', job_id=job['id'])
+    return view
+
+@app.route('/api/reports/jobs', methods=['POST'])
+def start_export_job():
+    """Run an export in the background; same parameters as /api/reports/export"""
+    if 'user_id' not in session or session.get('role') != 'teacher':
+        return jsonify({'error': 'Not authorized'}), 403
+    
+    teacher = current_profile('teacher')
+    if not teacher:
+        return jsonify({'error': 'Teacher not found'}), 404
+    
+    try:
+        export = _export_request(teacher)
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def produce(progress):
+        chunks = _export_chunks(export, progress)
+        # CSV files are kept gzipped and sent as they are to clients accepting gzip
+        return chunks if export['format'] == 'xlsx' else reports.gzip_chunks(chunks)
+    
+    job = export_jobs.submit(get_db_connection(), session['user_id'], export['report'], export['format'],
+                             export['download_name'], export['estimate'], produce)
+    if job is None:
+        response = jsonify({'error': 'Too many exports in progress, wait for one to finish'})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+    
+    response = jsonify(_job_view(job))
+    response.headers['Location'] = url_for('export_job_status', job_id=job['id'])
+    return response, 202
+
+@app.route('/api/reports/jobs/<job_id>')
+def export_job_status(job_id):
+    """Progress of a background export of the logged-in teacher"""
+    if 'user_id' not in session or session.get('role') != 'teacher':
+        return jsonify({'error': 'Not authorized'}), 403
+    
+    job = export_jobs.get(get_db_connection(), job_id, session['user_id'])
+    if job is None:
+        return jsonify({'error': 'Export not found'}), 404
+    response = jsonify(_job_view(job))
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/reports/jobs/<job_id>/download')
+def download_export(job_id):
+    """File of a finished background export"""
+    if 'user_id' not in session or session.get('role') != 'teacher':
+        return jsonify({'error': 'Not authorized'}), 403
+    
+    job = export_jobs.get(get_db_connection(), job_id, session['user_id'])
+    if job is None:
+        return jsonify({'error': 'Export not found'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': f"Export is {job['status']}", 'progress': job['progress']}), 409
+    path = export_jobs.path(job['file_name'])
+    if not os.path.exists(path):
+        return jsonify({'error': 'Export has expired'}), 410
+    
+    mimetype = EXPORT_MIMETYPES[job['format']]
+    if job['format'] == 'xlsx':
+        return send_file(os.path.abspath(path), mimetype=mimetype, as_attachment=True,
+                         download_name=job['download_name'])
+    if request.accept_encodings['gzip']:
+        response = send_file(os.path.abspath(path), mimetype=mimetype, as_attachment=True,
+                             download_name=job['download_name'])
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        def decompressed():
+            with gzip.open(path, 'rb') as source:
+                while True:
+                    chunk = source.read(reports.CHUNK_BYTES)
+                    if not chunk:
+                        return
+                    yield chunk
+        response = Response(decompressed(), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{job["download_name"]}"'
+    response.vary.add('Accept-Encoding')
+    return response
 
 @app.route('/api/game-log', methods=['POST'])
 def log_game_performance():
@@ -402,81 +1062,412 @@ def log_game_performance():
     if 'user_id' not in session or session.get('role') != 'student':
         return jsonify({'error': 'Not authorized'}), 403
     
-    data = request.get_json()
-    
-    conn = get_db_connection()
+    data = request.get_json(silent=True) or {}
     
-    # Get student ID
-    student = conn.execute('SELECT id FROM students WHERE user_id = ?', (session['user_id'],)).fetchone()
+    student = current_profile('student')
     if not student:
-        conn.close()
         return jsonify({'error': 'Student not found'}), 404
     
-    # Log the performance
-    conn.execute('''
-        INSERT INTO game_logs 
-        (student_id, subject, grade, game_id, game_type, level, score, max_score, time_spent, synced)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
-    ''', (
-        student['id'],
-        data['subject'],
-        data['grade'],
-        data['game_id'],
-        data.get('game_type', 'game'),
-        data.get('level', 'medium'),
-        data['score'],
-        data['max_score'],
-        data.get('time_spent', 0)
-    ))
-    
-    conn.commit()
-    conn.close()
+    if game_log_queue is None:
+        conn = get_shard_connection(student.get('shard'))
+        try:
+            result = ingest_logs(conn, student['id'], [data])[0]
+        except sqlite3.IntegrityError as e:
+            if not sharding.is_fence_error(e):
+                raise
+            return shard_unavailable()
+        finally:
+            conn.close()
+        if result['status'] == 'rejected':
+            return jsonify({'error': result['error']}), 400
+        change_notifier.notify()
+        return jsonify({'message': 'Performance logged successfully'})
+
+    # Validate now, write in the next group commit
+    try:
+        row = validate_log(data)
+    except LogValidationError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        game_log_queue.submit(student['id'], row, student.get('shard'))
+    except QueueFull:
+        response = jsonify({'error': 'Server busy, please retry'})
+        response.headers['Retry-After'] = '2'
+        return response, 503
+
+    return jsonify({'message': 'Performance logged successfully'}), 202
+
+# Columnar uploads are inserted block by block, so they may carry more logs
+MAX_COLUMNAR_SYNC_LOGS = 20000
+
+def _sync_columnar(student_id, shard):
+    """Decode a columnar upload block by block, one transaction per block
+
+    Only the indexes of rejected logs are returned; every other log up to
+    `received` is stored. Logs past MAX_COLUMNAR_SYNC_LOGS are not read and
+    stay on the device for the next sync.
+    """
+    counts = {'accepted': 0, 'duplicate': 0, 'rejected': 0}
+    rejected = []
+    received = 0
+    conn = get_shard_connection(shard)
+    try:
+        for logs in sync_codec.iter_blocks(request.stream, request.headers.get('Content-Encoding')):
+            if received + len(logs) > MAX_COLUMNAR_SYNC_LOGS:
+                break
+            for result in ingest_logs(conn, student_id, logs):
+                counts[result['status']] += 1
+                if result['status'] == 'rejected':
+                    rejected.append({'index': received + result['index'], 'error': result['error']})
+            received += len(logs)
+    except sync_codec.SyncFormatError as e:
+        return jsonify({'error': str(e), 'received': received}), 400
+    except sqlite3.IntegrityError as e:
+        if not sharding.is_fence_error(e):
+            raise
+        return shard_unavailable()
+    finally:
+        conn.close()
+    if counts['accepted']:
+        change_notifier.notify()
     
-    return jsonify({'message': 'Performance logged successfully'})
+    return jsonify({
+        'message': f'Synced {counts["accepted"]} logs successfully',
+        'received': received,
+        'accepted': counts['accepted'],
+        'duplicates': counts['duplicate'],
+        'rejected': counts['rejected'],
+        'rejected_logs': rejected
+    })
 
 @app.route('/api/sync-offline-data', methods=['POST'])
 def sync_offline_data():
-    """Sync offline game logs"""
+    """Sync a batch of offline game logs, sent as JSON or in the columnar encoding"""
     if 'user_id' not in session or session.get('role') != 'student':
         return jsonify({'error': 'Not authorized'}), 403
     
-    data = request.get_json()
+    if request.mimetype == sync_codec.COLUMNAR_CONTENT_TYPE:
+        student = current_profile('student')
+        if not student:
+            return jsonify({'error': 'Student not found'}), 404
+        return _sync_columnar(student['id'], student.get('shard'))
+    
+    data = request.get_json(silent=True) or {}
     logs = data.get('logs', [])
     
-    conn = get_db_connection()
-    student = conn.execute('SELECT id FROM students WHERE user_id = ?', (session['user_id'],)).fetchone()
+    if not isinstance(logs, list):
+        return jsonify({'error': 'logs must be a list'}), 400
+    if len(logs) > MAX_SYNC_BATCH:
+        return jsonify({'error': f'At most {MAX_SYNC_BATCH} logs per sync'}), 413
     
+    student = current_profile('student')
     if not student:
+        return jsonify({'error': 'Student not found'}), 404
+    
+    conn = get_shard_connection(student.get('shard'))
+    try:
+        results = ingest_logs(conn, student['id'], logs)
+    except sqlite3.IntegrityError as e:
+        if not sharding.is_fence_error(e):
+            raise
+        return shard_unavailable()
+    finally:
         conn.close()
+    
+    counts = summarize(results)
+    if counts['accepted']:
+        change_notifier.notify()
+    return jsonify({
+        'message': f'Synced {counts["accepted"]} logs successfully',
+        'accepted': counts['accepted'],
+        'duplicates': counts['duplicate'],
+        'rejected': counts['rejected'],
+        'results': results
+    })
+
+@app.route('/api/sync/changes')
+def sync_changes():
+    """Game logs, badges and mastery of the student changed since a cursor, optionally waiting for some
+
+    The cursor comes from the previous response (`cursor`, or the ETag sent
+    back as If-None-Match). With nothing new after `wait` seconds the answer
+    is 304; Retry-After is set when the worker could not hold the request.
+    """
+    if 'user_id' not in session or session.get('role') != 'student':
+        return jsonify({'error': 'Not authorized'}), 403
+    
+    student = current_profile('student')
+    if not student:
         return jsonify({'error': 'Student not found'}), 404
     
-    synced_count = 0
-    for log in logs:
-        try:
-            conn.execute('''
-                INSERT INTO game_logs 
-                (student_id, subject, grade, game_id, game_type, level, score, max_score, time_spent, played_at, synced)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
-            ''', (
-                student['id'],
-                log['subject'],
-                log['grade'],
-                log['game_id'],
-                log.get('game_type', 'game'),
-                log.get('level', 'medium'),
-                log['score'],
-                log['max_score'],
-                log.get('time_spent', 0),
-                log.get('played_at', datetime.datetime.now())
-            ))
-            synced_count += 1
-        except Exception as e:
-            print(f"Error syncing log: {e}")
+    # The ETag is weak (W/"...") when the response was compressed
+    cursor = request.args.get('cursor') or unquote_etag(request.headers.get('If-None-Match', ''))[0]
+    limit = min(max(request.args.get('limit', change_feed.DEFAULT_PAGE_SIZE, type=int), 1),
+                change_feed.MAX_PAGE_SIZE)
+    wait = min(max(request.args.get('wait', 0, type=float), 0), change_feed.MAX_WAIT_SECONDS)
+    database = student.get('shard') or 'main'
     
-    conn.commit()
+    conn = get_shard_connection(student.get('shard'))
+    try:
+        positions, reset = change_feed.start_positions(conn, database, student['id'], cursor)
+    except change_feed.CursorError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if cursor and not reset and not change_feed.has_changes(conn, student['id'], positions):
+        found = False
+        if wait:
+            found = change_notifier.wait_for(lambda: change_feed.has_changes(conn, student['id'], positions), wait)
+        if not found:
+            response = Response(status=304)
+            response.headers['ETag'] = f'"{cursor}"'
+            response.headers['Cache-Control'] = 'no-store'
+            if found is None:
+                response.headers['Retry-After'] = str(max(1, int(change_notifier.poll_interval)))
+            return response
+    
+    changes, positions, has_more = change_feed.read_changes(conn, student['id'], positions, limit)
+    next_cursor = change_feed.encode_cursor(database, student['id'], positions)
+    response = jsonify({
+        'cursor': next_cursor,
+        'student_id': student['id'],
+        'reset': reset,
+        'has_more': has_more,
+        'changes': changes
+    })
+    response.headers['ETag'] = f'"{next_cursor}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/db/pool-stats')
+@ops_only
+def db_pool_stats():
+    """Connection pool statistics for this worker, with one pool per shard in use"""
+    stats = db_pool.stats()
+    if shards.enabled:
+        stats['shards'] = {name: pool.stats() for name, pool in shards.pools().items()}
+    return jsonify(stats)
+
+@app.route('/api/db/shard-stats')
+@ops_only
+def shard_stats():
+    """Shard registry, routes and scatter-gather counters for this worker"""
+    return jsonify(shards.stats())
+
+@app.route('/api/student/mastery')
+def student_mastery():
+    """Mastery per game for the logged-in student and the game to play next"""
+    if 'user_id' not in session or session.get('role') != 'student':
+        return jsonify({'error': 'Not authorized'}), 403
+    
+    student = current_profile('student')
+    if not student:
+        return jsonify({'error': 'Student not found'}), 404
+    
+    grade = request.args.get('grade', student['grade'], type=int)
+    subject = request.args.get('subject') or None
+    
+    conn = get_shard_connection(student.get('shard'))
+    progress = mastery.student_mastery(conn, student['id'], grade, subject)
+    conn.close()
+    
+    return jsonify({
+        'grade': grade,
+        'subject': subject,
+        'topics': progress,
+        'recommended': mastery.recommend_game(game_catalog.entries(grade), progress, subject)
+    })
+
+@app.route('/api/achievements', methods=['GET', 'POST'])
+def student_achievements():
+    """List the student's badges and points, or store badges synced from the device"""
+    if 'user_id' not in session or session.get('role') != 'student':
+        return jsonify({'error': 'Not authorized'}), 403
+    
+    student = current_profile('student')
+    if not student:
+        return jsonify({'error': 'Student not found'}), 404
+    
+    conn = get_shard_connection(student.get('shard'))
+    if request.method == 'GET':
+        badges = [dict(row) for row in conn.execute('''
+            SELECT badge_name, badge_type, description, icon_path, awarded_at
+            FROM achievements WHERE student_id = ? ORDER BY awarded_at DESC
+        ''', (student['id'],))]
+        rewards = achievements.student_rewards(conn, student['id'])
+        conn.close()
+        return jsonify(dict(rewards, achievements=badges))
+    
+    # One achievement as saved by db_sync.js, or {"achievements": [...]}
+    data = request.get_json(silent=True)
+    items = data.get('achievements') if isinstance(data, dict) and 'achievements' in data else [data]
+    if not isinstance(items, list):
+        return jsonify({'error': 'achievements must be a list'}), 400
+    if len(items) > achievements.MAX_ACHIEVEMENT_BATCH:
+        return jsonify({'error': f'At most {achievements.MAX_ACHIEVEMENT_BATCH} achievements per sync'}), 413
+    
+    try:
+        results = achievements.store_achievements(conn, student['id'], items)
+    except sqlite3.IntegrityError as e:
+        if not sharding.is_fence_error(e):
+            raise
+        return shard_unavailable()
+    finally:
+        conn.close()
+    
+    counts = summarize(results)
+    if counts['accepted']:
+        change_notifier.notify()
+    return jsonify({
+        'accepted': counts['accepted'],
+        'duplicates': counts['duplicate'],
+        'rejected': counts['rejected'],
+        'results': results
+    })
+
+@app.route('/api/leaderboard')
+def leaderboard():
+    """Top students of the caller's school, district or grade, and the student's own rank"""
+    role = session.get('role')
+    if 'user_id' not in session or role not in ('student', 'teacher'):
+        return jsonify({'error': 'Not authorized'}), 403
+    
+    profile = current_profile(role)
+    if not profile:
+        return jsonify({'error': 'Profile not found'}), 404
+    
+    scope = request.args.get('scope', 'school')
+    limit = min(max(request.args.get('limit', achievements.DEFAULT_TOP_N, type=int), 1),
+                achievements.MAX_TOP_N)
+    
+    conn = get_db_connection()
+    # Shards holding the board's students; a school is on one shard
+    if scope == 'school':
+        value = profile['udise_code']
+        names = (profile.get('shard'),)
+    elif scope == 'district':
+        value = analytics.school_district(conn, profile['udise_code'], profile['district'])
+        names = shards.shards_for_district(value)
+    elif scope == 'grade':
+        # Teachers pick the grade; students see their own
+        value = profile['grade'] if role == 'student' else request.args.get('grade', type=int)
+        if value is None:
+            return jsonify({'error': 'grade is required'}), 400
+        names = shards.names()
+    else:
+        return jsonify({'error': 'scope must be school, district or grade'}), 400
+    
+    key = achievements.scope_key(scope, value)
+    boards = [get_shard_connection(name) for name in names]
+    if len(boards) == 1:
+        leaders = achievements.top(boards[0], key, limit)
+    else:
+        leaders = achievements.merge_top([achievements.top(board, key, limit) for board in boards], limit)
+    body = {'scope': scope, 'key': key, 'leaders': leaders}
+    if role == 'student':
+        own = get_shard_connection(profile.get('shard'))
+        position = achievements.rank(own, key, profile['id'], [board for board in boards if board is not own])
+        body['me'] = None if position is None else {
+            'rank': position[0], 'points': position[1], 'out_of': position[2]
+        }
     conn.close()
     
-    return jsonify({'message': f'Synced {synced_count} logs successfully'})
+    return jsonify(body)
+
+@app.route('/api/identity-cache-stats')
+@ops_only
+def identity_cache_stats():
+    """Identity cache hit rate and size for this worker"""
+    return jsonify(identity_cache.stats())
+
+@app.route('/api/analytics/cache-stats')
+@ops_only
+def analytics_cache_stats():
+    """Analytics result cache hit rate and size for this worker"""
+    return jsonify(analytics_cache.stats())
+
+@app.route('/api/db/archive-stats')
+@ops_only
+def archive_stats():
+    """Archived game log totals and this worker's archiving counters, over every shard"""
+    # A district split across shards lists its files in each shard's catalog
+    partitions = {}
+    hot = 0
+    for name in shards.names():
+        conn = get_shard_connection(name)
+        for row in conn.execute('''
+            SELECT path, row_count, bytes, min_played_at, max_played_at FROM archive_partitions
+        '''):
+            partitions[row[0]] = tuple(row[1:])
+        # Kept by triggers on game_logs; COUNT(*) would scan the whole table
+        hot += conn.execute(
+            "SELECT row_count FROM table_row_counts WHERE table_name = 'game_logs'"
+        ).fetchone()[0]
+        conn.close()
+    stores = list(cold_stores.values())
+    counters = stores[0].stats()
+    for store in stores[1:]:
+        for stat, value in store.stats().items():
+            if stat in ('runs', 'archived', 'files', 'conflicts'):
+                counters[stat] += value
+            elif stat == 'last_run_seconds':
+                counters[stat] = max(counters[stat], value)
+    return jsonify(dict(counters, files=len(partitions),
+                        archived_rows=sum(p[0] for p in partitions.values()),
+                        archived_bytes=sum(p[1] for p in partitions.values()),
+                        oldest=min((p[2] for p in partitions.values()), default=None),
+                        newest=max((p[3] for p in partitions.values()), default=None), hot_rows=hot))
+
+@app.route('/api/db/write-queue-stats')
+@ops_only
+def write_queue_stats():
+    """Game log write-behind queue statistics for this worker"""
+    if game_log_queue is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(game_log_queue.stats(), enabled=True))
+
+@app.route('/metrics')
+@ops_only
+def metrics():
+    """Prometheus metrics for this worker"""
+    return Response(instrumentation.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/games/catalog-stats')
+@ops_only
+def game_catalog_stats():
+    """Game catalog size, version and load errors for this worker"""
+    return jsonify(game_catalog.stats())
+
+@app.route('/api/pages/cache-stats')
+@ops_only
+def page_cache_stats():
+    """Rendered fragment cache hit rate and the loaded locale catalogs for this worker"""
+    return jsonify({'fragments': fragment_cache.stats(), 'locales': locales.stats()})
+
+@app.route('/healthz')
+def liveness():
+    """Liveness: the worker is running and answering requests; never touches the database"""
+    return jsonify({'status': 'alive', 'pid': os.getpid(), 'uptime_seconds': round(startup.elapsed(), 1)})
+
+@app.route('/readyz')
+def readiness():
+    """Readiness: warmed up, database reachable at the current schema, write queue not full"""
+    problems = []
+    if not startup.ready:
+        problems.append('warming up')
+    for name in dict.fromkeys((None,) + shards.names()):
+        try:
+            conn = get_shard_connection(name)
+            version = conn.execute('SELECT MAX(version) FROM main.schema_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                problems.append(('' if name is None else f'{name}: ') +
+                                f'schema version {version}, expected {SCHEMA_VERSION}')
+        except sqlite3.Error as e:
+            problems.append(f'{name or "database"}: {e}')
+    if game_log_queue is not None and game_log_queue.depth() >= game_log_queue.max_queue:
+        problems.append('game log queue is full')
+
+    body = dict(startup.snapshot(), status='not ready' if problems else 'ready', problems=problems)
+    return jsonify(body), 503 if problems else 200
 
 @app.route('/logout')
 def logout():
@@ -484,11 +1475,66 @@ def logout():
     session.clear()
     return redirect(url_for('index'))
 
-if __name__ == '__main__':
-    # Initialize database if it doesn't exist
-    if not os.path.exists('shiksha_leap.db'):
-        from database import init_db, import_udise_data
-        init_db()
-        import_udise_data()
+# ==================== STARTUP ====================
+
+def _warm_udise_register():
+    """Read the school register and its search index once so first searches hit the page cache"""
+    conn = connect()
+    conn.row_factory = sqlite3.Row
+    # Interrupt the scan rather than run past the startup budget
+    conn.set_progress_handler(lambda: 1 if startup.over_budget() else 0, 100000)
+    try:
+        conn.execute('SELECT COUNT(*), MAX(school_name) FROM udise_schools').fetchone()
+        if school_search.has_search_index(conn):
+            conn.execute(f'SELECT COUNT(*) FROM {school_search.SEARCH_INDEX_TABLE}_data').fetchone()
+        school_search.search_schools(conn, 'school')
+    except sqlite3.OperationalError as e:
+        if not startup.over_budget():
+            raise
+        startup.skip(f'rest of the UDISE register ({e})')
+    finally:
+        conn.close()
+
+def _load_udise_index():
+    conn = connect()
+    try:
+        udise_lookup.load(conn)
+    finally:
+        conn.close()
+
+def warm_up():
+    """Fill caches before taking traffic; with preload_app, forked workers inherit them"""
+    grades = sorted({entry.grade for entry in game_catalog.entries()})
+    steps = [
+        ('game_bundles', lambda: [game_manifests.bundle(grade) for grade in grades]),
+        ('udise_register', _warm_udise_register),
+        ('udise_index', _load_udise_index),
+    ]
+    for name, step in steps:
+        if startup.over_budget():
+            startup.skip(name)
+            continue
+        with startup.phase(f'warm_{name}'):
+            step()
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    if startup.over_budget():
+        startup.skip('pages')
+    else:
+        with startup.phase('warm_pages'), app.test_request_context():
+            for lang in locales.languages:
+                render_fragment('fragments/profile_sections.html', None, lang)
+                for grade in range(6, 13):
+                    render_fragment('grade_view.html', grade, lang)
+                    render_fragment('fragments/student_dashboard_sections.html', grade, lang,
+                                    student_grade=grade)
+    startup.mark_ready()
+    print(f"Ready in {startup.ready_seconds}s: {startup.phases}")
+
+instrumentation.metrics.gauge(
+    'shiksha_startup_seconds', 'Cold start phase durations of this process',
+    lambda: dict(startup.phases, ready=startup.ready_seconds or 0), labels=('phase',))
+
+warm_up()
+
+if __name__ == '__main__':
+    app.run(debug=True, host='0.0.0.0', port=5000)
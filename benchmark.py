@@ -0,0 +1,770 @@
+"""Load-testing harness that replays classroom traffic against app.py
+
+Seed a synthetic database with the real schema, then drive the app either
+in-process through Flask's test client or over HTTP against gunicorn:
+
+    python benchmark.py seed --db bench.db --schools 50 --students 40 --logs 60
+    python benchmark.py run --db bench.db --scenario classroom --users 32 --duration 20 --output before.json
+    python benchmark.py run --db bench.db --mode gunicorn --workers 4 --scenario game_log_storm
+    python benchmark.py compare before.json after.json
+    python benchmark.py encode --db bench.db
+
+Results report throughput and p50/p95/p99 latency per route as JSON so runs
+can be compared across commits. Upload routes also report request bytes per
+game log (compare bulk_offline_sync with bulk_offline_sync_columnar).
+Clients send Accept-Encoding like a browser (--accept-encoding '' to turn it
+off), so response bytes are bytes on the wire; in-process runs also report
+the time spent encoding and compressing response bodies. `encode` times the
+hot payloads (dashboard page, school search, batch resolve) through each
+encoder and shape and reports their size raw and compressed.
+"""
+import argparse
+import datetime
+import gzip
+import http.cookiejar
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import sync_codec
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DISTRICTS = ['ANGUL', 'BALASORE', 'CUTTACK', 'GANJAM', 'KORAPUT', 'MALKANGIRI', 'PURI', 'SAMBALPUR']
+NAME_PARTS = ['BANDHA', 'SAHI', 'NUA', 'PADA', 'GADA', 'PUR', 'BALI', 'KHANDA', 'SATA', 'ARABA', 'DURU', 'GUDA']
+SCHOOL_SUFFIXES = ['PPS', 'UPS', 'HIGH SCHOOL', 'NPS', 'PS']
+# Fixed login code and rate limits loose enough for one client address to
+# log in a whole district; set OTP_* yourself to benchmark the limits
+BENCHMARK_OTP = '424242'
+BENCHMARK_ENV = {
+    'OTP_FIXED_CODE': BENCHMARK_OTP,
+    'OTP_CONTACT_BURST': '1000000',
+    'OTP_IP_BURST': '1000000',
+}
+# What a phone browser offers; responses are measured as sent
+DEFAULT_ACCEPT_ENCODING = 'gzip, deflate, br'
+SUBJECTS = ['English', 'Odia', 'Mathematics', 'Science', 'Social Studies']
+MEDIUMS = ['Odia', 'English', 'Hindi']
+
+
+# ==================== SEEDING ====================
+
+def _remove_database(db_path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+
+def _school_name(rng):
+    return ''.join(rng.sample(NAME_PARTS, 2)) + ' ' + rng.choice(SCHOOL_SUFFIXES)
+
+
+def _game_log_row(rng, student_id, grade, now):
+    max_score = rng.choice([10, 20, 50, 100])
+    played_at = now - datetime.timedelta(minutes=rng.randint(0, 90 * 24 * 60))
+    return (
+        student_id,
+        rng.choice(SUBJECTS),
+        grade,
+        f'{rng.choice(["maths", "english", "odia", "science", "social"])}_game{rng.randint(1, 2)}',
+        rng.choice(['game', 'quiz']),
+        rng.choice(['easy', 'medium', 'hard']),
+        rng.randint(0, max_score),
+        max_score,
+        rng.randint(30, 900),
+        played_at.strftime('%Y-%m-%d %H:%M:%S'),
+        str(uuid.UUID(int=rng.getrandbits(128))),
+    )
+
+
+def seed_database(db_path, schools=20, students_per_school=30, logs_per_student=40,
+                  teachers_per_school=2, seed=42):
+    """Create a fresh database with the real schema and synthetic classroom data"""
+    from database import connect, migrate
+    from rollups import rebuild_rollups
+    from school_search import rebuild_search_index
+
+    rng = random.Random(seed)
+    _remove_database(db_path)
+    migrate(db_path)
+    conn = connect(db_path)
+    started = time.perf_counter()
+
+    school_rows = []
+    for i in range(schools):
+        district = DISTRICTS[i % len(DISTRICTS)]
+        school_rows.append((
+            f'21{i:09d}', _school_name(rng), district, f'{district[:4]}BLOCK{i % 7}',
+            'Primary', 'Rural', 'Government',
+        ))
+    conn.executemany('''
+        INSERT INTO udise_schools (udise_code, school_name, district, block, category, area, management)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', school_rows)
+    rebuild_search_index(conn)
+
+    users, students, teachers = [], [], []
+    user_id = 0
+    for code, name, district, _block, *_ in school_rows:
+        for _ in range(teachers_per_school):
+            user_id += 1
+            users.append((user_id, f'teacher{user_id}@example.org', None, 'teacher'))
+            teachers.append((user_id, user_id, 'Teacher', str(user_id), '1980-01-01', 'B.Ed',
+                             name, district, 'Odisha', code, rng.choice(MEDIUMS)))
+        for _ in range(students_per_school):
+            user_id += 1
+            users.append((user_id, None, f'9{user_id:09d}', 'student'))
+            students.append((user_id, user_id, 'Student', str(user_id), '2012-01-01', rng.randint(6, 12),
+                             name, district, 'Odisha', code, rng.choice(MEDIUMS)))
+
+    conn.executemany('INSERT INTO users (id, email, mobile, role) VALUES (?, ?, ?, ?)', users)
+    conn.executemany('''
+        INSERT INTO teachers (id, user_id, first_name, last_name, dob, qualification,
+                              school_name, district, state, udise_code, medium)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', teachers)
+    conn.executemany('''
+        INSERT INTO students (id, user_id, first_name, last_name, dob, grade,
+                              school_name, district, state, udise_code, medium)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', students)
+
+    now = datetime.datetime.now()
+    log_count = 0
+    batch = []
+    for student in students:
+        for _ in range(logs_per_student):
+            batch.append(_game_log_row(rng, student[0], student[5], now))
+        if len(batch) >= 50000:
+            log_count += _insert_logs(conn, batch)
+            batch = []
+    log_count += _insert_logs(conn, batch)
+    conn.commit()
+    rebuild_rollups(conn)
+    conn.close()
+
+    return {
+        'db': db_path,
+        'schools': schools,
+        'teachers': len(teachers),
+        'students': len(students),
+        'game_logs': log_count,
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+
+def _insert_logs(conn, rows):
+    conn.executemany('''
+        INSERT INTO game_logs (student_id, subject, grade, game_id, game_type, level, score,
+                               max_score, time_spent, played_at, synced, client_log_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+    ''', rows)
+    return len(rows)
+
+
+class Fixtures:
+    """Users and schools of a seeded database that scenarios draw from"""
+
+    def __init__(self, db_path):
+        from database import connect
+        self.db_path = db_path
+        conn = connect(db_path)
+        self.students = [dict(user_id=r[0], mobile=r[1], grade=r[2]) for r in conn.execute('''
+            SELECT u.id, u.mobile, s.grade FROM users u JOIN students s ON s.user_id = u.id
+        ''')]
+        self.teachers = [dict(user_id=r[0], email=r[1]) for r in conn.execute('''
+            SELECT u.id, u.email FROM users u JOIN teachers t ON t.user_id = u.id
+        ''')]
+        self.school_names = [r[0] for r in conn.execute('SELECT school_name FROM udise_schools')]
+        self.school_codes = [r[0] for r in conn.execute('SELECT udise_code FROM udise_schools')]
+        conn.close()
+        if not self.students or not self.teachers:
+            raise SystemExit(f'{db_path} has no students/teachers; run `benchmark.py seed` first')
+
+    def login_code(self, contact):
+        """The login code; runs pin it with OTP_FIXED_CODE since only its hash is stored"""
+        return os.environ.get('OTP_FIXED_CODE', BENCHMARK_OTP)
+
+
+# ==================== CLIENTS ====================
+
+def _with_accept_encoding(headers, accept_encoding):
+    headers = dict(headers or {})
+    if accept_encoding:
+        headers.setdefault('Accept-Encoding', accept_encoding)
+    return headers
+
+
+class InProcessClient:
+    """Drives the Flask app through its test client; sessions are set directly"""
+
+    def __init__(self, app, accept_encoding=DEFAULT_ACCEPT_ENCODING):
+        self.client = app.test_client()
+        self.accept_encoding = accept_encoding
+
+    def login(self, user_id, role, contact):
+        with self.client.session_transaction() as session:
+            session['user_id'] = user_id
+            session['role'] = role
+
+    def request(self, method, path, body=None, headers=None, data=None):
+        headers = _with_accept_encoding(headers, self.accept_encoding)
+        if data is not None:
+            response = self.client.open(path, method=method, data=data, headers=headers)
+        else:
+            response = self.client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_data()
+
+
+class HttpClient:
+    """Drives a running server over HTTP with its own cookie jar"""
+
+    def __init__(self, base_url, fixtures, accept_encoding=DEFAULT_ACCEPT_ENCODING):
+        self.base_url = base_url
+        self.fixtures = fixtures
+        self.accept_encoding = accept_encoding
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def login(self, user_id, role, contact):
+        self.request('POST', '/api/send-otp', {'contact': contact})
+        otp = self.fixtures.login_code(contact)
+        self.request('POST', '/api/verify-otp', {'contact': contact, 'otp': otp})
+
+    def request(self, method, path, body=None, headers=None, data=None):
+        raw = data is not None
+        if not raw:
+            data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if data is not None and not raw:
+            req.add_header('Content-Type', 'application/json')
+        # urllib does not decode responses, so the body read is what was sent
+        for name, value in _with_accept_encoding(headers, self.accept_encoding).items():
+            req.add_header(name, value)
+        try:
+            with self.opener.open(req, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+# ==================== SCENARIOS ====================
+
+class VirtualUser:
+    """One simulated student or teacher with its own client and random stream"""
+
+    def __init__(self, client, fixtures, rng, recorder):
+        self.client = client
+        self.fixtures = fixtures
+        self.rng = rng
+        self.recorder = recorder
+        self.logged_in_as = None
+
+    def call(self, route, method, path, body=None, headers=None, data=None, logs=0):
+        """One request; data is a raw body sent instead of JSON, logs the game logs it carries"""
+        if data is not None:
+            sent = len(data)
+        else:
+            sent = len(json.dumps(body).encode()) if body is not None else 0
+        started = time.perf_counter()
+        try:
+            status, payload = self.client.request(method, path, body, headers, data)
+        except Exception:
+            status, payload = 599, b''
+        self.recorder.record(route, status, (time.perf_counter() - started) * 1000, len(payload), sent, logs)
+        return status, payload
+
+    def as_student(self):
+        if self.logged_in_as != 'student':
+            student = self.rng.choice(self.fixtures.students)
+            self.client.login(student['user_id'], 'student', student['mobile'])
+            self.student = student
+            self.logged_in_as = 'student'
+        return self.student
+
+    def as_teacher(self):
+        if self.logged_in_as != 'teacher':
+            teacher = self.rng.choice(self.fixtures.teachers)
+            self.client.login(teacher['user_id'], 'teacher', teacher['email'])
+            self.logged_in_as = 'teacher'
+
+
+def _random_log(rng, grade):
+    max_score = rng.choice([10, 20, 50, 100])
+    return {
+        'subject': rng.choice(SUBJECTS),
+        'grade': grade,
+        'game_id': f'maths_game{rng.randint(1, 2)}',
+        'game_type': rng.choice(['game', 'quiz']),
+        'level': rng.choice(['easy', 'medium', 'hard']),
+        'score': rng.randint(0, max_score),
+        'max_score': max_score,
+        'time_spent': rng.randint(30, 900),
+        'timestamp': int(time.time() * 1000) - rng.randint(0, 30 * 86400 * 1000),
+        'client_log_id': str(uuid.UUID(int=rng.getrandbits(128))),
+    }
+
+
+def otp_login_burst(vu):
+    """9am: every student requests and verifies an OTP"""
+    student = vu.rng.choice(vu.fixtures.students)
+    contact = student['mobile']
+    vu.call('send_otp', 'POST', '/api/send-otp', {'contact': contact})
+    otp = vu.fixtures.login_code(contact)
+    vu.call('verify_otp', 'POST', '/api/verify-otp', {'contact': contact, 'otp': otp})
+    vu.logged_in_as = 'student'
+    vu.student = student
+
+
+def game_log_storm(vu):
+    """End of class: everyone posts a quiz result at once"""
+    student = vu.as_student()
+    vu.call('game_log', 'POST', '/api/game-log', _random_log(vu.rng, student['grade']), logs=1)
+
+
+def bulk_offline_sync(vu, logs_per_sync=200):
+    """A student back online uploads weeks of offline play"""
+    student = vu.as_student()
+    logs = [_random_log(vu.rng, student['grade']) for _ in range(logs_per_sync)]
+    vu.call('sync_offline_data', 'POST', '/api/sync-offline-data', {'logs': logs}, logs=len(logs))
+
+
+def bulk_offline_sync_columnar(vu, logs_per_sync=200):
+    """The same upload in the gzip columnar encoding db_sync.js prefers"""
+    student = vu.as_student()
+    logs = sorted((_random_log(vu.rng, student['grade']) for _ in range(logs_per_sync)),
+                  key=lambda log: log['timestamp'])
+    vu.call('sync_offline_columnar', 'POST', '/api/sync-offline-data',
+            headers={'Content-Type': sync_codec.COLUMNAR_CONTENT_TYPE, 'Content-Encoding': 'gzip'},
+            data=sync_codec.encode_logs(logs), logs=len(logs))
+
+
+def dashboard_polling(vu):
+    """Teachers refreshing the class dashboard"""
+    vu.as_teacher()
+    grade = vu.rng.choice([None, vu.rng.randint(6, 12)])
+    path = '/api/teacher/dashboard-data?shape=table' + (f'&grade={grade}' if grade else '')
+    vu.call('teacher_dashboard', 'GET', path)
+
+
+def school_search_typing(vu):
+    """Registration form: one search per keystroke from the third character"""
+    if vu.rng.random() < 0.3:
+        text = vu.rng.choice(vu.fixtures.school_codes)[:vu.rng.randint(4, 11)]
+        vu.call('school_search', 'GET', f'/api/school-search?shape=table&q={text}')
+        return
+    name = vu.rng.choice(vu.fixtures.school_names)
+    for length in range(3, min(len(name), 10) + 1):
+        query = urllib.request.quote(name[:length])
+        vu.call('school_search', 'GET', f'/api/school-search?shape=table&q={query}')
+
+
+SCENARIOS = {
+    'otp_login_burst': [(otp_login_burst, 1)],
+    'game_log_storm': [(game_log_storm, 1)],
+    'bulk_offline_sync': [(bulk_offline_sync, 1)],
+    'bulk_offline_sync_columnar': [(bulk_offline_sync_columnar, 1)],
+    'dashboard_polling': [(dashboard_polling, 1)],
+    'school_search_typing': [(school_search_typing, 1)],
+    # A school day compressed: mostly gameplay, some logins, searches and teachers
+    'classroom': [
+        (game_log_storm, 50),
+        (otp_login_burst, 10),
+        (dashboard_polling, 15),
+        (school_search_typing, 5),
+        (bulk_offline_sync, 2),
+    ],
+}
+
+
+# ==================== ENCODING ====================
+
+def _flask_json_dumps(obj):
+    """jsonify() before response_codec: sorted keys and \\uXXXX escapes"""
+    return json.dumps(obj, sort_keys=True, separators=(',', ':')).encode()
+
+
+def encode_payloads(db_path, resolve_codes=1000):
+    """Hot response bodies of a seeded database as {name: (columns, rows)}"""
+    import analytics
+    import school_search
+    import udise_index
+    from database import connect
+
+    conn = connect(db_path)
+    udise_code = conn.execute(
+        'SELECT udise_code FROM students GROUP BY udise_code ORDER BY COUNT(*) DESC LIMIT 1'
+    ).fetchone()[0]
+    students, _ = analytics.student_page_rows(conn, udise_code, limit=analytics.MAX_PAGE_SIZE)
+    name = conn.execute('SELECT school_name FROM udise_schools ORDER BY id LIMIT 1').fetchone()[0]
+    schools, _ = school_search.search_school_rows(conn, name[:school_search.MIN_QUERY_LENGTH + 1])
+    index = udise_index.UdiseIndex().load(conn)
+    codes = [r[0] for r in conn.execute('SELECT udise_code FROM udise_schools ORDER BY id LIMIT ?',
+                                        (resolve_codes,))]
+    resolved = list(index.resolve_rows(codes).values())
+    conn.close()
+    return {
+        'dashboard_page': (analytics.STUDENT_PAGE_COLUMNS, students),
+        'school_search': (school_search.SCHOOL_COLUMNS, schools),
+        'schools_resolve': (udise_index.COLUMNS, resolved),
+    }
+
+
+def _median_seconds(call, iterations):
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        result = call()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return result, timings[len(timings) // 2]
+
+
+def run_encode(db_path, iterations=200):
+    """Encode time and size of each hot payload per shape (records/table) and encoder"""
+    import response_codec
+
+    encoders = {'flask_json': _flask_json_dumps, response_codec.encoder_name(): response_codec.dumps}
+    shapes = {'records': response_codec.records, 'table': response_codec.table}
+    results = []
+    for payload, (columns, rows) in encode_payloads(db_path).items():
+        for shape, build in shapes.items():
+            for encoder, dumps in encoders.items():
+                # Building the shape from row tuples is part of the hot path
+                body, seconds = _median_seconds(lambda: dumps(build(columns, rows)), iterations)
+                entry = {
+                    'payload': payload, 'shape': shape, 'encoder': encoder, 'rows': len(rows),
+                    'encode_us': round(seconds * 1e6, 1), 'bytes': len(body),
+                    'gzip_bytes': len(gzip.compress(body, compresslevel=response_codec.DEFAULT_GZIP_LEVEL)),
+                    'br_bytes': None,
+                }
+                if brotli is not None:
+                    entry['br_bytes'] = len(brotli.compress(body, quality=response_codec.DEFAULT_BROTLI_QUALITY))
+                results.append(entry)
+    return {
+        'commit': _git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'config': {'db': db_path, 'iterations': iterations},
+        'results': results,
+    }
+
+
+def print_encode_report(report):
+    print(f"{'payload':<18}{'shape':<9}{'encoder':<12}{'rows':>6}{'encode us':>11}"
+          f"{'bytes':>9}{'gzip':>8}{'br':>8}")
+    for r in report['results']:
+        print(f"{r['payload']:<18}{r['shape']:<9}{r['encoder']:<12}{r['rows']:>6}{r['encode_us']:>11}"
+              f"{r['bytes']:>9}{r['gzip_bytes']:>8}{r['br_bytes'] if r['br_bytes'] is not None else '-':>8}")
+
+
+# ==================== RUNNER ====================
+
+class Recorder:
+    """Thread-safe collection of per-route latency samples"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, route, status, millis, size, sent=0, logs=0):
+        with self._lock:
+            self.samples.setdefault(route, []).append((status, millis, size, sent, logs))
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize_samples(samples, elapsed):
+    routes = {}
+    for route, entries in sorted(samples.items()):
+        latencies = sorted(millis for _, millis, _, _, _ in entries)
+        errors = sum(1 for status, _, _, _, _ in entries if status >= 400)
+        sent = sum(entry[3] for entry in entries)
+        logs = sum(entry[4] for entry in entries)
+        routes[route] = {
+            'count': len(entries),
+            'errors': errors,
+            'throughput_rps': round(len(entries) / elapsed, 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'max_ms': round(latencies[-1], 3),
+            'mean_response_bytes': round(sum(entry[2] for entry in entries) / len(entries)),
+            'mean_request_bytes': round(sent / len(entries)),
+        }
+        if logs:
+            routes[route]['request_bytes_per_log'] = round(sent / logs, 1)
+    total = sum(r['count'] for r in routes.values())
+    return routes, {
+        'requests': total,
+        'errors': sum(r['errors'] for r in routes.values()),
+        'throughput_rps': round(total / elapsed, 2),
+        'seconds': round(elapsed, 2),
+    }
+
+
+def _weighted_choice(rng, mix):
+    total = sum(weight for _, weight in mix)
+    pick = rng.uniform(0, total)
+    for scenario, weight in mix:
+        pick -= weight
+        if pick <= 0:
+            return scenario
+    return mix[-1][0]
+
+
+def run_load(make_client, fixtures, scenario='classroom', users=16, duration=10.0, seed=7):
+    """Run virtual users until duration elapses; returns (routes, totals)"""
+    mix = SCENARIOS[scenario]
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        vu = VirtualUser(make_client(), fixtures, rng, recorder)
+        while time.perf_counter() < deadline:
+            _weighted_choice(rng, mix)(vu)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize_samples(recorder.samples, time.perf_counter() - started)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(db_path, workers=2, threads=1, port=None):
+    """Launch gunicorn serving app:app on the benchmark database
+
+    Returns the process, its base URL and the seconds it took to answer
+    /readyz, i.e. the cold start including migrations and cache warmup.
+    """
+    port = port or _free_port()
+    env = dict(os.environ, SHIKSHA_DB_PATH=os.path.abspath(db_path))
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+         '--workers', str(workers), '--threads', str(threads), '--log-level', 'warning',
+         '--access-logfile', '/dev/null', 'app:app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(600):
+        if process.poll() is not None:
+            raise SystemExit('gunicorn exited during startup')
+        try:
+            urllib.request.urlopen(base_url + '/readyz', timeout=1).read()
+            return process, base_url, round(time.perf_counter() - started, 2)
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.1)
+    process.terminate()
+    raise SystemExit('gunicorn did not become ready')
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _encoding_report(before, after):
+    """Response encoding and compression work of an in-process run"""
+    json_before, compress_before = before
+    json_after, compress_after = after
+    responses = json_after['responses'] - json_before['responses']
+    compressed = compress_after['compressed'] - compress_before['compressed']
+    bytes_in = compress_after['bytes_in'] - compress_before['bytes_in']
+    bytes_out = compress_after['bytes_out'] - compress_before['bytes_out']
+    compress_seconds = compress_after['seconds'] - compress_before['seconds']
+    return {
+        'encoder': json_after['encoder'],
+        'json_responses': responses,
+        'json_encode_us': round((json_after['seconds'] - json_before['seconds']) / responses * 1e6, 1) if responses else None,
+        'json_bytes': json_after['bytes'] - json_before['bytes'],
+        'compressed': compressed,
+        'compress_us': round(compress_seconds / compressed * 1e6, 1) if compressed else None,
+        'compression_ratio': round(bytes_out / bytes_in, 3) if bytes_in else None,
+        'encodings': compress_after['encodings'],
+    }
+
+
+def run_benchmark(db_path, scenario='classroom', mode='inprocess', users=16, duration=10.0,
+                  workers=2, threads=1, seed=7, accept_encoding=DEFAULT_ACCEPT_ENCODING):
+    """Run one scenario and return a JSON-serialisable report"""
+    # database.DB_PATH is read at import time, so point it at the benchmark db first
+    os.environ['SHIKSHA_DB_PATH'] = db_path
+    for name, value in BENCHMARK_ENV.items():
+        os.environ.setdefault(name, value)
+    fixtures = Fixtures(db_path)
+    process = None
+    startup_seconds = None
+    if mode == 'inprocess':
+        import database
+        if database.DB_PATH != db_path:
+            raise SystemExit(f'database was already imported with {database.DB_PATH}')
+        started = time.perf_counter()
+        from app import app, compressor
+        startup_seconds = round(time.perf_counter() - started, 2)
+        make_client = lambda: InProcessClient(app, accept_encoding)
+        encoding_stats = lambda: (app.json.stats(), compressor.stats())
+    elif mode == 'gunicorn':
+        process, base_url, startup_seconds = start_gunicorn(db_path, workers, threads)
+        make_client = lambda: HttpClient(base_url, fixtures, accept_encoding)
+        # Counters live in each worker; /metrics shows one worker's share
+        encoding_stats = None
+    else:
+        raise ValueError(f'Unknown mode {mode}')
+
+    before = encoding_stats() if encoding_stats else None
+    try:
+        routes, totals = run_load(make_client, fixtures, scenario, users, duration, seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    return {
+        'commit': _git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'mode': mode,
+        'scenario': scenario,
+        'config': {'users': users, 'duration': duration, 'workers': workers,
+                   'threads': threads, 'seed': seed, 'db': db_path, 'accept_encoding': accept_encoding},
+        'startup_seconds': startup_seconds,
+        'totals': totals,
+        'encoding': _encoding_report(before, encoding_stats()) if encoding_stats else None,
+        'routes': routes,
+    }
+
+
+def compare_reports(before, after):
+    """Per-route throughput and latency change between two reports"""
+    lines = [f"{'route':<24}{'rps':>18}{'p50 ms':>22}{'p95 ms':>22}{'p99 ms':>22}"]
+    for route in sorted(set(before['routes']) | set(after['routes'])):
+        old, new = before['routes'].get(route), after['routes'].get(route)
+        if not old or not new:
+            lines.append(f'{route:<24}  only in {"after" if new else "before"}')
+            continue
+        cells = []
+        for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            cells.append(f'{old[key]:>8} > {new[key]:<8}{change:+.0f}%'.rjust(22 if key != 'throughput_rps' else 18))
+        lines.append(f'{route:<24}' + ''.join(cells))
+        if old.get('mean_response_bytes') and new.get('mean_response_bytes') != old['mean_response_bytes']:
+            change = (new['mean_response_bytes'] - old['mean_response_bytes']) / old['mean_response_bytes'] * 100
+            lines.append(f"{'':<24}response bytes {old['mean_response_bytes']} > "
+                         f"{new['mean_response_bytes']} {change:+.0f}%")
+        if old.get('request_bytes_per_log') and new.get('request_bytes_per_log'):
+            change = (new['request_bytes_per_log'] - old['request_bytes_per_log']) / old['request_bytes_per_log'] * 100
+            lines.append(f"{'':<24}request bytes/log {old['request_bytes_per_log']} > "
+                         f"{new['request_bytes_per_log']} {change:+.0f}%")
+    return '\n'.join(lines)
+
+
+def print_report(report):
+    print(f"{report['scenario']} ({report['mode']}, {report['config']['users']} users, "
+          f"commit {report['commit']}): ready in {report.get('startup_seconds')}s, "
+          f"{report['totals']['requests']} requests, "
+          f"{report['totals']['throughput_rps']} req/s, {report['totals']['errors']} errors")
+    encoding = report.get('encoding')
+    if encoding:
+        print(f"  {encoding['encoder']} encoding {encoding['json_encode_us']}us/response, "
+              f"{encoding['compressed']} compressed ({'/'.join(encoding['encodings'])}) "
+              f"at {encoding['compress_us']}us, ratio {encoding['compression_ratio']}")
+    for route, stats in report['routes'].items():
+        print(f"  {route:<22} n={stats['count']:<6} {stats['throughput_rps']:>8} req/s  "
+              f"p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms "
+              f"errors={stats['errors']} resp_bytes={stats['mean_response_bytes']}"
+              + (f" req_bytes/log={stats['request_bytes_per_log']}" if 'request_bytes_per_log' in stats else ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed = commands.add_parser('seed', help='create a synthetic database')
+    seed.add_argument('--db', default='bench.db')
+    seed.add_argument('--schools', type=int, default=20)
+    seed.add_argument('--students', type=int, default=30, help='students per school')
+    seed.add_argument('--teachers', type=int, default=2, help='teachers per school')
+    seed.add_argument('--logs', type=int, default=40, help='game logs per student')
+    seed.add_argument('--seed', type=int, default=42)
+
+    run = commands.add_parser('run', help='replay a traffic scenario')
+    run.add_argument('--db', default='bench.db')
+    run.add_argument('--scenario', default='classroom', choices=sorted(SCENARIOS))
+    run.add_argument('--mode', default='inprocess', choices=['inprocess', 'gunicorn'])
+    run.add_argument('--users', type=int, default=16)
+    run.add_argument('--duration', type=float, default=10.0)
+    run.add_argument('--workers', type=int, default=2)
+    run.add_argument('--threads', type=int, default=1)
+    run.add_argument('--seed', type=int, default=7)
+    run.add_argument('--accept-encoding', default=DEFAULT_ACCEPT_ENCODING,
+                     help="Accept-Encoding the clients send; '' for uncompressed responses")
+    run.add_argument('--output', help='write the JSON report to this file')
+
+    encode = commands.add_parser('encode', help='time serialisation of the hot response payloads')
+    encode.add_argument('--db', default='bench.db')
+    encode.add_argument('--iterations', type=int, default=200)
+    encode.add_argument('--output', help='write the JSON report to this file')
+
+    compare = commands.add_parser('compare', help='compare two JSON reports')
+    compare.add_argument('before')
+    compare.add_argument('after')
+
+    args = parser.parse_args(argv)
+    if args.command == 'seed':
+        print(json.dumps(seed_database(args.db, args.schools, args.students, args.logs,
+                                       args.teachers, args.seed)))
+    elif args.command == 'run':
+        report = run_benchmark(args.db, args.scenario, args.mode, args.users, args.duration,
+                               args.workers, args.threads, args.seed, args.accept_encoding)
+        print_report(report)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+    elif args.command == 'encode':
+        report = run_encode(args.db, args.iterations)
+        print_encode_report(report)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+    else:
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        print(compare_reports(before, after))
+
+
+if __name__ == '__main__':
+    main()
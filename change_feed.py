@@ -0,0 +1,254 @@
+"""Per-student change feed for pulling progress onto another device
+
+game_logs and achievements are append-only with AUTOINCREMENT ids, so "rows
+of this student after id N" is a range read of a (student_id, id) index.
+student_progress rows are updated in place by every game played; triggers
+give each inserted or updated row a new sequence number in progress_changes,
+keeping one entry per row. SQLite has a single writer, so ids and sequence
+numbers become visible in order and a position never skips a row committed
+later.
+
+/api/sync/changes hands out a page of changed rows as column lists plus an
+opaque cursor holding the database, the student and the three positions.
+Ids are local to a database file, so a cursor from another shard (the
+student was moved) or another student (a shared phone) starts again from
+the beginning with reset set, and the device replaces what it pulled
+before. Archived game logs are not in the feed.
+
+When nothing is new the request can wait: ChangeNotifier wakes the waiting
+requests of a worker as soon as it stores logs, and the database is checked
+again every poll interval for writes made by other workers.
+"""
+import os
+import threading
+import time
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+# Below the idle timeout of common proxies and mobile carriers
+MAX_WAIT_SECONDS = 25
+DEFAULT_POLL_SECONDS = 1.0
+# Each waiting request holds a gthread worker thread (8 by default)
+DEFAULT_MAX_WAITERS = 4
+
+# (table, position column, query of a page after a position); progress
+# first, so a student's mastery arrives before their full log history
+FEED_SOURCES = (
+    ('student_progress', 'seq', '''
+        SELECT c.seq, p.id, p.subject, p.grade, p.topic, p.mastery_level, p.attempts,
+               p.total_time_spent, p.last_activity
+        FROM progress_changes c JOIN student_progress p ON p.id = c.progress_id
+        WHERE c.student_id = ? AND c.seq > ? ORDER BY c.seq LIMIT ?
+    '''),
+    ('achievements', 'id', '''
+        SELECT id, id, badge_name, badge_type, description, icon_path, awarded_at
+        FROM achievements WHERE student_id = ? AND id > ? ORDER BY id LIMIT ?
+    '''),
+    ('game_logs', 'id', '''
+        SELECT id, id, subject, grade, game_id, game_type, level, score, max_score,
+               time_spent, played_at, client_log_id
+        FROM game_logs WHERE student_id = ? AND id > ? ORDER BY id LIMIT ?
+    '''),
+)
+
+FEED_COLUMNS = {
+    'student_progress': ('id', 'subject', 'grade', 'topic', 'mastery_level', 'attempts',
+                         'total_time_spent', 'last_activity'),
+    'achievements': ('id', 'badge_name', 'badge_type', 'description', 'icon_path', 'awarded_at'),
+    'game_logs': ('id', 'subject', 'grade', 'game_id', 'game_type', 'level', 'score', 'max_score',
+                  'time_spent', 'played_at', 'client_log_id'),
+}
+
+# Sequences the cursor positions are taken from, in FEED_SOURCES order
+POSITION_SEQUENCES = ('progress_changes', 'achievements', 'game_logs')
+
+HAS_CHANGES_SQL = '''
+    SELECT EXISTS (SELECT 1 FROM progress_changes WHERE student_id = ? AND seq > ?)
+        OR EXISTS (SELECT 1 FROM achievements WHERE student_id = ? AND id > ?)
+        OR EXISTS (SELECT 1 FROM game_logs WHERE student_id = ? AND id > ?)
+'''
+
+
+class CursorError(ValueError):
+    """Raised for a cursor this server did not issue"""
+
+
+def create_change_log(cursor):
+    """Indexes and the progress_changes table the feed reads, with existing rows backfilled"""
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_game_logs_student_id
+    ON game_logs (student_id, id)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_achievements_student_id
+    ON achievements (student_id, id)
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS progress_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id INTEGER NOT NULL,
+        progress_id INTEGER UNIQUE NOT NULL
+    )''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_progress_changes_student
+    ON progress_changes (student_id, seq)
+    ''')
+    # DELETE then INSERT rather than INSERT OR REPLACE: an OR clause on the
+    # statement firing a trigger overrides the one inside it. New rows need
+    # no DELETE, AUTOINCREMENT never hands out an id twice.
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS progress_changes_insert
+    AFTER INSERT ON student_progress BEGIN
+        INSERT INTO progress_changes (student_id, progress_id) VALUES (NEW.student_id, NEW.id);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS progress_changes_update
+    AFTER UPDATE ON student_progress BEGIN
+        DELETE FROM progress_changes WHERE progress_id = NEW.id;
+        INSERT INTO progress_changes (student_id, progress_id) VALUES (NEW.student_id, NEW.id);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS progress_changes_delete
+    AFTER DELETE ON student_progress BEGIN
+        DELETE FROM progress_changes WHERE progress_id = OLD.id;
+    END
+    ''')
+    cursor.execute('''
+    INSERT OR IGNORE INTO progress_changes (student_id, progress_id)
+    SELECT student_id, id FROM student_progress ORDER BY id
+    ''')
+
+
+def encode_cursor(database, student_id, positions):
+    return '.'.join([database, str(student_id)] + [str(position) for position in positions])
+
+
+def decode_cursor(cursor):
+    """(database, student_id, positions) of a cursor from encode_cursor()"""
+    try:
+        parts = cursor.rsplit('.', len(FEED_SOURCES) + 1)
+        numbers = [int(part) for part in parts[1:]]
+    except (AttributeError, ValueError):
+        raise CursorError('invalid cursor')
+    if len(numbers) != len(FEED_SOURCES) + 1 or min(numbers) < 0:
+        raise CursorError('invalid cursor')
+    return parts[0], numbers[0], numbers[1:]
+
+
+def start_positions(conn, database, student_id, cursor):
+    """(positions to read after, reset) for a client cursor
+
+    A cursor of another database or student, or of a database recreated
+    since (ahead of its sequences), restarts from the beginning.
+    """
+    start = [0] * len(FEED_SOURCES)
+    if not cursor:
+        return start, False
+    cursor_database, cursor_student, positions = decode_cursor(cursor)
+    if cursor_database != database or cursor_student != student_id:
+        return start, True
+    current = dict(conn.execute(f'''
+        SELECT name, seq FROM sqlite_sequence WHERE name IN ({', '.join('?' * len(POSITION_SEQUENCES))})
+    ''', POSITION_SEQUENCES).fetchall())
+    if any(position > current.get(name, 0) for name, position in zip(POSITION_SEQUENCES, positions)):
+        return start, True
+    return positions, False
+
+
+def has_changes(conn, student_id, positions):
+    params = []
+    for position in positions:
+        params += [student_id, position]
+    return bool(conn.execute(HAS_CHANGES_SQL, params).fetchone()[0])
+
+
+def read_changes(conn, student_id, positions, limit=DEFAULT_PAGE_SIZE):
+    """Up to limit changed rows after positions; returns (changes, new positions, has_more)
+
+    changes maps a table name to {'columns': [...], 'rows': [[...], ...]}
+    and only lists tables with changed rows.
+    """
+    changes = {}
+    positions = list(positions)
+    has_more = False
+    remaining = limit
+    for index, (table, _, sql) in enumerate(FEED_SOURCES):
+        if remaining == 0:
+            has_more = has_more or conn.execute(sql, (student_id, positions[index], 1)).fetchone() is not None
+            continue
+        rows = conn.execute(sql, (student_id, positions[index], remaining + 1)).fetchall()
+        if len(rows) > remaining:
+            has_more = True
+            rows = rows[:remaining]
+        if rows:
+            positions[index] = rows[-1][0]
+            changes[table] = {'columns': list(FEED_COLUMNS[table]), 'rows': [list(row[1:]) for row in rows]}
+            remaining -= len(rows)
+    return changes, positions, has_more
+
+
+class ChangeNotifier:
+    """Lets change feed requests of this worker wait for new rows without polling hard"""
+
+    def __init__(self, max_waiters=DEFAULT_MAX_WAITERS, poll_interval=DEFAULT_POLL_SECONDS):
+        self.max_waiters = max_waiters
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._waiting = 0
+        self._stats = {'waits': 0, 'woken': 0, 'timeouts': 0, 'refused': 0, 'notified': 0}
+
+    def notify(self):
+        """Rows were stored by this worker; waiting requests check their student again"""
+        with self._cond:
+            self._generation += 1
+            self._stats['notified'] += 1
+            self._cond.notify_all()
+
+    def wait_for(self, check, timeout):
+        """Call check() until it returns true or timeout seconds pass
+
+        Returns True once check() did, False on timeout, and None without
+        waiting when max_waiters requests are already waiting.
+        """
+        with self._cond:
+            if self._waiting >= self.max_waiters:
+                self._stats['refused'] += 1
+                return None
+            self._waiting += 1
+            self._stats['waits'] += 1
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                with self._cond:
+                    generation = self._generation
+                if check():
+                    with self._cond:
+                        self._stats['woken'] += 1
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._cond:
+                        self._stats['timeouts'] += 1
+                    return False
+                with self._cond:
+                    # A notify() since the check was made means look again now
+                    if self._generation == generation:
+                        self._cond.wait(min(self.poll_interval, remaining))
+        finally:
+            with self._cond:
+                self._waiting -= 1
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, waiting=self._waiting, max_waiters=self.max_waiters)
+
+
+def notifier_from_env():
+    """ChangeNotifier configured by SHIKSHA_FEED_* environment variables"""
+    return ChangeNotifier(
+        max_waiters=int(os.environ.get('SHIKSHA_FEED_MAX_WAITERS', DEFAULT_MAX_WAITERS)),
+        poll_interval=float(os.environ.get('SHIKSHA_FEED_POLL_SECONDS', DEFAULT_POLL_SECONDS)),
+    )
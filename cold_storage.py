@@ -0,0 +1,491 @@
+"""Tiering of old game_logs rows into compressed columnar archive files
+
+archive() moves rows played before a cutoff out of the hot SQLite table into
+files partitioned by state, district and month:
+
+    <archive dir>/state=<state>/district=<district>/month=<YYYY-MM>/part-<first id>-<tag>.<ext>
+
+Files are Parquet when pyarrow is installed and otherwise a stdlib columnar
+format (.cols): one zlib-compressed array per column, with repeated strings
+such as subject and game_id dictionary-encoded. Every file is listed in
+archive_partitions together with its row count and score totals; a file is
+only visible once its row is committed, in the same transaction that deletes
+the rows from game_logs, so a crash mid-archive never shows a row twice.
+
+The dashboard rollups, analytics buckets and mastery estimates were updated
+when the rows were inserted, so archiving does not change them. query_logs()
+unions hot and cold rows for historical reports, and attach_cold_logs()
+exposes both as the all_game_logs view so rebuilds keep archived history.
+
+A device that uploads a log after its month has been archived inserts it
+again: client_log_id duplicates are only detected in the hot table, so keep
+the archive age well beyond the longest time a device stays offline.
+"""
+import array
+import itertools
+import json
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+from database import DB_PATH, connect
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+DEFAULT_ARCHIVE_DIR = 'archive'
+DEFAULT_ARCHIVE_AFTER_DAYS = 365
+DEFAULT_BATCH_SIZE = 50000
+# SQLite builds older than 3.32 cap bound parameters at 999
+DELETE_CHUNK_SIZE = 500
+
+COLUMNS_MAGIC = b'SLCOLS1\n'
+
+# (column, kind): 'int' columns are stored as int64 arrays, 'delta' columns as
+# int64 differences from the previous row, 'dict' columns as indexes into a
+# per-file dictionary, 'text' columns as NUL-joined UTF-8
+LOG_COLUMNS = (
+    ('id', 'delta'),
+    ('student_id', 'int'),
+    ('subject', 'dict'),
+    ('grade', 'int'),
+    ('game_id', 'dict'),
+    ('game_type', 'dict'),
+    ('level', 'dict'),
+    ('score', 'int'),
+    ('max_score', 'int'),
+    ('time_spent', 'int'),
+    ('attempts', 'int'),
+    ('completed', 'int'),
+    ('played_at', 'text'),
+    ('synced', 'int'),
+    ('client_log_id', 'text'),
+)
+LOG_COLUMN_NAMES = tuple(name for name, _ in LOG_COLUMNS)
+
+MONTH_PATTERN = re.compile(r'^\d{4}-\d{2}$')
+
+
+def _encode_column(kind, values):
+    """(header, compressed bytes) of one column"""
+    nulls = [i for i, value in enumerate(values) if value is None]
+    header = {'kind': kind, 'nulls': nulls}
+    if kind == 'int':
+        raw = array.array('q', (0 if value is None else int(value) for value in values)).tobytes()
+    elif kind == 'delta':
+        numbers = [0 if value is None else int(value) for value in values]
+        raw = array.array('q', (b - a for a, b in zip([0] + numbers, numbers))).tobytes()
+    elif kind == 'dict':
+        dictionary = {}
+        codes = array.array('i', (0 if value is None else dictionary.setdefault(value, len(dictionary))
+                                  for value in values))
+        header['dictionary'] = list(dictionary)
+        raw = codes.tobytes()
+    else:
+        raw = '\0'.join('' if value is None else str(value) for value in values).encode('utf-8')
+    return header, zlib.compress(raw, 6)
+
+
+def _decode_column(header, blob, rows):
+    raw = zlib.decompress(blob)
+    kind = header['kind']
+    if kind in ('int', 'delta', 'dict'):
+        values = array.array('i' if kind == 'dict' else 'q')
+        values.frombytes(raw)
+        if header['byteorder'] != sys.byteorder:
+            values.byteswap()
+        values = values.tolist()
+        if kind == 'delta':
+            values = list(itertools.accumulate(values))
+        elif kind == 'dict':
+            dictionary = header['dictionary']
+            values = [dictionary[code] for code in values]
+    else:
+        values = raw.decode('utf-8').split('\0') if rows else []
+    for i in header['nulls']:
+        values[i] = None
+    return values
+
+
+def write_columns_file(path, columns):
+    """Write {name: values} in the stdlib columnar format"""
+    rows = len(columns[LOG_COLUMN_NAMES[0]])
+    headers = []
+    blobs = []
+    offset = 0
+    for name, kind in LOG_COLUMNS:
+        header, blob = _encode_column(kind, columns[name])
+        header.update(name=name, offset=offset, length=len(blob), byteorder=sys.byteorder)
+        headers.append(header)
+        blobs.append(blob)
+        offset += len(blob)
+    meta = json.dumps({'rows': rows, 'columns': headers}).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(COLUMNS_MAGIC)
+        f.write(len(meta).to_bytes(4, 'little'))
+        f.write(meta)
+        for blob in blobs:
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_columns_file(path, names=None):
+    """Read {name: values} from a stdlib columnar file, only decoding the requested columns"""
+    with open(path, 'rb') as f:
+        if f.read(len(COLUMNS_MAGIC)) != COLUMNS_MAGIC:
+            raise ValueError(f'{path} is not a columnar archive file')
+        meta = json.loads(f.read(int.from_bytes(f.read(4), 'little')))
+        start = f.tell()
+        result = {}
+        for header in meta['columns']:
+            if names is not None and header['name'] not in names:
+                continue
+            f.seek(start + header['offset'])
+            result[header['name']] = _decode_column(header, f.read(header['length']), meta['rows'])
+    return result
+
+
+def _write_parquet(path, columns):
+    table = pyarrow.table({name: columns[name] for name in LOG_COLUMN_NAMES})
+    pyarrow.parquet.write_table(
+        table, path, compression='zstd',
+        use_dictionary=[name for name, kind in LOG_COLUMNS if kind == 'dict']
+    )
+
+
+def _read_parquet(path, names=None):
+    return pyarrow.parquet.read_table(path, columns=list(names) if names else None).to_pydict()
+
+
+def _partition_value(value):
+    return quote(str(value or 'unknown'), safe='')
+
+
+def _month_of(played_at):
+    month = str(played_at or '')[:7]
+    return month if MONTH_PATTERN.match(month) else 'unknown'
+
+
+class ColdStorage:
+    """Moves old game_logs rows to partitioned archive files and reads them back"""
+
+    def __init__(self, archive_dir=DEFAULT_ARCHIVE_DIR, db_path=None, archive_after_days=DEFAULT_ARCHIVE_AFTER_DAYS,
+                 batch_size=DEFAULT_BATCH_SIZE, interval=None, file_format=None, shared_path=None):
+        self.archive_dir = archive_dir
+        self.db_path = db_path or DB_PATH
+        # Main database attached by the archiver when db_path is a shard
+        self.shared_path = shared_path
+        self.archive_after_days = archive_after_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self.file_format = file_format or ('parquet' if pyarrow is not None else 'cols')
+        if self.file_format == 'parquet' and pyarrow is None:
+            raise ValueError('Parquet archives need the pyarrow package')
+        self._lock = threading.Lock()
+        self._archiver = None
+        self._archiver_pid = None
+        self._stats = {'runs': 0, 'archived': 0, 'files': 0, 'conflicts': 0, 'last_run_seconds': 0.0}
+
+    def _write(self, path, columns):
+        if path.endswith('.parquet'):
+            _write_parquet(path, columns)
+        else:
+            write_columns_file(path, columns)
+
+    def read_file(self, relative_path, names=None):
+        """{column: values} of one archive file"""
+        path = os.path.join(self.archive_dir, relative_path)
+        if path.endswith('.parquet'):
+            if pyarrow is None:
+                raise RuntimeError(f'{relative_path} is Parquet but pyarrow is not installed')
+            return _read_parquet(path, names)
+        return read_columns_file(path, names)
+
+    def _select_batch(self, conn, after_id, cutoff):
+        """Next batch of rows to archive with their partition, scanning by rowid"""
+        columns = ', '.join(f'gl.{name}' for name in LOG_COLUMN_NAMES)
+        return conn.execute(f'''
+            SELECT {columns}, s.state, COALESCE(u.district, s.district)
+            FROM game_logs gl
+            LEFT JOIN students s ON s.id = gl.student_id
+            LEFT JOIN udise_schools u ON u.udise_code = s.udise_code
+            WHERE gl.id > ? AND gl.played_at < ?
+            ORDER BY gl.id
+            LIMIT ?
+        ''', (after_id, cutoff, self.batch_size)).fetchall()
+
+    def _write_partitions(self, rows):
+        """Write one file per (state, district, month) of a batch; returns catalog rows"""
+        groups = {}
+        for row in rows:
+            key = (row[-2] or 'unknown', row[-1] or 'unknown', _month_of(row[12]))
+            groups.setdefault(key, []).append(row)
+
+        extension = 'parquet' if self.file_format == 'parquet' else 'cols'
+        written = []
+        for (state, district, month), group in sorted(groups.items()):
+            directory = os.path.join(
+                f'state={_partition_value(state)}', f'district={_partition_value(district)}', f'month={month}'
+            )
+            os.makedirs(os.path.join(self.archive_dir, directory), exist_ok=True)
+            relative_path = os.path.join(directory, f'part-{group[0][0]}-{uuid.uuid4().hex[:8]}.{extension}')
+            columns = {name: [row[i] for row in group] for i, name in enumerate(LOG_COLUMN_NAMES)}
+            path = os.path.join(self.archive_dir, relative_path)
+            self._write(path, columns)
+            written.append((
+                relative_path, state, district, month, len(group), group[0][0], group[-1][0],
+                min(row[12] for row in group), max(row[12] for row in group),
+                sum(row[7] * 100.0 / row[8] for row in group if row[8]), os.path.getsize(path),
+            ))
+        return written
+
+    def _remove(self, written):
+        for entry in written:
+            try:
+                os.remove(os.path.join(self.archive_dir, entry[0]))
+            except FileNotFoundError:
+                pass
+
+    def _commit_batch(self, conn, ids, written):
+        """Delete archived rows and register their files in one transaction
+
+        Returns False (and removes the files) if another archiver got to any
+        of the rows first.
+        """
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            deleted = 0
+            for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+                chunk = ids[start:start + DELETE_CHUNK_SIZE]
+                deleted += conn.execute(
+                    f'DELETE FROM game_logs WHERE id IN ({", ".join("?" * len(chunk))})', chunk
+                ).rowcount
+            if deleted != len(ids):
+                conn.rollback()
+                self._remove(written)
+                return False
+            conn.executemany('''
+                INSERT INTO archive_partitions
+                (path, state, district, month, row_count, min_log_id, max_log_id,
+                 min_played_at, max_played_at, score_pct_sum, bytes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', written)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            self._remove(written)
+            raise
+        return True
+
+    def archive(self, conn, older_than_days=None, now=None):
+        """Move every game_logs row played more than older_than_days ago to archive files
+
+        Files are written outside any transaction; the write lock is only
+        held to delete a batch's rows and register its files.
+        """
+        days = self.archive_after_days if older_than_days is None else older_than_days
+        cutoff = ((now or datetime.now()) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+        started = time.perf_counter()
+        summary = {'cutoff': cutoff, 'rows': 0, 'files': 0, 'bytes': 0, 'conflicts': 0}
+        after_id = 0
+        while True:
+            rows = self._select_batch(conn, after_id, cutoff)
+            if not rows:
+                break
+            after_id = rows[-1][0]
+            written = self._write_partitions(rows)
+            if self._commit_batch(conn, [row[0] for row in rows], written):
+                summary['rows'] += len(rows)
+                summary['files'] += len(written)
+                summary['bytes'] += sum(entry[-1] for entry in written)
+            else:
+                summary['conflicts'] += 1
+        seconds = time.perf_counter() - started
+        summary['seconds'] = round(seconds, 3)
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['archived'] += summary['rows']
+            self._stats['files'] += summary['files']
+            self._stats['conflicts'] += summary['conflicts']
+            self._stats['last_run_seconds'] = round(seconds, 3)
+        return summary
+
+    def partitions(self, conn, state=None, district=None, since=None, until=None):
+        """Catalog rows of archive files overlapping the filters, oldest first"""
+        sql = '''
+            SELECT path, state, district, month, row_count, min_played_at, max_played_at
+            FROM archive_partitions WHERE 1 = 1
+        '''
+        params = []
+        if state is not None:
+            sql += ' AND state = ?'
+            params.append(state)
+        if district is not None:
+            sql += ' AND district = ?'
+            params.append(district)
+        if since is not None:
+            sql += ' AND max_played_at >= ?'
+            params.append(since)
+        if until is not None:
+            sql += ' AND min_played_at <= ?'
+            params.append(until)
+        sql += ' ORDER BY month, min_log_id'
+        return conn.execute(sql, params).fetchall()
+
+    def iter_cold_rows(self, conn, state=None, district=None, since=None, until=None, student_ids=None):
+        """Archived rows as tuples in LOG_COLUMN_NAMES order, pruned by partition then filtered"""
+        for partition in self.partitions(conn, state, district, since, until):
+            columns = self.read_file(partition[0])
+            for row in zip(*(columns[name] for name in LOG_COLUMN_NAMES)):
+                played_at = row[12] or ''
+                if since is not None and played_at < since:
+                    continue
+                if until is not None and played_at > until:
+                    continue
+                if student_ids is not None and row[1] not in student_ids:
+                    continue
+                yield row
+
+    def ensure_archiver(self):
+        """Start this worker's periodic archiver on first use (after any fork)"""
+        if not self.interval or (self._archiver_pid == os.getpid() and self._archiver.is_alive()):
+            return
+        with self._lock:
+            if self._archiver_pid == os.getpid() and self._archiver.is_alive():
+                return
+            self._archiver_pid = os.getpid()
+            self._archiver = threading.Thread(target=self._archive_forever, name='log-archiver', daemon=True)
+            self._archiver.start()
+
+    def _archive_forever(self):
+        conn = connect(self.db_path, shared_path=self.shared_path)
+        try:
+            while True:
+                # Jitter so workers started together rarely archive at the same time
+                time.sleep(self.interval * (0.5 + secrets.randbelow(1000) / 1000.0))
+                try:
+                    summary = self.archive(conn)
+                    if summary['rows']:
+                        print(f"Archived {summary['rows']} game logs older than {summary['cutoff']}")
+                except Exception as e:
+                    print(f"Warning: game log archiving failed: {e}")
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Snapshot of archiving counters for this worker"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['format'] = self.file_format
+        stats['archive_after_days'] = self.archive_after_days
+        return stats
+
+
+def _student_ids(conn, student_id=None, udise_code=None):
+    if student_id is not None:
+        return {student_id}
+    if udise_code is not None:
+        return {row[0] for row in conn.execute('SELECT id FROM students WHERE udise_code = ?', (udise_code,))}
+    return None
+
+
+def query_logs(conn, storage, student_id=None, udise_code=None, district=None, since=None, until=None):
+    """game_logs rows as dicts from the hot table and the archive, oldest archive first
+
+    Filters are by student, by school (udise_code), by district (from the
+    school's UDISE record, as partitions are) and by played_at range.
+    """
+    student_ids = _student_ids(conn, student_id, udise_code)
+    if storage is not None:
+        for row in storage.iter_cold_rows(conn, district=district, since=since, until=until,
+                                          student_ids=student_ids):
+            yield dict(zip(LOG_COLUMN_NAMES, row))
+
+    columns = ', '.join(f'gl.{name}' for name in LOG_COLUMN_NAMES)
+    sql = f'SELECT {columns} FROM game_logs gl'
+    where = []
+    params = []
+    if student_id is not None:
+        where.append('gl.student_id = ?')
+        params.append(student_id)
+    elif udise_code is not None:
+        where.append('gl.student_id IN (SELECT id FROM students WHERE udise_code = ?)')
+        params.append(udise_code)
+    if district is not None:
+        sql += '''
+            JOIN students s ON s.id = gl.student_id
+            LEFT JOIN udise_schools u ON u.udise_code = s.udise_code
+        '''
+        where.append('COALESCE(u.district, s.district) = ?')
+        params.append(district)
+    if since is not None:
+        where.append('gl.played_at >= ?')
+        params.append(since)
+    if until is not None:
+        where.append('gl.played_at <= ?')
+        params.append(until)
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    for row in conn.execute(sql + ' ORDER BY gl.played_at, gl.id', params):
+        yield dict(zip(LOG_COLUMN_NAMES, row))
+
+
+def attach_cold_logs(conn, storage, own_students_only=False):
+    """Load archived rows into a temp table and expose hot + cold as the all_game_logs view
+
+    Meant for rebuilds, which need every log ever played; returns the number
+    of archived rows loaded. A shard that gave schools of a district to
+    another shard still lists that district's partitions, so shard rebuilds
+    keep only the archived rows of students stored on the shard.
+    """
+    columns = ', '.join(LOG_COLUMN_NAMES)
+    conn.execute('DROP VIEW IF EXISTS temp.all_game_logs')
+    conn.execute('DROP TABLE IF EXISTS temp.cold_game_logs')
+    conn.execute(f'CREATE TEMP TABLE cold_game_logs AS SELECT {columns} FROM game_logs WHERE 0')
+    loaded = 0
+    if storage is not None:
+        placeholders = ', '.join('?' * len(LOG_COLUMN_NAMES))
+        batch = []
+        student_ids = None
+        if own_students_only:
+            student_ids = {row[0] for row in conn.execute('SELECT id FROM main.students')}
+        for row in storage.iter_cold_rows(conn, student_ids=student_ids):
+            batch.append(row)
+            if len(batch) >= DEFAULT_BATCH_SIZE:
+                conn.executemany(f'INSERT INTO temp.cold_game_logs VALUES ({placeholders})', batch)
+                loaded += len(batch)
+                batch = []
+        conn.executemany(f'INSERT INTO temp.cold_game_logs VALUES ({placeholders})', batch)
+        loaded += len(batch)
+    conn.execute(f'''
+        CREATE TEMP VIEW all_game_logs AS
+        SELECT {columns} FROM main.game_logs
+        UNION ALL
+        SELECT {columns} FROM temp.cold_game_logs
+    ''')
+    return loaded
+
+
+def storage_from_env(db_path=None, shared_path=None):
+    """ColdStorage configured by SHIKSHA_ARCHIVE_* environment variables"""
+    hours = float(os.environ.get('SHIKSHA_ARCHIVE_INTERVAL_HOURS', '0'))
+    return ColdStorage(
+        os.environ.get('SHIKSHA_ARCHIVE_DIR', DEFAULT_ARCHIVE_DIR),
+        db_path,
+        archive_after_days=float(os.environ.get('SHIKSHA_ARCHIVE_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS)),
+        batch_size=int(os.environ.get('SHIKSHA_ARCHIVE_BATCH', DEFAULT_BATCH_SIZE)),
+        interval=hours * 3600 if hours > 0 else None,
+        file_format=os.environ.get('SHIKSHA_ARCHIVE_FORMAT') or None,
+        shared_path=shared_path,
+    )
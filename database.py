@@ -1,12 +1,89 @@
+import contextlib
 import sqlite3
-import csv
 import os
+import sys
+import urllib.parse
 
-def init_db():
-    """Initialize the SQLite database with all required tables"""
-    conn = sqlite3.connect('shiksha_leap.db')
-    cursor = conn.cursor()
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from achievements import rebuild_achievements, recompute_achievements
+from analytics import rebuild_analytics, recompute_analytics
+from change_feed import FEED_SOURCES, HAS_CHANGES_SQL, create_change_log
+from mastery import rebuild_mastery, recompute_mastery
+from rollups import rebuild_rollups, recompute_rollups
+from school_search import create_search_index, rebuild_search_index
+
+DB_PATH = os.environ.get('SHIKSHA_DB_PATH', 'shiksha_leap.db')
+# Fail migrate() when a hot query no longer uses an index (dev and image builds)
+CHECK_QUERY_PLANS = os.environ.get('SHIKSHA_CHECK_QUERY_PLANS', '0') not in ('0', 'false', 'no', 'off')
+
+# Applied to every connection. WAL lets dashboard reads run while game logs
+# are being written; NORMAL sync is durable across app crashes in WAL mode.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('mmap_size', 268435456),
+    ('temp_store', 'MEMORY'),
+)
+
+# Shared with the shadow table used by udise_import
+UDISE_SCHOOLS_COLUMNS = '''
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        udise_code TEXT UNIQUE NOT NULL,
+        school_name TEXT NOT NULL,
+        district TEXT NOT NULL,
+        block TEXT NOT NULL,
+        category TEXT,
+        area TEXT,
+        management TEXT
+    '''
+
+# Tables that stay in the main database when student data is sharded and
+# that shard queries join against (profiles, the UDISE register)
+GLOBAL_TABLES = ('users', 'teachers', 'udise_schools')
+# Student-owned tables whose inserts are refused on a shard that does not
+# hold the student (any more), so a write racing a shard split fails loudly
+FENCED_TABLES = ('game_logs', 'achievements')
+STUDENT_FENCE_ERROR = 'student is not stored on this shard'
 
+def connect(db_path=None, shared_path=None, **kwargs):
+    """Open a SQLite connection with the standard pragmas applied
+
+    A connection to a shard (see sharding.py) passes the main database as
+    shared_path. It is attached read-only as `shared`, and temp views make
+    GLOBAL_TABLES resolve there instead of to the shard's empty copies, so
+    the same SQL works on sharded and unsharded databases.
+    """
+    if shared_path is not None:
+        kwargs.setdefault('uri', True)
+    conn = sqlite3.connect(db_path or DB_PATH, **kwargs)
+    for name, value in PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    if shared_path is not None:
+        location = 'file:' + urllib.parse.quote(os.path.abspath(shared_path)) + '?mode=ro'
+        conn.execute('ATTACH DATABASE ? AS shared', (location,))
+        for table in GLOBAL_TABLES:
+            conn.execute(f'CREATE TEMP VIEW {table} AS SELECT * FROM shared.{table}')
+        for table in FENCED_TABLES:
+            conn.execute(f'''
+            CREATE TEMP TRIGGER fence_{table} BEFORE INSERT ON main.{table}
+            WHEN NOT EXISTS (SELECT 1 FROM main.students WHERE id = NEW.student_id)
+            BEGIN SELECT RAISE(ABORT, '{STUDENT_FENCE_ERROR}'); END
+            ''')
+    return conn
+
+def add_column_if_missing(cursor, table, column, definition):
+    """Add a column to a table created by an older version of init_db"""
+    columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def _create_base_tables(cursor):
+    """Migration 1: the original application tables"""
     # User table for both students and teachers
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
@@ -59,17 +136,7 @@ def init_db():
     )''')
 
     # UDISE school data
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS udise_schools (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        udise_code TEXT UNIQUE NOT NULL,
-        school_name TEXT NOT NULL,
-        district TEXT NOT NULL,
-        block TEXT NOT NULL,
-        category TEXT,
-        area TEXT,
-        management TEXT
-    )''')
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS udise_schools ({UDISE_SCHOOLS_COLUMNS})')
 
     # Game/Quiz performance logs - core analytics table
     cursor.execute('''
@@ -88,6 +155,7 @@ def init_db():
         completed INTEGER DEFAULT 1,
         played_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         synced INTEGER DEFAULT 0,
+        client_log_id TEXT,
         FOREIGN KEY (student_id) REFERENCES students (id)
     )''')
     
@@ -131,44 +199,751 @@ def init_db():
         UNIQUE(student_id, subject, grade, topic)
     )''')
 
-    conn.commit()
-    conn.close()
+def _add_client_log_ids(cursor):
+    """Migration 2: idempotency key for offline sync retries"""
+    add_column_if_missing(cursor, 'game_logs', 'client_log_id', 'TEXT')
+    cursor.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_game_logs_client_log_id
+    ON game_logs (student_id, client_log_id)
+    ''')
+
+def _create_rollup_tables(cursor):
+    """Migration 3: dashboard rollups, maintained incrementally by ingest.ingest_logs()"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS student_stats (
+        student_id INTEGER PRIMARY KEY,
+        total_games INTEGER NOT NULL DEFAULT 0,
+        score_pct_sum REAL NOT NULL DEFAULT 0,
+        last_activity TIMESTAMP,
+        FOREIGN KEY (student_id) REFERENCES students (id)
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS student_subject_stats (
+        student_id INTEGER NOT NULL,
+        subject TEXT NOT NULL,
+        total_games INTEGER NOT NULL DEFAULT 0,
+        score_pct_sum REAL NOT NULL DEFAULT 0,
+        last_activity TIMESTAMP,
+        PRIMARY KEY (student_id, subject),
+        FOREIGN KEY (student_id) REFERENCES students (id)
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS school_subject_stats (
+        udise_code TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        grade INTEGER NOT NULL,
+        total_attempts INTEGER NOT NULL DEFAULT 0,
+        score_pct_sum REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (udise_code, subject, grade)
+    )''')
+
+    # Dashboard student list is filtered by school and grade
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_students_udise_grade
+    ON students (udise_code, grade)
+    ''')
+
+    # Backfill rollups for databases that predate them
+    recompute_rollups(cursor)
+
+def _create_school_search_index(cursor):
+    """Migration 4: district/block filters and trigram name index for school search"""
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_udise_schools_district_block
+    ON udise_schools (district, block)
+    ''')
+    if create_search_index(cursor):
+        rebuild_search_index(cursor)
+
+def _add_hot_path_indexes(cursor):
+    """Migration 5: covering indexes for the per-request queries in app.py"""
+    # Per-student history by subject (student_id alone is served by its prefix)
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_game_logs_student_subject_played
+    ON game_logs (student_id, subject, played_at)
+    ''')
+    # verify_otp_api: latest challenge for a contact
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_otp_contact_created
+    ON otp_verifications (contact, created_at)
+    ''')
+    # student_profile: achievements newest first
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_achievements_student_awarded
+    ON achievements (student_id, awarded_at)
+    ''')
+    # Teacher lookups by school
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_teachers_udise
+    ON teachers (udise_code)
+    ''')
+
+def _create_otp_store(cursor):
+    """Migration 6: one live OTP challenge per contact plus rate limit buckets"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS otp_challenges (
+        contact TEXT PRIMARY KEY,
+        otp_hash TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL
+    ) WITHOUT ROWID''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_otp_challenges_expires
+    ON otp_challenges (expires_at)
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+        key TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL
+    ) WITHOUT ROWID''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_rate_limit_buckets_updated
+    ON rate_limit_buckets (updated_at)
+    ''')
+    # Every row ever issued, none of them needed once challenges move over
+    cursor.execute('DROP TABLE IF EXISTS otp_verifications')
+
+def _add_mastery_tracking(cursor):
+    """Migration 7: attempt counts for student_progress, backfilled from game_logs"""
+    add_column_if_missing(cursor, 'student_progress', 'attempts', 'INTEGER NOT NULL DEFAULT 0')
+    recompute_mastery(cursor.connection)
+
+def _create_analytics_buckets(cursor):
+    """Migration 8: daily/weekly activity buckets and cache versions for teacher analytics"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS activity_buckets (
+        scope TEXT NOT NULL,
+        scope_key TEXT NOT NULL,
+        period TEXT NOT NULL,
+        bucket_start TEXT NOT NULL,
+        grade INTEGER NOT NULL,
+        subject TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        score_pct_sum REAL NOT NULL DEFAULT 0,
+        time_spent INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (scope, scope_key, period, bucket_start, grade, subject)
+    ) WITHOUT ROWID''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS analytics_versions (
+        scope_key TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    ) WITHOUT ROWID''')
+    # Keyset pages of a school's students; replaces the (udise_code, grade) index
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_students_udise_grade_name
+    ON students (udise_code, grade, first_name, id)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_students_udise_grade')
+    recompute_analytics(cursor.connection)
+
+def _create_archive_catalog(cursor):
+    """Migration 9: catalog of game_logs archive files written by cold_storage"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS archive_partitions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        path TEXT UNIQUE NOT NULL,
+        state TEXT NOT NULL,
+        district TEXT NOT NULL,
+        month TEXT NOT NULL,
+        row_count INTEGER NOT NULL,
+        min_log_id INTEGER NOT NULL,
+        max_log_id INTEGER NOT NULL,
+        min_played_at TEXT NOT NULL,
+        max_played_at TEXT NOT NULL,
+        score_pct_sum REAL NOT NULL,
+        bytes INTEGER NOT NULL,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_archive_partitions_district_month
+    ON archive_partitions (district, month)
+    ''')
+
+def _create_leaderboards(cursor):
+    """Migration 10: one row per earned badge, points, streaks and leaderboards"""
+    # Keep the oldest copy of badges awarded twice before the unique index
+    cursor.execute('''
+    DELETE FROM achievements WHERE id NOT IN (
+        SELECT MIN(id) FROM achievements GROUP BY student_id, badge_name)
+    ''')
+    cursor.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_achievements_student_badge
+    ON achievements (student_id, badge_name)
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS student_rewards (
+        student_id INTEGER PRIMARY KEY,
+        points INTEGER NOT NULL DEFAULT 0,
+        current_streak INTEGER NOT NULL DEFAULT 0,
+        best_streak INTEGER NOT NULL DEFAULT 0,
+        last_active_day TEXT,
+        FOREIGN KEY (student_id) REFERENCES students (id)
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS leaderboard_entries (
+        scope_key TEXT NOT NULL,
+        student_id INTEGER NOT NULL,
+        points INTEGER NOT NULL,
+        PRIMARY KEY (scope_key, student_id)
+    ) WITHOUT ROWID''')
+    # The leaderboard itself: top N and in-bucket rank counts are range reads
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_leaderboard_entries_rank
+    ON leaderboard_entries (scope_key, points DESC, student_id)
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS leaderboard_buckets (
+        scope_key TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        students INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (scope_key, bucket)
+    ) WITHOUT ROWID''')
+    recompute_achievements(cursor.connection)
+
+def _create_shard_registry(cursor):
+    """Migration 11: shard files, routes overriding the district hash, and the student directory"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS shards (
+        name TEXT PRIMARY KEY,
+        path TEXT UNIQUE NOT NULL,
+        hashed INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    # route_key is 'district:<district>' or 'school:<udise_code>'; a school
+    # route wins over its district's
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS shard_routes (
+        route_key TEXT PRIMARY KEY,
+        district TEXT NOT NULL,
+        shard TEXT NOT NULL
+    ) WITHOUT ROWID''')
+    # Hands out student ids that are unique across shards and tells a login
+    # which school, and so which shard, the student is on
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS student_directory (
+        student_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER UNIQUE,
+        udise_code TEXT NOT NULL,
+        district TEXT NOT NULL
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS shard_moves (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        source TEXT NOT NULL,
+        target TEXT NOT NULL,
+        routes TEXT NOT NULL,
+        students INTEGER NOT NULL,
+        seconds REAL NOT NULL,
+        moved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+def _create_change_feed(cursor):
+    """Migration 12: per-student positions read by /api/sync/changes"""
+    create_change_log(cursor)
+
+def _create_export_jobs(cursor):
+    """Migration 13: background report exports, polled from any worker (see reports.py)"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS export_jobs (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        report TEXT NOT NULL,
+        format TEXT NOT NULL,
+        status TEXT NOT NULL CHECK (status IN ('queued', 'running', 'done', 'failed')),
+        rows_estimate INTEGER,
+        rows_written INTEGER NOT NULL DEFAULT 0,
+        bytes_written INTEGER NOT NULL DEFAULT 0,
+        file_name TEXT NOT NULL,
+        download_name TEXT NOT NULL,
+        error TEXT,
+        worker TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        finished_at REAL
+    )''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_export_jobs_user_status
+    ON export_jobs (user_id, status)
+    ''')
+    # Heartbeats and the sweep of jobs whose worker went away
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_export_jobs_status_updated
+    ON export_jobs (status, updated_at)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_export_jobs_created
+    ON export_jobs (created_at)
+    ''')
+
+def _create_row_counts(cursor):
+    """Migration 14: game_logs row count kept by triggers, read by stats instead of COUNT(*)"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS table_row_counts (
+        table_name TEXT PRIMARY KEY,
+        row_count INTEGER NOT NULL
+    )''')
+    cursor.execute('''
+    INSERT OR REPLACE INTO table_row_counts (table_name, row_count)
+    VALUES ('game_logs', (SELECT COUNT(*) FROM game_logs))
+    ''')
+    # Ingest, archiving and shard moves all insert or delete through SQL, so
+    # the triggers see every change; game_logs is never written with REPLACE
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS game_logs_count_insert
+    AFTER INSERT ON game_logs BEGIN
+        UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'game_logs';
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS game_logs_count_delete
+    AFTER DELETE ON game_logs BEGIN
+        UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'game_logs';
+    END
+    ''')
+
+# Ordered schema migrations: (version, description, function(cursor)).
+# Append new entries; never edit or reorder applied ones.
+MIGRATIONS = [
+    (1, 'base tables', _create_base_tables),
+    (2, 'game log client ids', _add_client_log_ids),
+    (3, 'dashboard rollups', _create_rollup_tables),
+    (4, 'school search index', _create_school_search_index),
+    (5, 'hot path indexes', _add_hot_path_indexes),
+    (6, 'otp store', _create_otp_store),
+    (7, 'mastery tracking', _add_mastery_tracking),
+    (8, 'analytics buckets', _create_analytics_buckets),
+    (9, 'archive catalog', _create_archive_catalog),
+    (10, 'achievements and leaderboards', _create_leaderboards),
+    (11, 'shard registry', _create_shard_registry),
+    (12, 'change feed', _create_change_feed),
+    (13, 'export jobs', _create_export_jobs),
+    (14, 'row counts', _create_row_counts),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Long migrations (rollup backfill, search index build) must not make other
+# starting workers give up waiting for the lock
+MIGRATION_LOCK_TIMEOUT_MS = 600000
+
+def schema_version(conn):
+    """Highest applied migration version, 0 for a new database"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+def migrate(db_path=None):
+    """Apply pending migrations in order; returns the list of versions applied
+
+    Each migration runs in its own BEGIN IMMEDIATE transaction together with
+    its schema_version row, so concurrent workers starting at the same time
+    serialise on the SQLite write lock and each migration is applied once.
+    After applying any, or always with SHIKSHA_CHECK_QUERY_PLANS, the hot
+    queries' plans are checked: a full scan is a warning, or a RuntimeError
+    in check mode.
+    """
+    conn = connect(db_path)
+    conn.execute(f'PRAGMA busy_timeout = {MIGRATION_LOCK_TIMEOUT_MS}')
+    applied = []
+    try:
+        schema_version(conn)
+        for version, description, migration in MIGRATIONS:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if schema_version(conn) >= version:
+                    conn.rollback()
+                    continue
+                migration(conn.cursor())
+                conn.execute(
+                    'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                    (version, description)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append(version)
+            print(f"Applied migration {version}: {description}")
+        if applied or CHECK_QUERY_PLANS:
+            failures = check_query_plans(conn)
+            if failures:
+                scans = '; '.join(f"{name}: {', '.join(lines)}" for name, lines in failures.items())
+                if CHECK_QUERY_PLANS:
+                    raise RuntimeError(f'Hot queries regressed to a full scan in {db_path or DB_PATH}: {scans}')
+                print(f"Warning: hot queries regressed to a full scan: {scans}")
+    finally:
+        conn.close()
+    return applied
+
+@contextlib.contextmanager
+def _init_lock(db_path):
+    """Exclusive lock held by the one process preparing a database file"""
+    if fcntl is None:
+        yield
+        return
+    with open(f'{db_path}.init-lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def prepare_database(db_path=None, udise_csv=None):
+    """Migrate the schema and load UDISE data into an empty register, once across processes
+
+    Gunicorn workers or containers starting together wait on a lock file
+    next to the database while the first one does the work; the others
+    then find nothing left to do. Shard files (SHIKSHA_SHARD_DIR) are
+    created and migrated under the same lock. Returns the migration
+    versions applied to the main database.
+    """
+    from sharding import prepare_shards
+    db_path = db_path or DB_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    with _init_lock(db_path):
+        applied = migrate(db_path)
+        if udise_csv:
+            conn = connect(db_path)
+            try:
+                empty = conn.execute('SELECT 1 FROM udise_schools LIMIT 1').fetchone() is None
+            finally:
+                conn.close()
+            if empty:
+                import_udise_data(udise_csv, db_path=db_path)
+        prepare_shards(db_path)
+    return applied
+
+def init_db():
+    """Initialize the SQLite database and bring its schema up to date"""
+    migrate()
     print("Database initialized successfully!")
 
-def import_udise_data():
+# Per-request queries from app.py and ingest.py; each must stay index-driven
+# as the tables grow. Checked after migrations and by
+# `python database.py check-query-plans`.
+HOT_QUERIES = {
+    'student by user': ('''
+        SELECT s.*, u.email FROM students s
+        JOIN users u ON s.user_id = u.id
+        WHERE s.user_id = ?
+    ''', (1,)),
+    'student id by user': ('SELECT id FROM students WHERE user_id = ?', (1,)),
+    'student directory by user': (
+        'SELECT student_id, udise_code, district FROM student_directory WHERE user_id = ?', (1,)
+    ),
+    'student directory by id': (
+        'SELECT udise_code, district FROM student_directory WHERE student_id = ?', (1,)
+    ),
+    'teacher by user': ('''
+        SELECT t.*, u.email FROM teachers t
+        JOIN users u ON t.user_id = u.id
+        WHERE t.user_id = ?
+    ''', (1,)),
+    'student progress': (
+        'SELECT subject, grade, topic, mastery_level FROM student_progress WHERE student_id = ?', (1,)
+    ),
+    'student achievements': (
+        'SELECT * FROM achievements WHERE student_id = ? ORDER BY awarded_at DESC', (1,)
+    ),
+    'held badges': ('SELECT badge_name FROM achievements WHERE student_id = ?', (1,)),
+    'change feed progress': (FEED_SOURCES[0][2], (1, 0, 500)),
+    'change feed achievements': (FEED_SOURCES[1][2], (1, 0, 500)),
+    'change feed logs': (FEED_SOURCES[2][2], (1, 0, 500)),
+    'change feed probe': (HAS_CHANGES_SQL, (1, 0, 1, 0, 1, 0)),
+    'leaderboard top': ('''
+        SELECT e.student_id, e.points, s.first_name
+        FROM leaderboard_entries e
+        JOIN students s ON s.id = e.student_id
+        WHERE e.scope_key = ?
+        ORDER BY e.points DESC, e.student_id
+        LIMIT 10
+    ''', ('school:1',)),
+    'leaderboard buckets above': (
+        'SELECT SUM(students) FROM leaderboard_buckets WHERE scope_key = ? AND bucket > ?', ('school:1', 5)
+    ),
+    'leaderboard rank in bucket': ('''
+        SELECT COUNT(*) FROM leaderboard_entries
+        WHERE scope_key = ? AND points > ? AND points < ?
+    ''', ('school:1', 5, 6)),
+    'otp challenge': (
+        'SELECT otp_hash, expires_at, attempts FROM otp_challenges WHERE contact = ?', ('x',)
+    ),
+    'rate limit bucket': (
+        'SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?', ('x',)
+    ),
+    'user by contact': ('SELECT * FROM users WHERE email = ? OR mobile = ?', ('x', 'x')),
+    'school by code': ('SELECT * FROM udise_schools WHERE udise_code = ?', ('1',)),
+    'dashboard students': ('''
+        SELECT s.id, s.first_name, st.total_games, st.last_activity
+        FROM students s
+        LEFT JOIN student_stats st ON st.student_id = s.id
+        WHERE s.udise_code = ? AND s.grade = ?
+        ORDER BY s.grade, s.first_name
+    ''', ('1', 6)),
+    'dashboard subjects': ('''
+        SELECT subject, SUM(score_pct_sum) / SUM(total_attempts), SUM(total_attempts)
+        FROM school_subject_stats WHERE udise_code = ? GROUP BY subject
+    ''', ('1',)),
+    'dashboard student page': ('''
+        SELECT s.id, s.first_name, st.total_games
+        FROM students s
+        LEFT JOIN student_stats st ON st.student_id = s.id
+        WHERE s.udise_code = ? AND (s.grade, s.first_name, s.id) > (?, ?, ?)
+        ORDER BY s.grade, s.first_name, s.id LIMIT 100
+    ''', ('1', 6, 'A', 1)),
+    'student location': ('''
+        SELECT s.udise_code, COALESCE(u.district, s.district) FROM students s
+        LEFT JOIN udise_schools u ON u.udise_code = s.udise_code
+        WHERE s.id = ?
+    ''', (1,)),
+    'analytics trends': ('''
+        SELECT bucket_start, subject, SUM(attempts), SUM(score_pct_sum)
+        FROM activity_buckets
+        WHERE scope = ? AND scope_key IN (?, ?) AND period = ? AND bucket_start BETWEEN ? AND ?
+        GROUP BY bucket_start, subject
+    ''', ('school', '1', '2', 'week', '2024-01-01', '2024-06-30')),
+    'analytics district schools': ('''
+        SELECT u.udise_code, SUM(b.attempts)
+        FROM udise_schools u
+        CROSS JOIN activity_buckets b
+          ON b.scope = 'school' AND b.scope_key = u.udise_code AND b.period = ?
+         AND b.bucket_start BETWEEN ? AND ?
+        WHERE u.district = ?
+        GROUP BY u.udise_code
+    ''', ('week', '2024-01-01', '2024-06-30', 'A')),
+    'analytics versions': (
+        'SELECT scope_key, version FROM analytics_versions WHERE scope_key IN (?, ?)', ('a', 'b')
+    ),
+    'archive partitions': ('''
+        SELECT path FROM archive_partitions
+        WHERE district = ? AND max_played_at >= ? AND min_played_at <= ?
+        ORDER BY month, min_log_id
+    ''', ('A', '2023-01-01', '2023-12-31')),
+    'existing client log ids': ('''
+        SELECT client_log_id FROM game_logs
+        WHERE student_id = ? AND client_log_id IN (?, ?)
+    ''', (1, 'a', 'b')),
+    'student subject history': ('''
+        SELECT score, max_score, played_at FROM game_logs
+        WHERE student_id = ? AND subject = ? ORDER BY played_at DESC LIMIT 20
+    ''', (1, 'Mathematics')),
+    'export student batch': ('''
+        SELECT s.id, s.first_name, st.total_games
+        FROM students s
+        LEFT JOIN student_stats st ON st.student_id = s.id
+        WHERE s.udise_code = ? AND (s.grade, s.first_name, s.id) > (?, ?, ?) AND s.grade = ?
+        ORDER BY s.grade, s.first_name, s.id LIMIT 500
+    ''', ('1', 0, '', 0, 6)),
+    'export subject stats': ('''
+        SELECT student_id, subject, total_games FROM student_subject_stats
+        WHERE student_id IN (?, ?) ORDER BY student_id, subject
+    ''', (1, 2)),
+    'export game logs': ('''
+        SELECT id, subject, score, played_at FROM game_logs
+        WHERE student_id = ? AND id > ? AND played_at >= ? AND played_at <= ?
+        ORDER BY id LIMIT 500
+    ''', (1, 0, '2024-01-01', '2024-12-31~')),
+    'export estimate': ('''
+        SELECT COALESCE(SUM(st.total_games), 0) FROM students s
+        JOIN student_stats st ON st.student_id = s.id
+        WHERE s.udise_code = ? AND s.grade = ?
+    ''', ('1', 6)),
+    'export jobs of user': (
+        "SELECT COUNT(*) FROM export_jobs WHERE user_id = ? AND status IN ('queued', 'running')", (1,)
+    ),
+    'export job heartbeat': (
+        "SELECT id FROM export_jobs WHERE status IN ('queued', 'running') AND worker = ?", ('x',)
+    ),
+    'table row count': (
+        'SELECT row_count FROM table_row_counts WHERE table_name = ?', ('game_logs',)
+    ),
+    'schools by district': (
+        'SELECT * FROM udise_schools WHERE district = ? AND block = ? LIMIT 20', ('A', 'B')
+    ),
+}
+
+def full_scans(conn, sql, params=()):
+    """EXPLAIN QUERY PLAN lines that read a whole table or index"""
+    plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    return [row[-1] for row in plan
+            if row[-1].startswith('SCAN') and 'VIRTUAL TABLE' not in row[-1]
+            and row[-1] != 'SCAN CONSTANT ROW']
+
+def check_query_plans(conn=None):
+    """Return {query name: scan lines} for hot queries that regressed to a scan"""
+    own = conn is None
+    conn = conn or connect()
+    try:
+        failures = {}
+        for name, (sql, params) in HOT_QUERIES.items():
+            scans = full_scans(conn, sql, params)
+            if scans:
+                failures[name] = scans
+        return failures
+    finally:
+        if own:
+            conn.close()
+
+def import_udise_data(csv_path='a.csv', chunk_size=None, resume=True, db_path=None):
     """Import UDISE school data from CSV file"""
-    if not os.path.exists('a.csv'):
-        print("Warning: a.csv file not found. UDISE data not imported.")
+    if not os.path.exists(csv_path):
+        print(f"Warning: {csv_path} file not found. UDISE data not imported.")
         return
     
-    conn = sqlite3.connect('shiksha_leap.db')
-    cursor = conn.cursor()
-    
-    # Clear existing data
-    cursor.execute('DELETE FROM udise_schools')
-    
-    with open('a.csv', 'r', encoding='utf-8') as file:
-        csv_reader = csv.DictReader(file)
-        for row in csv_reader:
-            cursor.execute('''
-                INSERT INTO udise_schools 
-                (udise_code, school_name, district, block, category, area, management)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                row['UDISE_Code'],
-                row['School_Name'],
-                row['District'],
-                row['Block'],
-                row.get('Category', ''),
-                row.get('Area', ''),
-                row.get('Management', '')
-            ))
-    
-    conn.commit()
-    count = cursor.execute('SELECT COUNT(*) FROM udise_schools').fetchone()[0]
-    conn.close()
-    print(f"Imported {count} UDISE school records successfully!")
+    from udise_import import DEFAULT_CHUNK_SIZE, import_udise_csv
+    summary = import_udise_csv(csv_path, db_path, chunk_size=chunk_size or DEFAULT_CHUNK_SIZE, resume=resume)
+    print(f"Imported {summary['schools']} UDISE school records successfully! "
+          f"({summary['rows_per_second']} rows/s, {summary['rows_skipped']} skipped)")
+    return summary
+
+def _student_databases():
+    """(shard name, connection) of every database holding student data
+
+    The main database when sharding is off, otherwise each shard.
+    """
+    from sharding import ShardSet
+    shards = ShardSet(DB_PATH, processes=1).load()
+    for name in shards.names():
+        conn = shards.connect(name)
+        try:
+            yield name, conn
+        finally:
+            conn.close()
+
+def _rebuild_source(conn, name=None):
+    """Table or view holding every game log, including archived ones"""
+    from cold_storage import attach_cold_logs, storage_from_env
+    if conn.execute('SELECT 1 FROM archive_partitions LIMIT 1').fetchone() is None:
+        return 'game_logs'
+    if name is None:
+        loaded = attach_cold_logs(conn, storage_from_env())
+    else:
+        loaded = attach_cold_logs(conn, storage_from_env(), own_students_only=True)
+    print(f"Including {loaded} archived game logs{'' if name is None else f' of {name}'}.")
+    return 'all_game_logs'
+
+def _rebuild_each(rebuild):
+    count = 0
+    for name, conn in _student_databases():
+        count += rebuild(conn, _rebuild_source(conn, name))
+    return count
+
+def rebuild_rollups_command():
+    """Recompute the dashboard rollup tables from game_logs"""
+    count = _rebuild_each(rebuild_rollups)
+    print(f"Rebuilt rollups for {count} students successfully!")
+
+def rebuild_mastery_command():
+    """Recompute student_progress mastery estimates from game_logs"""
+    count = _rebuild_each(rebuild_mastery)
+    print(f"Rebuilt mastery for {count} students successfully!")
+
+def rebuild_analytics_command():
+    """Recompute the teacher analytics buckets from game_logs"""
+    count = _rebuild_each(rebuild_analytics)
+    print(f"Rebuilt analytics buckets for {count} schools successfully!")
+
+def rebuild_achievements_command():
+    """Recompute points, streaks and leaderboards from game_logs and award missing badges"""
+    count = _rebuild_each(rebuild_achievements)
+    print(f"Rebuilt leaderboards for {count} students successfully!")
+
+def archive_logs_command(days=None, vacuum=False):
+    """Move old game_logs rows into archive files, optionally shrinking the database files"""
+    from cold_storage import storage_from_env
+    storage = storage_from_env()
+    totals = {'rows': 0, 'files': 0, 'bytes': 0}
+    for name, conn in _student_databases():
+        summary = storage.archive(conn, days)
+        print(f"Archived {summary['rows']} game logs{'' if name is None else f' of {name}'} played before "
+              f"{summary['cutoff']} into {summary['files']} {storage.file_format} files "
+              f"({summary['bytes']} bytes, {summary['seconds']}s)")
+        if vacuum and summary['rows']:
+            # Deleted pages are reused by new logs anyway; VACUUM returns them to the OS
+            conn.execute('VACUUM')
+            print("Vacuumed the database.")
+        for key in totals:
+            totals[key] += summary[key]
+    return totals
+
+def shards_command():
+    """Print the shards with their student counts and the route overrides"""
+    from sharding import ShardSet
+    shards = ShardSet(DB_PATH, processes=1).load()
+    if not shards.enabled:
+        print("Sharding is off; set SHIKSHA_SHARD_DIR to enable it.")
+        return
+    stats = shards.stats()
+    for name, conn in _student_databases():
+        students = conn.execute('SELECT COUNT(*) FROM students').fetchone()[0]
+        logs = conn.execute('SELECT COUNT(*) FROM game_logs').fetchone()[0]
+        info = stats['shards'][name]
+        print(f"{name}\t{'hashed' if info['hashed'] else 'routed'}\t{students} students\t"
+              f"{logs} game logs\t{info['path']}")
+    conn = connect()
+    try:
+        for key, shard in conn.execute('SELECT route_key, shard FROM shard_routes ORDER BY route_key'):
+            print(f"route {key} -> {shard}")
+    finally:
+        conn.close()
+
+def split_shard_command(name):
+    """Move about half of a shard's students to a new shard"""
+    from sharding import split_shard
+    summary = split_shard(DB_PATH, name)
+    print(f"Moved {summary['students']} students from {summary['source']} to {summary['target']} "
+          f"({', '.join(summary['routes'])}) in {summary['seconds']}s")
+    return summary
 
 if __name__ == '__main__':
-    init_db()
-    import_udise_data()
\ No newline at end of file
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'rebuild-rollups':
+        rebuild_rollups_command()
+    elif command == 'rebuild-mastery':
+        rebuild_mastery_command()
+    elif command == 'rebuild-analytics':
+        rebuild_analytics_command()
+    elif command == 'rebuild-achievements':
+        rebuild_achievements_command()
+    elif command == 'archive-logs':
+        # python database.py archive-logs [days] [--vacuum]
+        args = [a for a in sys.argv[2:] if a != '--vacuum']
+        archive_logs_command(float(args[0]) if args else None, vacuum='--vacuum' in sys.argv)
+    elif command == 'migrate':
+        prepare_database()
+    elif command == 'shards':
+        shards_command()
+    elif command == 'split-shard':
+        # python database.py split-shard <shard name>
+        if len(sys.argv) < 3:
+            sys.exit("usage: python database.py split-shard <shard>")
+        try:
+            split_shard_command(sys.argv[2])
+        except ValueError as e:
+            sys.exit(str(e))
+    elif command == 'check-query-plans':
+        failures = check_query_plans()
+        for name, scans in failures.items():
+            print(f"FULL SCAN in {name}: {'; '.join(scans)}")
+        if failures:
+            sys.exit(1)
+        print(f"All {len(HOT_QUERIES)} hot-path queries use indexes.")
+    elif command == 'import-udise':
+        # python database.py import-udise <csv> [chunk_size] [--restart]
+        args = [a for a in sys.argv[2:] if a != '--restart']
+        import_udise_data(
+            args[0] if args else 'a.csv',
+            chunk_size=int(args[1]) if len(args) > 1 else None,
+            resume='--restart' not in sys.argv
+        )
+    else:
+        init_db()
+        import_udise_data()
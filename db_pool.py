@@ -0,0 +1,137 @@
+"""Per-thread SQLite connection pool for the Flask app
+
+Each worker thread keeps one open connection for its lifetime instead of
+opening and closing a file handle per request. Connections carry the WAL
+pragmas from database.connect() and a larger prepared-statement cache, so
+the hot queries in app.py are parsed once per thread rather than per call.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from database import DB_PATH, connect
+
+STATEMENT_CACHE_SIZE = 256
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() returns it to the pool"""
+
+    pool = None
+    checked_out = False
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def close_for_real(self):
+        """Close the underlying SQLite handle"""
+        sqlite3.Connection.close(self)
+
+
+class ConnectionPool:
+    """Hands out one long-lived connection per thread and tracks usage stats"""
+
+    def __init__(self, db_path=None, max_idle_seconds=600, shared_path=None):
+        self.db_path = db_path or DB_PATH
+        # Set for shard pools: the main database every connection attaches
+        self.shared_path = shared_path
+        self.max_idle_seconds = max_idle_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._connections = {}
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'released': 0,
+            'rollbacks': 0,
+            'discarded': 0,
+        }
+
+    def _bump(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _check_fork(self):
+        """Drop connections inherited from a parent process after fork"""
+        pid = os.getpid()
+        if pid != self._pid:
+            with self._lock:
+                # SQLite handles must not be used across fork; forget them
+                # without closing so the parent's locks are left alone.
+                self._connections = {}
+                self._local = threading.local()
+                self._pid = pid
+
+    def _create(self):
+        conn = connect(
+            self.db_path,
+            shared_path=self.shared_path,
+            factory=PooledConnection,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.pool = self
+        with self._lock:
+            self._connections[threading.get_ident()] = conn
+            self._stats['created'] += 1
+        return conn
+
+    def acquire(self):
+        """Return this thread's connection, opening it on first use"""
+        self._check_fork()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and time.monotonic() - self._local.last_used > self.max_idle_seconds:
+            self._discard(conn)
+            conn = None
+        if conn is None:
+            conn = self._create()
+            self._local.conn = conn
+        else:
+            self._bump('reused')
+        self._local.last_used = time.monotonic()
+        conn.checked_out = True
+        return conn
+
+    def release(self, conn):
+        """Finish a unit of work; any uncommitted transaction is rolled back"""
+        if not conn.checked_out:
+            return
+        conn.checked_out = False
+        if conn.in_transaction:
+            conn.rollback()
+            self._bump('rollbacks')
+        self._bump('released')
+
+    def _discard(self, conn):
+        with self._lock:
+            self._connections.pop(threading.get_ident(), None)
+            self._stats['discarded'] += 1
+        self._local.conn = None
+        conn.close_for_real()
+
+    def close_all(self):
+        """Close every connection owned by this process"""
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections = {}
+            self._local = threading.local()
+        for conn in connections:
+            try:
+                conn.close_for_real()
+            except sqlite3.ProgrammingError:
+                # Owned by another thread; it is dropped with that thread
+                pass
+
+    def stats(self):
+        """Snapshot of pool counters for monitoring"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['open'] = len(self._connections)
+        stats['pid'] = self._pid
+        stats['statement_cache_size'] = STATEMENT_CACHE_SIZE
+        return stats
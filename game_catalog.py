@@ -0,0 +1,197 @@
+"""In-memory catalog of the game and quiz JSON files under games/
+
+Every file is parsed and validated once, then kept as compact UTF-8 bytes
+together with gzip (and brotli, when the module is installed) encodings and
+a content hash. serve() answers /games/grade_<n>/<file> from memory with
+strong ETags, If-None-Match revalidation and long-lived Cache-Control, so a
+phone that already has a game never downloads it again. Changed files are
+picked up by polling mtimes at most once every poll_interval seconds.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GRADE_DIR_PATTERN = re.compile(r'^grade_(\d+)$')
+
+# Revalidate at least daily; URLs pinned with ?v=<hash> never change
+CACHE_CONTROL = 'public, max-age=86400, stale-while-revalidate=604800'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class GameEntry:
+    """One pre-serialised game file and its compressed encodings"""
+
+    __slots__ = ('grade', 'name', 'path', 'mtime', 'data', 'body', 'encodings',
+                 'content_hash', 'etag')
+
+    def __init__(self, grade, name, path, mtime, data):
+        self.grade = grade
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.data = data
+        self.body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.content_hash = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = self.content_hash
+        self.encodings = {'gzip': gzip.compress(self.body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.encodings['br'] = brotli.compress(self.body, quality=11)
+
+    @property
+    def size(self):
+        return len(self.body)
+
+    def etag_for(self, encoding):
+        """Each encoding is a distinct representation with its own strong ETag"""
+        return self.etag if encoding is None else f'{self.etag}-{encoding}'
+
+
+def validate_game(data):
+    """Raise ValueError if a parsed file is not a usable game or quiz"""
+    if not isinstance(data, dict):
+        raise ValueError('top level must be an object')
+    if 'game_id' not in data and 'quiz_id' not in data:
+        raise ValueError('missing game_id or quiz_id')
+    for field in ('title', 'subject'):
+        if not data.get(field):
+            raise ValueError(f'missing {field}')
+
+
+def negotiate_encoding(accept_encodings, available):
+    """Pick the best offered encoding the client accepts, or None for identity"""
+    for encoding in ('br', 'gzip'):
+        if encoding in available and accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+class GameCatalog:
+    """Loads games/grade_*/*.json into memory and keeps it fresh"""
+
+    def __init__(self, root, poll_interval=2.0):
+        self.root = root
+        self.poll_interval = poll_interval
+        self._entries = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+        self._last_poll = 0.0
+        self.version = 0
+
+    def _scan(self):
+        """Yield (grade, name, path, mtime) for every game file on disk"""
+        if not os.path.isdir(self.root):
+            return
+        for grade_dir in sorted(os.listdir(self.root)):
+            match = GRADE_DIR_PATTERN.match(grade_dir)
+            grade_path = os.path.join(self.root, grade_dir)
+            if not match or not os.path.isdir(grade_path):
+                continue
+            for name in sorted(os.listdir(grade_path)):
+                if name.endswith('.json'):
+                    path = os.path.join(grade_path, name)
+                    yield int(match.group(1)), name, path, os.stat(path).st_mtime_ns
+
+    def reload(self):
+        """Re-read new or modified files; returns True if anything changed"""
+        with self._lock:
+            entries = {}
+            errors = {}
+            changed = False
+            for grade, name, path, mtime in self._scan():
+                key = (grade, name)
+                current = self._entries.get(key)
+                if current is not None and current.mtime == mtime:
+                    entries[key] = current
+                    continue
+                failed = self._errors.get(path)
+                if failed is not None and failed[0] == mtime:
+                    errors[path] = failed
+                    if current is not None:
+                        entries[key] = current
+                    continue
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    validate_game(data)
+                except (OSError, ValueError) as e:
+                    # Keep serving the last good version of a broken edit
+                    errors[path] = (mtime, str(e))
+                    if current is not None:
+                        entries[key] = current
+                    print(f"Warning: skipping game file {path}: {e}")
+                    continue
+                entries[key] = GameEntry(grade, name, path, mtime, data)
+                changed = True
+            if set(entries) != set(self._entries):
+                changed = True
+            self._entries = entries
+            self._errors = errors
+            self._last_poll = time.monotonic()
+            if changed:
+                self.version += 1
+            return changed
+
+    def _maybe_reload(self):
+        if time.monotonic() - self._last_poll >= self.poll_interval:
+            self.reload()
+
+    def get(self, grade, name):
+        self._maybe_reload()
+        return self._entries.get((grade, name))
+
+    def current_version(self):
+        """Catalog version after picking up any edited files"""
+        self._maybe_reload()
+        return self.version
+
+    def entries(self, grade=None):
+        self._maybe_reload()
+        return [e for key, e in sorted(self._entries.items()) if grade is None or key[0] == grade]
+
+    def stats(self):
+        entries = list(self._entries.values())
+        return {
+            'version': self.version,
+            'files': len(entries),
+            'bytes': sum(e.size for e in entries),
+            'gzip_bytes': sum(len(e.encodings['gzip']) for e in entries),
+            'errors': {path: message for path, (_, message) in self._errors.items()},
+        }
+
+    def serve(self, entry, request):
+        """Build a response for entry honouring Accept-Encoding and If-None-Match"""
+        return serve_entry(entry, request)
+
+
+def serve_entry(entry, request, mimetype='application/json'):
+    """Response for a pre-encoded entry (body, encodings, content_hash, etag_for)
+
+    A request pinned to the content hash with ?v= is cached as immutable.
+    """
+    encoding = negotiate_encoding(request.accept_encodings, entry.encodings)
+    pinned = request.args.get('v') == entry.content_hash
+
+    known_tags = [entry.etag_for(None)] + [entry.etag_for(e) for e in entry.encodings]
+    if any(request.if_none_match.contains(tag) for tag in known_tags):
+        response = Response(status=304)
+    else:
+        body = entry.body if encoding is None else entry.encodings[encoding]
+        response = Response(body, mimetype=mimetype)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(entry.etag_for(encoding))
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if pinned else CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,161 @@
+"""Per-grade game manifests and single-request bundles for offline prefetch
+
+A manifest lists every game of a grade (optionally filtered by medium) with
+its content hash and sizes; its version is a hash of those entries, so all
+workers agree on it without coordination. A bundle packs the grade's game
+JSONs into one gzip-compressed document. A delta bundle only carries the
+entries that differ from the file -> hash map the client sends, so any
+worker can answer it, before or after a restart, without remembering old
+manifests; its `since` is the manifest version of that map.
+"""
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from flask import Response
+
+MAX_CACHED_BUNDLES = 64
+# Files a client may list in one delta request
+MAX_HAVE_FILES = 1000
+
+
+def manifest_version(hashes):
+    """Version of a {file: content hash} map; equal maps give equal versions"""
+    return hashlib.sha256(
+        '\n'.join(f'{name}:{hashes[name]}' for name in sorted(hashes)).encode()
+    ).hexdigest()[:16]
+
+
+def parse_have(have):
+    """Validate the {file: hash} map a client holds; raises ValueError"""
+    if not isinstance(have, dict):
+        raise ValueError('have must be an object of file names to content hashes')
+    if len(have) > MAX_HAVE_FILES:
+        raise ValueError(f'have lists more than {MAX_HAVE_FILES} files')
+    if not all(isinstance(k, str) and isinstance(v, str) for k, v in have.items()):
+        raise ValueError('have must map file names to content hash strings')
+    return have
+
+
+def _entry_mediums(entry):
+    medium = entry.data.get('medium')
+    if medium is None:
+        return None
+    return [medium] if isinstance(medium, str) else list(medium)
+
+
+def _matches_medium(entry, medium):
+    """Games without a 'medium' field are shared by every medium"""
+    mediums = _entry_mediums(entry)
+    return medium is None or mediums is None or medium in mediums
+
+
+class GameManifests:
+    """Builds manifests and compressed bundles on top of a GameCatalog"""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._lock = threading.Lock()
+        self._bundles = OrderedDict()
+
+    def _entries(self, grade, medium):
+        return [e for e in self.catalog.entries(grade) if _matches_medium(e, medium)]
+
+    def manifest(self, grade, medium=None):
+        entries = self._entries(grade, medium)
+        games = []
+        for entry in entries:
+            data = entry.data
+            games.append({
+                'file': entry.name,
+                'id': data.get('game_id') or data.get('quiz_id'),
+                'kind': 'quiz' if 'quiz_id' in data else 'game',
+                'subject': data.get('subject'),
+                'title': data.get('title'),
+                'hash': entry.content_hash,
+                'size': entry.size,
+                'gzip_size': len(entry.encodings['gzip']),
+                'url': f'/games/grade_{grade}/{entry.name}?v={entry.content_hash}',
+            })
+        version = manifest_version({g['file']: g['hash'] for g in games})
+        return {'grade': grade, 'medium': medium, 'version': version, 'games': games}
+
+    def bundle(self, grade, medium=None, since=None, have=None):
+        """Return (version, since, gzip_bytes, raw_size) for a full or delta bundle
+
+        With `have`, the client's {file: hash} map, the bundle holds only the
+        games that differ from it and `since` is that map's version. Without
+        it a `since` equal to the current version gives an empty delta and
+        any other `since` a full bundle (since is then None).
+        """
+        manifest = self.manifest(grade, medium)
+        version = manifest['version']
+        current = {g['file']: g['hash'] for g in manifest['games']}
+        if have is not None:
+            previous = have
+            since = manifest_version(have)
+        elif since == version:
+            previous = current
+        else:
+            previous = None
+            since = None
+
+        # Clients holding the same files send the same map, so deltas are shared
+        cache_key = (grade, medium, version, since)
+        with self._lock:
+            cached = self._bundles.get(cache_key)
+            if cached is not None:
+                self._bundles.move_to_end(cache_key)
+                return cached
+
+        by_name = {e.name: e for e in self._entries(grade, medium)}
+        if previous is None:
+            changed = list(current)
+            removed = []
+        else:
+            changed = [f for f, h in current.items() if previous.get(f) != h]
+            removed = [f for f in previous if f not in current]
+
+        # Splice the catalog's pre-serialised bodies instead of re-encoding them
+        parts = []
+        for name in changed:
+            entry = by_name[name]
+            head = json.dumps({'file': name, 'hash': entry.content_hash})[:-1]
+            parts.append(head.encode() + b',"data":' + entry.body + b'}')
+        header = json.dumps({
+            'grade': grade,
+            'medium': medium,
+            'version': version,
+            'since': since,
+            'full': previous is None,
+            'removed': removed,
+        })[:-1]
+        body = header.encode() + b',"games":[' + b','.join(parts) + b']}'
+
+        result = (version, since, gzip.compress(body, compresslevel=9, mtime=0), len(body))
+        with self._lock:
+            self._bundles[cache_key] = result
+            while len(self._bundles) > MAX_CACHED_BUNDLES:
+                self._bundles.popitem(last=False)
+        return result
+
+
+def bundle_response(request, version, gzip_body, since=None):
+    """Serve a bundle gzip-encoded, revalidated by version"""
+    etag = f'{version}-{since or "full"}'
+    if request.if_none_match.contains(etag) or request.if_none_match.contains(etag + '-gzip'):
+        response = Response(status=304)
+        response.set_etag(etag)
+    elif request.accept_encodings['gzip']:
+        response = Response(gzip_body, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(etag + '-gzip')
+    else:
+        response = Response(gzip.decompress(gzip_body), mimetype='application/json')
+        response.set_etag(etag)
+    # Same URL can return a newer version, so always revalidate (cheap 304)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
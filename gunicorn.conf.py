@@ -0,0 +1,78 @@
+"""Production gunicorn settings: `gunicorn -c gunicorn.conf.py app:app`
+
+The app is imported once in the master (preload_app), which prepares the
+database under a file lock and warms the game, page and UDISE caches before
+any worker is forked; workers inherit the warm caches and open their own
+SQLite connections after the fork. Worker and thread counts are sized from
+the CPU count and can be overridden with the variables below.
+
+    SHIKSHA_BIND            address to listen on (0.0.0.0:5000)
+    SHIKSHA_WORKER_CLASS    gthread (default), gevent or sync
+    WEB_CONCURRENCY         worker processes
+    SHIKSHA_THREADS         threads per gthread worker
+    SHIKSHA_PRELOAD         0 to import the app in every worker instead
+    SHIKSHA_TIMEOUT         seconds before a silent worker is restarted
+"""
+import multiprocessing
+import os
+
+CPUS = multiprocessing.cpu_count()
+
+bind = os.environ.get('SHIKSHA_BIND', '0.0.0.0:5000')
+
+worker_class = os.environ.get('SHIKSHA_WORKER_CLASS', 'gthread')
+if worker_class == 'gevent':
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        print("Warning: gevent is not installed; using gthread workers.")
+        worker_class = 'gthread'
+
+# SQLite takes one writer at a time, so more processes than cores only adds
+# lock contention; requests mostly wait on SQLite or the network, which
+# threads (or greenlets) overlap cheaply.
+if worker_class == 'sync':
+    workers = int(os.environ.get('WEB_CONCURRENCY', CPUS * 2 + 1))
+else:
+    workers = int(os.environ.get('WEB_CONCURRENCY', max(2, CPUS)))
+threads = int(os.environ.get('SHIKSHA_THREADS', 8 if worker_class == 'gthread' else 1))
+worker_connections = 1000
+
+preload_app = os.environ.get('SHIKSHA_PRELOAD', '1') != '0'
+
+timeout = int(os.environ.get('SHIKSHA_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    """Drop anything SQLite-related inherited from the master"""
+    import app
+    # The pool also notices the new pid on first use; doing it here keeps
+    # the parent's connections from ever being touched in the child
+    app.db_pool._check_fork()
+    for pool in app.shards.pools().values():
+        pool._check_fork()
+
+
+def post_worker_init(worker):
+    import app
+    worker.log.info("Worker %s ready; startup %s", worker.pid, app.startup.snapshot())
+
+
+def worker_exit(server, worker):
+    """Commit queued game logs and stop shard query processes before the worker goes away"""
+    import app
+    if app.game_log_queue is not None:
+        app.game_log_queue.close()
+    app.shards.close()
+
+
+def when_ready(server):
+    if preload_app:
+        import app
+        server.log.info("Master ready in %ss; forking %s %s workers", app.startup.ready_seconds,
+                        server.cfg.workers, worker_class)
@@ -0,0 +1,108 @@
+"""Per-worker cache of the logged-in user's student or teacher profile
+
+Authenticated routes need the caller's student_id, teacher_id or udise_code
+on every request. IdentityCache resolves the profile once (at login,
+registration or first use) and keeps it in a bounded LRU with a TTL, so the
+game-log, sync and dashboard paths skip the students/teachers lookups.
+Only found profiles are cached: a user who has not registered yet is looked
+up again next time, and registration invalidates the entry explicitly.
+A loader other than load_profile() can add fields, such as the shard a
+student's data is on.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL_SECONDS = 300
+
+STUDENT_PROFILE_SQL = '''
+    SELECT s.*, u.email, u.mobile FROM students s
+    JOIN users u ON s.user_id = u.id
+    WHERE s.user_id = ?
+'''
+
+TEACHER_PROFILE_SQL = '''
+    SELECT t.*, u.email, u.mobile FROM teachers t
+    JOIN users u ON t.user_id = u.id
+    WHERE t.user_id = ?
+'''
+
+PROFILE_QUERIES = {'student': STUDENT_PROFILE_SQL, 'teacher': TEACHER_PROFILE_SQL}
+
+
+def load_profile(conn, role, user_id):
+    """Read a student or teacher profile as a plain dict, or None"""
+    row = conn.execute(PROFILE_QUERIES[role], (user_id,)).fetchone()
+    return dict(row) if row is not None else None
+
+
+class IdentityCache:
+    """Bounded LRU of profiles keyed by (role, user_id), each expiring after ttl seconds"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL_SECONDS, loader=load_profile):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.loader = loader
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0, 'invalidations': 0}
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            profile, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return profile
+
+    def put(self, role, user_id, profile):
+        with self._lock:
+            key = (role, user_id)
+            self._entries[key] = (profile, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def get(self, role, user_id, get_conn):
+        """Cached profile, loading it with a connection from get_conn() on a miss"""
+        profile = self._lookup((role, user_id))
+        if profile is None:
+            profile = self.refresh(get_conn(), role, user_id)
+        return profile
+
+    def refresh(self, conn, role, user_id):
+        """Re-read a profile from the database and cache it if it exists"""
+        profile = self.loader(conn, role, user_id)
+        if profile is not None:
+            self.put(role, user_id, profile)
+        return profile
+
+    def invalidate(self, user_id):
+        """Forget every cached profile of a user, e.g. after a profile change"""
+        with self._lock:
+            for role in PROFILE_QUERIES:
+                if self._entries.pop((role, user_id), None) is not None:
+                    self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Snapshot of cache counters for monitoring"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        stats['max_entries'] = self.max_entries
+        stats['ttl'] = self.ttl
+        return stats
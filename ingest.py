@@ -0,0 +1,239 @@
+"""Validation and batched insertion of student game logs
+
+Both /api/game-log and /api/sync-offline-data write through ingest_logs(),
+which validates the whole payload first and then inserts every accepted row
+with a single executemany inside one transaction. Offline clients attach a
+client_log_id (a UUID generated on the device) to each log; a unique index on
+(student_id, client_log_id) makes retried uploads idempotent. The dashboard
+rollups in rollups.py, the mastery estimates in mastery.py, the analytics
+buckets in analytics.py and the points, badges and leaderboards in
+achievements.py are updated in the same transaction.
+"""
+import datetime
+
+from achievements import apply_log_achievements
+from analytics import apply_log_analytics
+from mastery import apply_log_mastery
+from rollups import apply_log_rollups
+
+GAME_TYPES = ('game', 'quiz')
+LEVELS = ('easy', 'medium', 'hard')
+MAX_SYNC_BATCH = 2000
+MAX_CLIENT_LOG_ID_LENGTH = 64
+# Upper bounds well inside SQLite's 64-bit integers, so a bad value is one
+# rejected log rather than an OverflowError for the whole batch
+MAX_SCORE = 1000000
+MAX_TIME_SPENT = 86400
+# Date.now() of 9999-12-31, the last moment a datetime can hold
+MAX_TIMESTAMP_MILLIS = 253402300799999
+
+# SQLite builds older than 3.32 cap bound parameters at 999
+LOOKUP_CHUNK_SIZE = 500
+
+INSERT_GAME_LOG_SQL = '''
+    INSERT OR IGNORE INTO game_logs
+    (student_id, subject, grade, game_id, game_type, level, score, max_score,
+     time_spent, played_at, synced, client_log_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+'''
+
+
+class LogValidationError(ValueError):
+    """Raised when a game log in a payload is malformed"""
+
+
+def _as_int(log, field, default=None, minimum=None, maximum=None):
+    value = log.get(field, default)
+    if value is None:
+        raise LogValidationError(f'{field} is required')
+    if isinstance(value, bool):
+        raise LogValidationError(f'{field} must be an integer')
+    try:
+        number = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise LogValidationError(f'{field} must be an integer')
+    if minimum is not None and number < minimum:
+        raise LogValidationError(f'{field} must be at least {minimum}')
+    if maximum is not None and number > maximum:
+        raise LogValidationError(f'{field} must be at most {maximum}')
+    return number
+
+
+def _as_text(log, field, default=None):
+    value = log.get(field, default)
+    if value is None or not str(value).strip():
+        raise LogValidationError(f'{field} is required')
+    return str(value).strip()
+
+
+def format_timestamp(dt):
+    """Format a datetime the way game_logs.played_at stores it"""
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def parse_timestamp(value):
+    """Local naive datetime of an ISO 8601 string ('Z' and offsets allowed), or None"""
+    if not isinstance(value, str):
+        return None
+    text = value.strip()
+    if text.endswith(('Z', 'z')):
+        text = text[:-1] + '+00:00'
+    try:
+        dt = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if dt.tzinfo is not None:
+        # Stored times are server local, like the ones from 'timestamp'
+        try:
+            dt = dt.astimezone().replace(tzinfo=None)
+        except (OverflowError, ValueError, OSError):
+            return None
+    return dt
+
+
+def _played_at(log):
+    if log.get('played_at'):
+        dt = parse_timestamp(log['played_at'])
+        if dt is None:
+            raise LogValidationError('played_at must be an ISO 8601 date and time')
+        return format_timestamp(dt)
+    if log.get('timestamp') is not None:
+        # IndexedDB entries carry Date.now() milliseconds
+        millis = _as_int(log, 'timestamp', minimum=0, maximum=MAX_TIMESTAMP_MILLIS)
+        try:
+            return format_timestamp(datetime.datetime.fromtimestamp(millis / 1000))
+        except (OverflowError, ValueError, OSError):
+            raise LogValidationError('timestamp is out of range')
+    return format_timestamp(datetime.datetime.now())
+
+
+def client_log_id_of(log):
+    """The device-generated idempotency key of a log, if it has one"""
+    if not isinstance(log, dict):
+        return None
+    value = log.get('client_log_id')
+    return str(value) if value is not None else None
+
+
+def validate_log(log):
+    """Normalise one client log into a game_logs row (without student_id)"""
+    if not isinstance(log, dict):
+        raise LogValidationError('log must be an object')
+
+    game_type = log.get('game_type', 'game')
+    if game_type not in GAME_TYPES:
+        raise LogValidationError(f'game_type must be one of {", ".join(GAME_TYPES)}')
+    level = log.get('level', 'medium')
+    if level not in LEVELS:
+        raise LogValidationError(f'level must be one of {", ".join(LEVELS)}')
+
+    client_log_id = client_log_id_of(log)
+    if client_log_id is not None and not 0 < len(client_log_id) <= MAX_CLIENT_LOG_ID_LENGTH:
+        raise LogValidationError('client_log_id is too long')
+
+    return (
+        _as_text(log, 'subject'),
+        _as_int(log, 'grade', minimum=6, maximum=12),
+        _as_text(log, 'game_id'),
+        game_type,
+        level,
+        _as_int(log, 'score', minimum=0, maximum=MAX_SCORE),
+        _as_int(log, 'max_score', minimum=1, maximum=MAX_SCORE),
+        _as_int(log, 'time_spent', default=0, minimum=0, maximum=MAX_TIME_SPENT),
+        _played_at(log),
+        client_log_id,
+    )
+
+
+def _existing_client_ids(conn, student_id, client_log_ids):
+    """Client log ids of this student that are already stored"""
+    ids = list(client_log_ids)
+    existing = set()
+    for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+        chunk = ids[start:start + LOOKUP_CHUNK_SIZE]
+        placeholders = ', '.join('?' * len(chunk))
+        rows = conn.execute(f'''
+            SELECT client_log_id FROM game_logs
+            WHERE student_id = ? AND client_log_id IN ({placeholders})
+        ''', [student_id] + chunk).fetchall()
+        existing.update(row[0] for row in rows)
+    return existing
+
+
+def _insert_accepted(conn, student_id, rows):
+    conn.executemany(INSERT_GAME_LOG_SQL, [(student_id,) + row for row in rows])
+    apply_log_rollups(conn, student_id, rows)
+    apply_log_mastery(conn, student_id, rows)
+    apply_log_analytics(conn, student_id, rows)
+    apply_log_achievements(conn, student_id, rows)
+
+
+def store_rows(conn, student_id, rows):
+    """Insert validated rows inside the caller's write transaction
+
+    Rows whose client_log_id is already stored are skipped; returns the rows
+    that were inserted.
+    """
+    existing = _existing_client_ids(conn, student_id, {row[-1] for row in rows if row[-1] is not None})
+    accepted = [row for row in rows if row[-1] is None or row[-1] not in existing]
+    _insert_accepted(conn, student_id, accepted)
+    return accepted
+
+
+def ingest_logs(conn, student_id, logs):
+    """Validate and insert a batch of logs in one transaction
+
+    Returns one result per input log, in order, with status 'accepted',
+    'duplicate' (already stored, safe to mark synced) or 'rejected'.
+    """
+    results = [None] * len(logs)
+    candidates = []
+    batch_ids = set()
+
+    for index, log in enumerate(logs):
+        client_log_id = client_log_id_of(log)
+        try:
+            row = validate_log(log)
+        except LogValidationError as e:
+            results[index] = {'index': index, 'client_log_id': client_log_id,
+                              'status': 'rejected', 'error': str(e)}
+            continue
+        if client_log_id is not None:
+            if client_log_id in batch_ids:
+                results[index] = {'index': index, 'client_log_id': client_log_id,
+                                  'status': 'duplicate'}
+                continue
+            batch_ids.add(client_log_id)
+        candidates.append((index, row))
+
+    if candidates:
+        # Take the write lock before the duplicate check so a concurrent
+        # retry of the same upload cannot slip in between check and insert
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            existing = _existing_client_ids(conn, student_id, batch_ids)
+            accepted = []
+            for index, row in candidates:
+                client_log_id = row[-1]
+                if client_log_id is not None and client_log_id in existing:
+                    status = 'duplicate'
+                else:
+                    status = 'accepted'
+                    accepted.append(row)
+                results[index] = {'index': index, 'client_log_id': client_log_id,
+                                  'status': status}
+            _insert_accepted(conn, student_id, accepted)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return results
+
+
+def summarize(results):
+    """Count results by status"""
+    counts = {'accepted': 0, 'duplicate': 0, 'rejected': 0}
+    for result in results:
+        counts[result['status']] += 1
+    return counts
@@ -0,0 +1,507 @@
+"""Per-request timing, SQL accounting and Prometheus metrics for app.py
+
+Every request records its wall time, Python CPU time, payload sizes and the
+number and duration of SQL statements run through the connection returned by
+get_db_connection(). Time spent inside SQLite calls is split into CPU and
+off-CPU time; off-CPU time is what the thread spent blocked on database locks
+(busy_timeout sleeps) or disk, which is how lock contention shows up apart
+from slow Python. render() returns all of it in Prometheus text format.
+
+StartupTimer records how long each cold start phase took until the process
+was ready for traffic.
+
+An optional sampling profiler (SHIKSHA_PROFILE_SLOW_MS) captures stacks of
+in-flight requests and appends them in flamegraph "folded" format for any
+request slower than the threshold.
+"""
+import contextlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+PROFILE_FILE = 'slow_requests.folded'
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    """Monotonic counter keyed by label values"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values=(), amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield f'{self.name}{_format_labels(self.labels, label_values)} {value}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        names = self.labels + ('le',)
+        for label_values, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket{_format_labels(names, label_values + (bound,))} {cumulative}'
+            yield f'{self.name}_bucket{_format_labels(names, label_values + ("+Inf",))} {count}'
+            yield f'{self.name}_sum{_format_labels(self.labels, label_values)} {total}'
+            yield f'{self.name}_count{_format_labels(self.labels, label_values)} {count}'
+
+
+class Gauge:
+    """Value read from a callback at scrape time; may return a number or {labels: value}"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, callback, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.callback = callback
+
+    def samples(self):
+        value = self.callback()
+        if isinstance(value, dict):
+            for label_values, item in sorted(value.items()):
+                if not isinstance(label_values, tuple):
+                    label_values = (label_values,)
+                yield f'{self.name}{_format_labels(self.labels, label_values)} {item}'
+        elif value is not None:
+            yield f'{self.name} {value}'
+
+
+class Metrics:
+    """Registry of metrics rendered together at /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, callback, labels=()):
+        return self._register(Gauge(name, help_text, callback, labels))
+
+    def render(self):
+        """Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+class StartupTimer:
+    """Durations of the cold start phases of this process, up to ready
+
+    Optional phases (cache warmup) are skipped once `budget` seconds have
+    passed, so a slow disk delays readiness by at most the budget plus
+    the required phases.
+    """
+
+    def __init__(self, budget=None):
+        self.started = time.monotonic()
+        self.budget = budget
+        self.phases = {}
+        self.skipped = []
+        self.ready_seconds = None
+        self._pid = os.getpid()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def over_budget(self):
+        return self.budget is not None and self.elapsed() > self.budget
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.monotonic() - started, 4)
+
+    def skip(self, name):
+        self.skipped.append(name)
+        print(f"Warning: startup budget of {self.budget}s exceeded; skipping {name}")
+
+    def mark_ready(self):
+        self.ready_seconds = round(self.elapsed(), 4)
+
+    @property
+    def ready(self):
+        return self.ready_seconds is not None
+
+    def snapshot(self):
+        return {
+            'ready': self.ready,
+            'ready_seconds': self.ready_seconds,
+            'budget_seconds': self.budget,
+            'phases': dict(self.phases),
+            'skipped': list(self.skipped),
+            # With preload_app the phases ran once in the gunicorn master
+            'inherited': self._pid != os.getpid(),
+        }
+
+
+class RequestStats:
+    """Counters for one in-flight request"""
+
+    __slots__ = ('route', 'method', 'started', 'cpu_started', 'sql_statements', 'sql_seconds',
+                 'sql_cpu_seconds', 'sql_busy_errors', 'in_sql', 'samples')
+
+    def __init__(self, route, method):
+        self.route = route
+        self.method = method
+        self.started = time.perf_counter()
+        self.cpu_started = time.thread_time()
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.sql_cpu_seconds = 0.0
+        self.sql_busy_errors = 0
+        self.in_sql = False
+        self.samples = None
+
+
+def _timed(stats, count, call, *args):
+    """Run a SQLite call, charging wall and CPU time to the request"""
+    if stats is None:
+        return call(*args)
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+    stats.in_sql = True
+    try:
+        return call(*args)
+    except sqlite3.OperationalError as e:
+        if 'locked' in str(e) or 'busy' in str(e):
+            stats.sql_busy_errors += 1
+        raise
+    finally:
+        stats.in_sql = False
+        stats.sql_statements += count
+        stats.sql_seconds += time.perf_counter() - started
+        stats.sql_cpu_seconds += time.thread_time() - cpu_started
+
+
+class InstrumentedCursor:
+    """Cursor proxy that also charges row fetching to the request"""
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, sql, parameters=()):
+        _timed(self._stats, 1, self._cursor.execute, sql, parameters)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        _timed(self._stats, 1, self._cursor.executemany, sql, seq_of_parameters)
+        return self
+
+    def fetchone(self):
+        return _timed(self._stats, 0, self._cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return _timed(self._stats, 0, self._cursor.fetchmany)
+        return _timed(self._stats, 0, self._cursor.fetchmany, size)
+
+    def fetchall(self):
+        return _timed(self._stats, 0, self._cursor.fetchall)
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+
+class InstrumentedConnection:
+    """Connection proxy that counts and times every statement of a request"""
+
+    def __init__(self, conn, stats):
+        self._conn = conn
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def cursor(self, *args):
+        return InstrumentedCursor(self._conn.cursor(*args), self._stats)
+
+    def execute(self, sql, parameters=()):
+        return InstrumentedCursor(
+            _timed(self._stats, 1, self._conn.execute, sql, parameters), self._stats
+        )
+
+    def executemany(self, sql, seq_of_parameters):
+        return InstrumentedCursor(
+            _timed(self._stats, 1, self._conn.executemany, sql, seq_of_parameters), self._stats
+        )
+
+    def executescript(self, script):
+        return InstrumentedCursor(_timed(self._stats, 1, self._conn.executescript, script), self._stats)
+
+    def commit(self):
+        _timed(self._stats, 1, self._conn.commit)
+
+    def rollback(self):
+        _timed(self._stats, 1, self._conn.rollback)
+
+    def close(self):
+        self._conn.close()
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class SamplingProfiler:
+    """Samples the stacks of in-flight requests on a background thread"""
+
+    def __init__(self, slow_ms, output_dir, interval=0.005):
+        self.slow_ms = slow_ms
+        self.output_dir = output_dir
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.dumped = 0
+
+    def _ensure_running(self):
+        # A thread started before a gunicorn fork does not exist in the worker
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                    self._pid = os.getpid()
+                    self._active = {}
+                    self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                    self._thread.start()
+
+    def start(self, stats):
+        self._ensure_running()
+        stats.samples = {}
+        with self._lock:
+            self._active[threading.get_ident()] = stats
+
+    def stop(self, stats):
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for ident, stats in active:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.reverse()
+                if stats.in_sql:
+                    stack.append('[sqlite]')
+                key = ';'.join(stack)
+                stats.samples[key] = stats.samples.get(key, 0) + 1
+
+    def maybe_dump(self, stats, duration_ms):
+        """Append folded stacks for a slow request; returns True if written"""
+        if duration_ms < self.slow_ms or not stats.samples:
+            return False
+        root = f'{stats.method} {stats.route}'.replace(';', ':').replace(' ', '_')
+        lines = [f'{root};{stack} {count}' for stack, count in stats.samples.items()]
+        with self._write_lock:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(os.path.join(self.output_dir, PROFILE_FILE), 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+            self.dumped += 1
+        print(f"Warning: slow request {stats.method} {stats.route} took {duration_ms:.0f}ms; "
+              f"stacks appended to {os.path.join(self.output_dir, PROFILE_FILE)}")
+        return True
+
+
+class Instrumentation:
+    """Flask hooks that time requests and feed the metrics registry"""
+
+    def __init__(self, app=None, profiler=None):
+        self.metrics = Metrics()
+        self.profiler = profiler
+        labels = ('route', 'method')
+        self.requests = self.metrics.counter(
+            'shiksha_http_requests_total', 'Requests served', ('route', 'method', 'status'))
+        self.duration = self.metrics.histogram(
+            'shiksha_http_request_duration_seconds', 'Wall time per request', labels)
+        self.cpu = self.metrics.counter(
+            'shiksha_http_request_cpu_seconds_total', 'Python CPU time spent in requests', labels)
+        self.sql_statements = self.metrics.histogram(
+            'shiksha_sql_statements_per_request', 'SQL statements per request', labels,
+            buckets=SQL_COUNT_BUCKETS)
+        self.sql_seconds = self.metrics.histogram(
+            'shiksha_sql_seconds_per_request', 'Wall time inside SQLite calls per request', labels)
+        self.sql_lock_wait = self.metrics.histogram(
+            'shiksha_sql_lock_wait_seconds_per_request',
+            'Off-CPU time inside SQLite calls (lock waits and disk) per request', labels)
+        self.sql_busy = self.metrics.counter(
+            'shiksha_sql_busy_errors_total', 'SQLite "database is locked" errors', labels)
+        self.request_bytes = self.metrics.histogram(
+            'shiksha_http_request_bytes', 'Request body size', labels, buckets=SIZE_BUCKETS)
+        self.response_bytes = self.metrics.histogram(
+            'shiksha_http_response_bytes', 'Response body size', labels, buckets=SIZE_BUCKETS)
+        self.slow = self.metrics.counter(
+            'shiksha_http_slow_requests_total', 'Requests over the profiling threshold', labels)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        stats = RequestStats(route, request.method)
+        g._request_stats = stats
+        if self.profiler is not None:
+            self.profiler.start(stats)
+
+    def current(self):
+        """Stats of the request being served, or None outside a request"""
+        return g.get('_request_stats') if has_request_context() else None
+
+    def wrap(self, conn):
+        """Instrument a connection for the current request"""
+        stats = self.current()
+        return conn if stats is None else InstrumentedConnection(conn, stats)
+
+    def _after_request(self, response):
+        stats = g.get('_request_stats')
+        if stats is None:
+            return response
+        duration = time.perf_counter() - stats.started
+        cpu = time.thread_time() - stats.cpu_started
+        labels = (stats.route, stats.method)
+
+        self.requests.inc(labels + (str(response.status_code),))
+        self.duration.observe(labels, duration)
+        self.cpu.inc(labels, cpu)
+        self.sql_statements.observe(labels, stats.sql_statements)
+        self.sql_seconds.observe(labels, stats.sql_seconds)
+        self.sql_lock_wait.observe(labels, max(0.0, stats.sql_seconds - stats.sql_cpu_seconds))
+        if stats.sql_busy_errors:
+            self.sql_busy.inc(labels, stats.sql_busy_errors)
+        if request.content_length is not None:
+            self.request_bytes.observe(labels, request.content_length)
+        if not response.is_streamed:
+            self.response_bytes.observe(labels, response.calculate_content_length() or 0)
+
+        if self.profiler is not None:
+            self.profiler.stop(stats)
+            if self.profiler.maybe_dump(stats, duration * 1000):
+                self.slow.inc(labels)
+        return response
+
+    def _teardown_request(self, exc):
+        stats = g.pop('_request_stats', None)
+        if stats is not None and self.profiler is not None:
+            self.profiler.stop(stats)
+
+
+def profiler_from_env():
+    """SamplingProfiler configured by SHIKSHA_PROFILE_* variables, or None when disabled"""
+    slow_ms = os.environ.get('SHIKSHA_PROFILE_SLOW_MS')
+    if not slow_ms:
+        return None
+    return SamplingProfiler(
+        float(slow_ms),
+        os.environ.get('SHIKSHA_PROFILE_DIR', 'profiles'),
+        float(os.environ.get('SHIKSHA_PROFILE_INTERVAL_MS', '5')) / 1000.0,
+    )
@@ -0,0 +1,203 @@
+"""Server-side locale catalogs and a cache of rendered page fragments
+
+static/locales/*.json are read once at startup, completed with English for
+any missing key and frozen, so every worker translates from read-only
+mappings without touching the disk again. Each language, and all of them
+merged into one document, is pre-serialised and compressed with a content
+hash that serves as its ETag; /api/locales hands these bodies out the way
+the game catalog serves game files.
+
+Pages whose markup only depends on a student's grade and language are
+rendered once per (template, grade, language, version) and kept in a
+FragmentCache. The version combines the locale hash with the game catalog
+version, so editing a game or a locale file simply stops the old entries
+from being looked up and the LRU drops them.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+
+from markupsafe import Markup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_LANGUAGE = 'en'
+# students.medium / teachers.medium -> locale file
+MEDIUM_LANGUAGES = {'English': 'en', 'Hindi': 'hi', 'Tamil': 'ta', 'Odia': 'od'}
+LANGUAGE_COOKIE = 'shikshaLanguage'
+
+DEFAULT_FRAGMENT_CACHE_SIZE = 512
+
+
+class LocaleBundle:
+    """One pre-serialised locale document and its compressed encodings"""
+
+    __slots__ = ('body', 'encodings', 'content_hash', 'etag')
+
+    def __init__(self, document):
+        self.body = json.dumps(document, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.content_hash = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = self.content_hash
+        self.encodings = {'gzip': gzip.compress(self.body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.encodings['br'] = brotli.compress(self.body, quality=11)
+
+    @property
+    def size(self):
+        return len(self.body)
+
+    def etag_for(self, encoding):
+        return self.etag if encoding is None else f'{self.etag}-{encoding}'
+
+
+def _read_locale(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        messages = json.load(f)
+    if not isinstance(messages, dict):
+        raise ValueError('top level must be an object')
+    for key, value in messages.items():
+        if not isinstance(value, str):
+            raise ValueError(f'{key} must be a string')
+    return messages
+
+
+class LocaleCatalog:
+    """Every locale file, loaded once and frozen"""
+
+    def __init__(self, root, default=DEFAULT_LANGUAGE):
+        self.root = root
+        self.default = default
+        self.messages = MappingProxyType({})
+        self.missing = MappingProxyType({})
+        self.hashes = MappingProxyType({})
+        self.version = ''
+        self._bundles = {}
+
+    def load(self):
+        """Read static/locales/*.json; a broken file is skipped, a broken default is fatal"""
+        raw = {}
+        for name in sorted(os.listdir(self.root)):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                raw[name[:-5]] = _read_locale(path)
+            except (OSError, ValueError) as e:
+                if name[:-5] == self.default:
+                    raise
+                print(f"Warning: skipping locale file {path}: {e}")
+        if self.default not in raw:
+            raise ValueError(f'missing default locale {self.default}.json')
+
+        fallback = raw[self.default]
+        messages = {}
+        missing = {}
+        for lang, own in raw.items():
+            merged = dict(fallback)
+            merged.update(own)
+            messages[lang] = MappingProxyType(merged)
+            missing[lang] = tuple(sorted(set(fallback) - set(own)))
+
+        bundles = {}
+        hashes = {}
+        for lang, merged in messages.items():
+            bundle = LocaleBundle({'lang': lang, 'messages': dict(merged)})
+            bundles[lang] = bundle
+            hashes[lang] = bundle.content_hash
+        version = hashlib.sha256(
+            '\n'.join(f'{lang}:{h}' for lang, h in sorted(hashes.items())).encode()
+        ).hexdigest()[:16]
+        bundles[None] = LocaleBundle({
+            'version': version,
+            'default': self.default,
+            'hashes': hashes,
+            'locales': {lang: dict(merged) for lang, merged in messages.items()},
+        })
+
+        self.messages = MappingProxyType(messages)
+        self.missing = MappingProxyType(missing)
+        self.hashes = MappingProxyType(hashes)
+        self._bundles = bundles
+        self.version = version
+        return self
+
+    @property
+    def languages(self):
+        return tuple(self.messages)
+
+    def bundle(self, lang=None):
+        """Pre-serialised document for one language, or every language merged (lang=None)"""
+        return self._bundles.get(lang)
+
+    def translate(self, lang, key, default=None):
+        messages = self.messages.get(lang) or self.messages.get(self.default, {})
+        value = messages.get(key)
+        if value is None:
+            return key if default is None else default
+        return value
+
+    def language_for(self, request, profile=None):
+        """?lang=, then the language cookie set by main.js, then the profile's medium"""
+        for lang in (request.args.get('lang'), request.cookies.get(LANGUAGE_COOKIE)):
+            if lang in self.messages:
+                return lang
+        if profile is not None:
+            lang = MEDIUM_LANGUAGES.get(profile['medium'])
+            if lang in self.messages:
+                return lang
+        return self.default
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'languages': {
+                lang: {'keys': len(messages), 'missing': len(self.missing[lang]),
+                       'hash': self.hashes[lang], 'bytes': self._bundles[lang].size,
+                       'gzip_bytes': len(self._bundles[lang].encodings['gzip'])}
+                for lang, messages in self.messages.items()
+            },
+        }
+
+
+class FragmentCache:
+    """LRU of rendered markup keyed by (template, grade, language, version)"""
+
+    def __init__(self, max_entries=DEFAULT_FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key, render):
+        """Cached markup for key, rendering it with render() on a miss"""
+        with self._lock:
+            markup = self._entries.get(key)
+            if markup is not None:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return markup
+            self._stats['misses'] += 1
+        # Rendering outside the lock; two threads missing together both render
+        markup = Markup(render())
+        with self._lock:
+            self._entries[key] = markup
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return markup
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), max_entries=self.max_entries)
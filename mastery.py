@@ -0,0 +1,249 @@
+"""Bayesian Knowledge Tracing over game logs, stored in student_progress
+
+Each game a student plays is a topic. student_progress.mastery_level holds
+the probability that the student has mastered it, and every new game_logs
+row updates that probability in place: the score fraction is soft evidence
+of a correct answer, followed by the BKT learning transition. Only the new
+logs and the student's current progress rows are read, so the cost of an
+insert never depends on how much history a student has.
+
+apply_log_mastery() runs in the same transaction as the game_logs insert,
+like the dashboard rollups. Batches spanning many topics (write-behind group
+commits, rebuilds) are traced with NumPy, stepping every topic forward
+together, when NumPy is installed; otherwise the same update runs in plain
+Python.
+"""
+from collections import defaultdict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+P_INIT = 0.2
+P_TRANSIT = 0.1
+P_SLIP = 0.1
+# Guessing a hard game right is less likely than an easy one
+P_GUESS = {'easy': 0.3, 'medium': 0.2, 'hard': 0.1}
+
+MASTERED = 0.95
+# Recommend games a student is most likely to learn from: not yet mastered,
+# closest to this probability
+TARGET_MASTERY = 0.6
+
+# Below this many topics NumPy's per-step overhead outweighs vectorising
+VECTORIZE_MIN_TOPICS = 200
+# Students traced together when rebuilding from scratch
+REBUILD_BATCH_STUDENTS = 1000
+
+UPSERT_PROGRESS_SQL = '''
+    INSERT INTO student_progress
+    (student_id, subject, grade, topic, mastery_level, last_activity, total_time_spent, attempts)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (student_id, subject, grade, topic) DO UPDATE SET
+        mastery_level = excluded.mastery_level,
+        last_activity = MAX(COALESCE(last_activity, ''), excluded.last_activity),
+        total_time_spent = total_time_spent + excluded.total_time_spent,
+        attempts = attempts + excluded.attempts
+'''
+
+
+def bkt_step(p, correct, guess, slip=P_SLIP, transit=P_TRANSIT):
+    """One BKT update for evidence `correct` in [0, 1]; works on floats and arrays"""
+    if_correct = p * (1 - slip) / (p * (1 - slip) + (1 - p) * guess)
+    if_wrong = p * slip / (p * slip + (1 - p) * (1 - guess))
+    posterior = correct * if_correct + (1 - correct) * if_wrong
+    return posterior + (1 - posterior) * transit
+
+
+def _trace_python(priors, sequences):
+    result = []
+    for p, observations in zip(priors, sequences):
+        for correct, guess in observations:
+            p = bkt_step(p, correct, guess)
+        result.append(p)
+    return result
+
+
+def _trace_numpy(priors, sequences):
+    """Advance all topics one observation at a time, longest sequences first"""
+    order = sorted(range(len(sequences)), key=lambda i: -len(sequences[i]))
+    lengths = numpy.array([len(sequences[i]) for i in order])
+    flat = numpy.array([obs for i in order for obs in sequences[i]], dtype=float).reshape(-1, 2)
+    steps = int(lengths[0]) if len(lengths) else 0
+    rows = numpy.repeat(numpy.arange(len(order)), lengths)
+    cols = numpy.arange(len(flat)) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+    correct = numpy.zeros((len(order), steps))
+    guess = numpy.full((len(order), steps), P_GUESS['medium'])
+    correct[rows, cols] = flat[:, 0]
+    guess[rows, cols] = flat[:, 1]
+
+    p = numpy.array([priors[i] for i in order], dtype=float)
+    # Topics still active at each step form a prefix because of the sort
+    active = numpy.searchsorted(-lengths, -numpy.arange(1, steps + 1), side='right')
+    for step in range(steps):
+        n = active[step]
+        p[:n] = bkt_step(p[:n], correct[:n, step], guess[:n, step])
+    result = [0.0] * len(order)
+    for position, i in enumerate(order):
+        result[i] = float(p[position])
+    return result
+
+
+def trace(priors, sequences):
+    """Final mastery per topic given its prior and ordered (correct, guess) observations"""
+    if numpy is not None and len(sequences) >= VECTORIZE_MIN_TOPICS:
+        return _trace_numpy(priors, sequences)
+    return _trace_python(priors, sequences)
+
+
+def _observations(rows):
+    """Group validated log rows into per-topic observation sequences ordered by played_at"""
+    topics = defaultdict(lambda: {'observations': [], 'time_spent': 0, 'last': ''})
+    for subject, grade, game_id, _game_type, level, score, max_score, time_spent, played_at, _client_id \
+            in sorted(rows, key=lambda row: row[8]):
+        topic = topics[(subject, grade, game_id)]
+        topic['observations'].append((min(score / max_score, 1.0), P_GUESS.get(level, P_GUESS['medium'])))
+        topic['time_spent'] += time_spent or 0
+        topic['last'] = max(topic['last'], played_at)
+    return topics
+
+
+def apply_mastery_batch(conn, rows_by_student):
+    """Fold newly inserted game_logs rows of several students into student_progress
+
+    rows are validated tuples as produced by ingest.validate_log(). The
+    caller owns the transaction. Logs are applied in played_at order within
+    the batch; a log synced later than newer ones is applied after them.
+    All topics of all students are traced together.
+    """
+    keys = []
+    priors = []
+    sequences = []
+    for student_id, rows in rows_by_student.items():
+        if not rows:
+            continue
+        current = {
+            (subject, grade, topic): mastery
+            for subject, grade, topic, mastery in conn.execute('''
+                SELECT subject, grade, topic, mastery_level FROM student_progress WHERE student_id = ?
+            ''', (student_id,))
+        }
+        for key, topic in _observations(rows).items():
+            keys.append((student_id, key, topic))
+            priors.append(current.get(key, P_INIT))
+            sequences.append(topic['observations'])
+
+    mastery = trace(priors, sequences)
+    conn.executemany(UPSERT_PROGRESS_SQL, [
+        (student_id, subject, grade, game_id, probability, topic['last'],
+         topic['time_spent'], len(topic['observations']))
+        for (student_id, (subject, grade, game_id), topic), probability in zip(keys, mastery)
+    ])
+
+
+def apply_log_mastery(conn, student_id, rows):
+    """Fold one student's newly inserted game_logs rows into student_progress"""
+    if rows:
+        apply_mastery_batch(conn, {student_id: rows})
+
+
+def recompute_mastery(conn, source='game_logs'):
+    """Rebuild student_progress from game_logs (or a view including archived logs)"""
+    conn.execute('DELETE FROM student_progress')
+    reader = conn.cursor()
+    reader.execute(f'''
+        SELECT student_id, subject, grade, game_id, game_type, level, score, max_score,
+               time_spent, played_at, client_log_id
+        FROM {source}
+        ORDER BY student_id
+    ''')
+    students = 0
+    batch = defaultdict(list)
+    for row in reader:
+        if row[0] not in batch and len(batch) >= REBUILD_BATCH_STUDENTS:
+            apply_mastery_batch(conn, batch)
+            students += len(batch)
+            batch = defaultdict(list)
+        batch[row[0]].append(tuple(row[1:]))
+    apply_mastery_batch(conn, batch)
+    return students + len(batch)
+
+
+def rebuild_mastery(conn, source='game_logs'):
+    """Recompute student_progress from game_logs in one transaction"""
+    with conn:
+        return recompute_mastery(conn, source)
+
+
+def _game_aliases(entry):
+    """Names a game may be logged under: its id, file name or player path"""
+    stem = entry.name[:-5] if entry.name.endswith('.json') else entry.name
+    game_id = entry.data.get('game_id') or entry.data.get('quiz_id')
+    return {game_id, entry.name, stem, f'grade_{entry.grade}/{stem}', f'grade_{entry.grade}/{entry.name}'}
+
+
+def _matches(entry, aliases, topic):
+    if topic in aliases:
+        return True
+    # The grade page logs short ids such as grade_6/number_ninja
+    short = topic.rsplit('/', 1)[-1]
+    game_id = entry.data.get('game_id') or entry.data.get('quiz_id') or ''
+    return bool(short) and game_id.endswith('_' + short)
+
+
+def student_mastery(conn, student_id, grade=None, subject=None):
+    """Progress rows of a student, optionally for one grade and subject"""
+    sql = '''
+        SELECT subject, grade, topic, mastery_level, attempts, total_time_spent, last_activity
+        FROM student_progress WHERE student_id = ?
+    '''
+    params = [student_id]
+    if grade is not None:
+        sql += ' AND grade = ?'
+        params.append(grade)
+    if subject:
+        sql += ' AND subject = ?'
+        params.append(subject)
+    sql += ' ORDER BY subject, topic'
+    return [
+        {'subject': r[0], 'grade': r[1], 'topic': r[2], 'mastery': round(r[3], 4),
+         'mastered': r[3] >= MASTERED, 'attempts': r[4], 'time_spent': r[5], 'last_activity': r[6]}
+        for r in conn.execute(sql, params)
+    ]
+
+
+def recommend_game(entries, progress, subject=None):
+    """Pick the catalog game a student should play next
+
+    Unplayed games count as P_INIT. Mastered games are skipped; among the
+    rest the one closest to TARGET_MASTERY wins, then the least recently
+    played. Returns None when everything is mastered.
+    """
+    best = None
+    for entry in entries:
+        if subject and entry.data.get('subject') != subject:
+            continue
+        aliases = _game_aliases(entry)
+        played = [p for p in progress
+                  if p['grade'] == entry.grade and _matches(entry, aliases, p['topic'])]
+        mastery = max((p['mastery'] for p in played), default=P_INIT)
+        if mastery >= MASTERED:
+            continue
+        last = max((p['last_activity'] or '' for p in played), default='')
+        key = (abs(mastery - TARGET_MASTERY), last)
+        if best is None or key < best[0]:
+            best = (key, entry, mastery, played)
+    if best is None:
+        return None
+    _, entry, mastery, played = best
+    return {
+        'file': entry.name,
+        'id': entry.data.get('game_id') or entry.data.get('quiz_id'),
+        'title': entry.data.get('title'),
+        'subject': entry.data.get('subject'),
+        'grade': entry.grade,
+        'mastery': round(mastery, 4),
+        'reason': 'practice' if played else 'new',
+        'url': f'/games/grade_{entry.grade}/{entry.name}?v={entry.content_hash}',
+    }
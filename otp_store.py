@@ -0,0 +1,239 @@
+"""Expiring OTP challenges and token-bucket rate limits shared by all workers
+
+Each contact has at most one live challenge in otp_challenges, keyed by the
+contact itself, so issuing and verifying are primary-key lookups that cost
+the same no matter how many logins came before. Only an HMAC of the code is
+stored. send-otp requests draw from two token buckets (per contact and per
+client IP) kept in rate_limit_buckets; both tables live in the app database,
+which every gunicorn worker already shares. A background sweeper in each
+worker deletes expired challenges and idle buckets in small batches.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+
+from database import DB_PATH, connect
+
+DEFAULT_TTL_SECONDS = 600
+DEFAULT_MAX_ATTEMPTS = 5
+# (burst capacity, tokens refilled per minute)
+DEFAULT_CONTACT_LIMIT = (3, 1.0)
+DEFAULT_IP_LIMIT = (60, 30.0)
+DEFAULT_SWEEP_INTERVAL = 60
+SWEEP_BATCH_SIZE = 500
+# A bucket idle this long has refilled completely and can be forgotten
+BUCKET_IDLE_SECONDS = 3600
+
+VERIFIED = 'verified'
+INVALID = 'invalid'
+EXPIRED = 'expired'
+TOO_MANY_ATTEMPTS = 'too_many_attempts'
+
+
+class RateLimited(Exception):
+    """Raised by issue() when a bucket is empty; carries the seconds until a retry can succeed"""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f'Too many OTP requests for this {scope}')
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class OtpStore:
+    """Issues and verifies one-time codes stored in SQLite"""
+
+    def __init__(self, secret, db_path=None, ttl=DEFAULT_TTL_SECONDS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, contact_limit=DEFAULT_CONTACT_LIMIT,
+                 ip_limit=DEFAULT_IP_LIMIT, sweep_interval=DEFAULT_SWEEP_INTERVAL, fixed_code=None):
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self.db_path = db_path or DB_PATH
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.contact_limit = contact_limit
+        self.ip_limit = ip_limit
+        self.sweep_interval = sweep_interval
+        self.fixed_code = fixed_code
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._sweeper_pid = None
+        self._stats = {'issued': 0, 'rate_limited': 0, 'verified': 0, 'failed': 0,
+                       'swept_challenges': 0, 'swept_buckets': 0}
+
+    def _bump(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def generate(self):
+        """A fresh 6-digit code (or the fixed code configured for load tests)"""
+        return self.fixed_code or str(secrets.randbelow(900000) + 100000)
+
+    def _digest(self, contact, otp):
+        return hmac.new(self.secret, f'{contact}:{otp}'.encode(), hashlib.sha256).hexdigest()
+
+    def _take_tokens(self, conn, buckets, now):
+        """Consume one token from every bucket, or none if any is empty"""
+        states = []
+        for scope, key, (capacity, per_minute) in buckets:
+            rate = per_minute / 60.0
+            row = conn.execute(
+                'SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?', (key,)
+            ).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+            if tokens < 1:
+                raise RateLimited(scope, max(1, int((1 - tokens) / rate + 0.999)))
+            states.append((key, tokens - 1))
+        conn.executemany('''
+            INSERT INTO rate_limit_buckets (key, tokens, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at
+        ''', [(key, tokens, now) for key, tokens in states])
+
+    def issue(self, conn, contact, ip=None):
+        """Create or replace the contact's challenge and return the code
+
+        Raises RateLimited when the contact or IP bucket is empty.
+        """
+        self._ensure_sweeper()
+        now = time.time()
+        buckets = [('contact', f'otp:contact:{contact}', self.contact_limit)]
+        if ip:
+            buckets.append(('address', f'otp:ip:{ip}', self.ip_limit))
+        otp = self.generate()
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._take_tokens(conn, buckets, now)
+            conn.execute('''
+                INSERT INTO otp_challenges (contact, otp_hash, expires_at, attempts, created_at)
+                VALUES (?, ?, ?, 0, ?)
+                ON CONFLICT (contact) DO UPDATE SET
+                    otp_hash = excluded.otp_hash,
+                    expires_at = excluded.expires_at,
+                    attempts = 0,
+                    created_at = excluded.created_at
+            ''', (contact, self._digest(contact, otp), now + self.ttl, now))
+            conn.commit()
+        except RateLimited:
+            conn.rollback()
+            self._bump('rate_limited')
+            raise
+        except Exception:
+            conn.rollback()
+            raise
+        self._bump('issued')
+        return otp
+
+    def verify(self, conn, contact, otp):
+        """Check a code; returns VERIFIED, INVALID, EXPIRED or TOO_MANY_ATTEMPTS
+
+        A verified or exhausted challenge is deleted, so every code works once.
+        """
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT otp_hash, expires_at, attempts FROM otp_challenges WHERE contact = ?',
+                (contact,)
+            ).fetchone()
+            if row is None:
+                status = INVALID
+            elif row[1] <= now:
+                status = EXPIRED
+                conn.execute('DELETE FROM otp_challenges WHERE contact = ?', (contact,))
+            elif hmac.compare_digest(row[0], self._digest(contact, otp)):
+                status = VERIFIED
+                conn.execute('DELETE FROM otp_challenges WHERE contact = ?', (contact,))
+            elif row[2] + 1 >= self.max_attempts:
+                status = TOO_MANY_ATTEMPTS
+                conn.execute('DELETE FROM otp_challenges WHERE contact = ?', (contact,))
+            else:
+                status = INVALID
+                conn.execute(
+                    'UPDATE otp_challenges SET attempts = attempts + 1 WHERE contact = ?', (contact,)
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self._bump('verified' if status == VERIFIED else 'failed')
+        return status
+
+    def sweep(self, conn, now=None):
+        """Delete expired challenges and idle buckets in small batches"""
+        now = now or time.time()
+        swept = {'challenges': 0, 'buckets': 0}
+        for name, sql, params in (
+            ('challenges', '''
+                DELETE FROM otp_challenges WHERE contact IN (
+                    SELECT contact FROM otp_challenges WHERE expires_at <= ? LIMIT ?)
+            ''', (now,)),
+            ('buckets', '''
+                DELETE FROM rate_limit_buckets WHERE key IN (
+                    SELECT key FROM rate_limit_buckets WHERE updated_at <= ? LIMIT ?)
+            ''', (now - BUCKET_IDLE_SECONDS,)),
+        ):
+            while True:
+                # Short transactions so logins never wait behind a big delete
+                with conn:
+                    deleted = conn.execute(sql, params + (SWEEP_BATCH_SIZE,)).rowcount
+                swept[name] += deleted
+                if deleted < SWEEP_BATCH_SIZE:
+                    break
+        self._bump('swept_challenges', swept['challenges'])
+        self._bump('swept_buckets', swept['buckets'])
+        return swept
+
+    def _ensure_sweeper(self):
+        """Start this worker's sweeper thread on first use (after any fork)"""
+        if not self.sweep_interval or (self._sweeper_pid == os.getpid() and self._sweeper.is_alive()):
+            return
+        with self._lock:
+            if self._sweeper_pid == os.getpid() and self._sweeper.is_alive():
+                return
+            self._sweeper_pid = os.getpid()
+            self._sweeper = threading.Thread(target=self._sweep_forever, name='otp-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def _sweep_forever(self):
+        conn = connect(self.db_path)
+        try:
+            while True:
+                # Jitter so workers started together do not sweep in lockstep
+                time.sleep(self.sweep_interval * (0.5 + secrets.randbelow(1000) / 1000.0))
+                try:
+                    self.sweep(conn)
+                except Exception as e:
+                    print(f"Warning: OTP sweep failed: {e}")
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Snapshot of OTP counters for this worker"""
+        with self._lock:
+            return dict(self._stats)
+
+
+def _limit_from_env(prefix, default):
+    return (
+        float(os.environ.get(f'{prefix}_BURST', default[0])),
+        float(os.environ.get(f'{prefix}_PER_MINUTE', default[1])),
+    )
+
+
+def store_from_env(secret, db_path=None):
+    """OtpStore configured by OTP_* environment variables"""
+    fixed_code = os.environ.get('OTP_FIXED_CODE') or None
+    if fixed_code:
+        print("Warning: OTP_FIXED_CODE is set; every login code is the same. Use only for load tests.")
+    return OtpStore(
+        secret,
+        db_path,
+        ttl=float(os.environ.get('OTP_TTL_SECONDS', DEFAULT_TTL_SECONDS)),
+        max_attempts=int(os.environ.get('OTP_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)),
+        contact_limit=_limit_from_env('OTP_CONTACT', DEFAULT_CONTACT_LIMIT),
+        ip_limit=_limit_from_env('OTP_IP', DEFAULT_IP_LIMIT),
+        sweep_interval=float(os.environ.get('OTP_SWEEP_SECONDS', DEFAULT_SWEEP_INTERVAL)),
+        fixed_code=fixed_code,
+    )
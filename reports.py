@@ -0,0 +1,620 @@
+"""Streaming CSV and XLSX exports of student results
+
+Teachers export their school, a list of schools or their whole district (the
+scopes of the analytics endpoints) as one of three reports:
+
+    students    one row per student with their dashboard rollups
+    subjects    one row per student and subject from student_subject_stats
+    games       one row per game log, archived logs first
+
+Students are read school by school in keyset batches of the (udise_code,
+grade, first_name, id) index and game logs student by student on
+(student_id, id), so every query is an index range and memory stays flat
+however large the district. Each batch is its own short read; no snapshot
+is held open for the length of a download, which would keep the WAL from
+being checkpointed. Archived logs are read a partition file at a time and
+matched to the exported schools by looking their students up in chunks.
+
+The writers turn rows into byte chunks of about CHUNK_BYTES: CSV with a BOM
+so spreadsheet programs detect UTF-8, and XLSX written by zipfile onto a
+stream that is never seeked, with inline strings instead of a shared string
+table that would have to be held until the end. gzip_chunks() compresses a
+CSV download on the fly.
+
+ExportJobs runs an export in a background thread instead, writing the file
+under the export directory and its progress to the export_jobs table, so
+whichever worker a progress poll or download reaches can answer it.
+"""
+import csv
+import datetime
+import io
+import os
+import queue
+import re
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+import zipfile
+import zlib
+from xml.sax.saxutils import escape
+
+from database import connect
+
+REPORT_COLUMNS = {
+    'students': ('student_id', 'first_name', 'last_name', 'grade', 'udise_code', 'school_name', 'district',
+                 'total_games', 'avg_score', 'last_activity'),
+    'subjects': ('student_id', 'first_name', 'last_name', 'grade', 'udise_code', 'school_name', 'subject',
+                 'total_games', 'avg_score', 'last_activity'),
+    'games': ('student_id', 'first_name', 'last_name', 'student_grade', 'udise_code', 'school_name', 'log_id',
+              'subject', 'grade', 'game_id', 'game_type', 'level', 'score', 'max_score', 'score_pct',
+              'time_spent', 'attempts', 'completed', 'played_at'),
+}
+FORMATS = ('csv', 'xlsx')
+
+# Students per keyset batch and game logs per read; SQLite builds older
+# than 3.32 cap bound parameters at 999
+EXPORT_BATCH_ROWS = 500
+CHUNK_BYTES = 64 * 1024
+# Rows in one worksheet, header included
+XLSX_MAX_ROWS = 1048576
+# Cells starting with these are run as formulas by spreadsheet programs
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+DEFAULT_EXPORT_DIR = 'exports'
+DEFAULT_EXPORT_WORKERS = 1
+DEFAULT_EXPORT_TTL_HOURS = 24
+DEFAULT_MAX_ACTIVE_JOBS = 2
+# Streamed responses hold a request thread; bigger exports go to a job
+DEFAULT_STREAM_MAX_ROWS = 200000
+HEARTBEAT_SECONDS = 2.0
+# A queued or running job not heard of for this long lost its worker
+STALE_SECONDS = 120
+INTERRUPTED_ERROR = 'The export was interrupted, please start it again'
+
+STUDENT_BATCH_SQL = '''
+    SELECT s.id, s.first_name, s.last_name, s.grade, s.udise_code, s.school_name, s.district,
+           COALESCE(st.total_games, 0), st.score_pct_sum / st.total_games, st.last_activity
+    FROM students s
+    LEFT JOIN student_stats st ON st.student_id = s.id
+    WHERE s.udise_code = ? AND (s.grade, s.first_name, s.id) > (?, ?, ?)
+'''
+
+GAME_LOG_BATCH_SQL = '''
+    SELECT id, subject, grade, game_id, game_type, level, score, max_score, time_spent,
+           attempts, completed, played_at
+    FROM game_logs WHERE student_id = ? AND id > ?
+'''
+
+ESTIMATE_SQL = {
+    'students': 'SELECT COUNT(*) FROM students s WHERE s.udise_code = ?',
+    'subjects': '''
+        SELECT COUNT(*) FROM students s
+        JOIN student_subject_stats ss ON ss.student_id = s.id
+        WHERE s.udise_code = ?
+    ''',
+    # Archived logs included, date filters not: an upper bound
+    'games': '''
+        SELECT COALESCE(SUM(st.total_games), 0) FROM students s
+        JOIN student_stats st ON st.student_id = s.id
+        WHERE s.udise_code = ?
+    ''',
+}
+
+
+def export_params(args):
+    """(report, format, grade, since, until) of an export request, raising ValueError"""
+    report = args.get('report', 'students')
+    if report not in REPORT_COLUMNS:
+        raise ValueError(f'report must be one of {", ".join(REPORT_COLUMNS)}')
+    file_format = args.get('format', 'csv')
+    if file_format not in FORMATS:
+        raise ValueError(f'format must be one of {", ".join(FORMATS)}')
+    grade = args.get('grade')
+    if grade not in (None, ''):
+        try:
+            grade = int(grade)
+        except (TypeError, ValueError):
+            raise ValueError('grade must be a number')
+    else:
+        grade = None
+    since = args.get('since') or None
+    until = args.get('until') or None
+    try:
+        for value in (since, until):
+            if value is not None:
+                datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError('since and until must be dates (YYYY-MM-DD)')
+    if since and until and since > until:
+        raise ValueError('since must not be after until')
+    return report, file_format, grade, since, until
+
+
+def _played_range(since, until):
+    """played_at bounds of a date range; until covers the whole day, whatever the time format"""
+    return since, (until + '~') if until else None
+
+
+def iter_students(conn, udise_codes, grade=None, batch_size=EXPORT_BATCH_ROWS):
+    """Batches of student rows of each school in turn, ordered by grade and name"""
+    sql = STUDENT_BATCH_SQL
+    if grade is not None:
+        sql += ' AND s.grade = ?'
+    sql += ' ORDER BY s.grade, s.first_name, s.id LIMIT ?'
+    for udise_code in udise_codes:
+        after = (0, '', 0)
+        while True:
+            params = [udise_code, *after] + ([grade] if grade is not None else []) + [batch_size]
+            rows = [tuple(row) for row in conn.execute(sql, params)]
+            if rows:
+                yield rows
+            if len(rows) < batch_size:
+                break
+            after = (rows[-1][3], rows[-1][1], rows[-1][0])
+
+
+def _average(value):
+    return round(value, 2) if value is not None else None
+
+
+def student_rows(conn, storage, udise_codes, district, grade=None, since=None, until=None):
+    for batch in iter_students(conn, udise_codes, grade):
+        for row in batch:
+            yield row[:8] + (_average(row[8]), row[9])
+
+
+def subject_rows(conn, storage, udise_codes, district, grade=None, since=None, until=None):
+    for batch in iter_students(conn, udise_codes, grade):
+        placeholders = ', '.join('?' * len(batch))
+        subjects = {}
+        for student_id, subject, games, average, last_activity in conn.execute(f'''
+            SELECT student_id, subject, total_games, score_pct_sum / total_games, last_activity
+            FROM student_subject_stats WHERE student_id IN ({placeholders})
+            ORDER BY student_id, subject
+        ''', [row[0] for row in batch]):
+            subjects.setdefault(student_id, []).append((subject, games, _average(average), last_activity))
+        for row in batch:
+            for subject in subjects.get(row[0], ()):
+                yield row[:6] + subject
+
+
+def _game_row(student, log):
+    """Output row of a student's (id, first, last, grade, udise, school) and a log tuple"""
+    score, max_score = log[6], log[7]
+    score_pct = round(score * 100.0 / max_score, 2) if max_score else None
+    return student[:6] + log[:8] + (score_pct,) + log[8:12]
+
+
+def _archived_game_rows(conn, rows, udise_codes, grade):
+    student_ids = sorted({row[1] for row in rows})
+    placeholders = ', '.join('?' * len(student_ids))
+    students = {row[0]: tuple(row) for row in conn.execute(f'''
+        SELECT id, first_name, last_name, grade, udise_code, school_name
+        FROM students WHERE id IN ({placeholders})
+    ''', student_ids)}
+    for row in rows:
+        student = students.get(row[1])
+        if student is None or student[4] not in udise_codes or (grade is not None and student[3] != grade):
+            continue
+        # Cold rows are in LOG_COLUMN_NAMES order: id, student_id, then the logged fields
+        yield _game_row(student, (row[0],) + tuple(row[2:13]))
+
+
+def game_rows(conn, storage, udise_codes, district, grade=None, since=None, until=None):
+    since, until = _played_range(since, until)
+    if storage is not None:
+        # Partitions are per district; keep the rows of students of the exported schools
+        codes = set(udise_codes)
+        chunk = []
+        for row in storage.iter_cold_rows(conn, district=district, since=since, until=until):
+            chunk.append(row)
+            if len(chunk) == EXPORT_BATCH_ROWS:
+                yield from _archived_game_rows(conn, chunk, codes, grade)
+                chunk = []
+        if chunk:
+            yield from _archived_game_rows(conn, chunk, codes, grade)
+
+    sql = GAME_LOG_BATCH_SQL
+    filters = []
+    if since is not None:
+        sql += ' AND played_at >= ?'
+        filters.append(since)
+    if until is not None:
+        sql += ' AND played_at <= ?'
+        filters.append(until)
+    sql += ' ORDER BY id LIMIT ?'
+    for batch in iter_students(conn, udise_codes, grade):
+        for student in batch:
+            after = 0
+            while True:
+                logs = [tuple(row) for row in conn.execute(sql, [student[0], after] + filters + [EXPORT_BATCH_ROWS])]
+                for log in logs:
+                    yield _game_row(student, log)
+                if len(logs) < EXPORT_BATCH_ROWS:
+                    break
+                after = logs[-1][0]
+
+
+REPORT_ROWS = {
+    'students': student_rows,
+    'subjects': subject_rows,
+    'games': game_rows,
+}
+
+
+def export_rows(report, parts, district, grade=None, since=None, until=None):
+    """Rows of a report over parts, (conn, cold storage, udise codes) of each shard in turn"""
+    rows = REPORT_ROWS[report]
+    for conn, storage, udise_codes in parts:
+        yield from rows(conn, storage, udise_codes, district, grade, since, until)
+
+
+def estimate_rows(conn, report, udise_codes, grade=None):
+    """Rows a report over these schools will have, about; games counts archived and all dates"""
+    sql = ESTIMATE_SQL[report]
+    params = []
+    if grade is not None:
+        sql += ' AND s.grade = ?'
+        params.append(grade)
+    return sum(conn.execute(sql, [code] + params).fetchone()[0] for code in udise_codes)
+
+
+def _csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_chunks(columns, rows, chunk_bytes=CHUNK_BYTES):
+    """UTF-8 CSV of a header and rows as byte chunks of about chunk_bytes"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_csv_cell(value) for value in row])
+        if buffer.tell() >= chunk_bytes:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+XLSX_PARTS = (
+    ('[Content_Types].xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+     '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+     '<Default Extension="xml" ContentType="application/xml"/>'
+     '<Override PartName="/xl/workbook.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+     '<Override PartName="/xl/worksheets/sheet1.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+     '</Types>'),
+    ('_rels/.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" Target="xl/workbook.xml" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+     '</Relationships>'),
+    ('xl/workbook.xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+     'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+     '<sheets><sheet name="Report" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    ('xl/_rels/workbook.xml.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+     '</Relationships>'),
+)
+SHEET_HEAD = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+              '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+SHEET_TAIL = '</sheetData></worksheet>'
+
+
+def _xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value!r}</v></c>'
+    text = escape(INVALID_XML_CHARS.sub('', str(value)))
+    space = ' xml:space="preserve"' if text != text.strip() else ''
+    return f'<c t="inlineStr"><is><t{space}>{text}</t></is></c>'
+
+
+def _xlsx_row(values):
+    # Cells without a reference fill the row left to right, so empty ones stay as <c/>
+    return '<row>' + ''.join(_xlsx_cell(value) for value in values) + '</row>'
+
+
+class _ChunkSink:
+    """Write-only file for zipfile; take() hands back what was written since the last call"""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def xlsx_chunks(columns, rows, chunk_bytes=CHUNK_BYTES, max_rows=XLSX_MAX_ROWS):
+    """Single-sheet XLSX workbook of a header and rows as byte chunks
+
+    Rows past the worksheet limit are left out; callers check the estimate
+    first. zipfile sees a stream without tell() and writes data
+    descriptors after each member instead of seeking back.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, body in XLSX_PARTS:
+            archive.writestr(name, body)
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            pending = [SHEET_HEAD, _xlsx_row(columns)]
+            size = 0
+            for written, row in enumerate(rows, 2):
+                if written > max_rows:
+                    break
+                text = _xlsx_row(row)
+                pending.append(text)
+                size += len(text)
+                if size >= chunk_bytes:
+                    sheet.write(''.join(pending).encode('utf-8'))
+                    pending = []
+                    size = 0
+                    data = sink.take()
+                    if data:
+                        yield data
+            pending.append(SHEET_TAIL)
+            sheet.write(''.join(pending).encode('utf-8'))
+    yield sink.take()
+
+
+def gzip_chunks(chunks, level=6):
+    """gzip stream of byte chunks, compressed as they come"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def file_chunks(columns, rows, file_format):
+    return (xlsx_chunks if file_format == 'xlsx' else csv_chunks)(columns, rows)
+
+
+def counted(rows, progress):
+    """Pass rows through, reporting each to progress()"""
+    for row in rows:
+        progress()
+        yield row
+
+
+class ExportJobs:
+    """Background exports run by this worker; state lives in export_jobs for every worker to read
+
+    submit() queues a job with a produce(progress) callable returning its
+    byte chunks; the rows it passes through progress() are counted and, at
+    most every HEARTBEAT_SECONDS, written to the job row together with a
+    heartbeat for every unfinished job of this worker. A job whose worker
+    stopped beating is reported as failed. Finished jobs and their files are
+    removed after ttl_hours.
+    """
+
+    def __init__(self, db_path, export_dir=DEFAULT_EXPORT_DIR, workers=DEFAULT_EXPORT_WORKERS,
+                 ttl_hours=DEFAULT_EXPORT_TTL_HOURS, max_active=DEFAULT_MAX_ACTIVE_JOBS):
+        self.db_path = db_path
+        self.export_dir = export_dir
+        self.workers = workers
+        self.ttl = ttl_hours * 3600
+        self.max_active = max_active
+        self._lock = threading.Lock()
+        self._queue = None
+        self._queue_pid = None
+        self._running = 0
+        self._stats = {'submitted': 0, 'done': 0, 'failed': 0, 'refused': 0, 'expired': 0, 'rows': 0}
+
+    def _worker_name(self):
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    def _jobs_queue(self):
+        """This process's job queue, with its threads started on first use (after any fork)"""
+        with self._lock:
+            if self._queue is None or self._queue_pid != os.getpid():
+                self._queue = queue.Queue()
+                self._queue_pid = os.getpid()
+                for index in range(self.workers):
+                    threading.Thread(target=self._work, name=f'export-{index}', daemon=True).start()
+            return self._queue
+
+    def path(self, file_name):
+        return os.path.join(self.export_dir, file_name)
+
+    def submit(self, conn, user_id, report, file_format, download_name, estimate, produce):
+        """Queue an export and return its status, or None when the user has max_active unfinished
+
+        conn is a main database connection, committed here.
+        """
+        now = time.time()
+        self.expire(conn, now)
+        active = conn.execute('''
+            SELECT COUNT(*) FROM export_jobs WHERE user_id = ? AND status IN ('queued', 'running')
+        ''', (user_id,)).fetchone()[0]
+        if active >= self.max_active:
+            with self._lock:
+                self._stats['refused'] += 1
+            return None
+        job_id = secrets.token_hex(16)
+        extension = 'xlsx' if file_format == 'xlsx' else 'csv.gz'
+        conn.execute('''
+            INSERT INTO export_jobs
+            (id, user_id, report, format, status, rows_estimate, file_name, download_name, worker,
+             created_at, updated_at)
+            VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?)
+        ''', (job_id, user_id, report, file_format, estimate, f'{job_id}.{extension}', download_name,
+              self._worker_name(), now, now))
+        conn.commit()
+        with self._lock:
+            self._stats['submitted'] += 1
+        self._jobs_queue().put((job_id, produce))
+        return self.get(conn, job_id, user_id)
+
+    def get(self, conn, job_id, user_id):
+        """Status of a job of this user, or None"""
+        row = conn.execute('''
+            SELECT id, report, format, status, rows_estimate, rows_written, bytes_written, file_name,
+                   download_name, error, created_at, updated_at, finished_at
+            FROM export_jobs WHERE id = ? AND user_id = ?
+        ''', (job_id, user_id)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(('id', 'report', 'format', 'status', 'rows_estimate', 'rows_written', 'bytes',
+                        'file_name', 'download_name', 'error', 'created_at', 'updated_at', 'finished_at'),
+                       tuple(row)))
+        if job['status'] in ('queued', 'running') and job['updated_at'] < time.time() - STALE_SECONDS:
+            job['status'] = 'failed'
+            job['error'] = INTERRUPTED_ERROR
+        if job['status'] == 'done':
+            job['progress'] = 1.0
+        elif job['rows_estimate']:
+            # The games estimate is an upper bound, so stop short of done
+            job['progress'] = round(min(0.99, job['rows_written'] / job['rows_estimate']), 3)
+        else:
+            job['progress'] = 0.0
+        job['expires_at'] = job['created_at'] + self.ttl
+        return job
+
+    def expire(self, conn, now=None):
+        """Fail jobs whose worker went away and delete jobs older than the TTL with their files"""
+        now = now or time.time()
+        conn.execute('''
+            UPDATE export_jobs SET status = 'failed', error = ?, finished_at = ?
+            WHERE status IN ('queued', 'running') AND updated_at < ?
+        ''', (INTERRUPTED_ERROR, now, now - STALE_SECONDS))
+        expired = conn.execute(
+            'SELECT id, file_name FROM export_jobs WHERE created_at < ?', (now - self.ttl,)
+        ).fetchall()
+        for job_id, file_name in expired:
+            for path in (self.path(file_name), self.path(file_name) + '.part'):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            conn.execute('DELETE FROM export_jobs WHERE id = ?', (job_id,))
+        conn.commit()
+        if expired:
+            with self._lock:
+                self._stats['expired'] += len(expired)
+        return len(expired)
+
+    def _work(self):
+        jobs = self._queue
+        while True:
+            job_id, produce = jobs.get()
+            with self._lock:
+                self._running += 1
+            try:
+                self._run(job_id, produce)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+    def _heartbeat(self, conn, job_id, rows, status='running'):
+        try:
+            now = time.time()
+            conn.execute('UPDATE export_jobs SET status = ?, rows_written = ? WHERE id = ?',
+                         (status, rows, job_id))
+            conn.execute('''
+                UPDATE export_jobs SET updated_at = ?
+                WHERE status IN ('queued', 'running') AND worker = ?
+            ''', (now, self._worker_name()))
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            # A busy database only delays the progress shown
+            conn.rollback()
+            print(f"Warning: export progress update failed: {e}")
+
+    def _run(self, job_id, produce):
+        conn = connect(self.db_path)
+        path = None
+        rows = [0]
+        try:
+            file_name = conn.execute('SELECT file_name FROM export_jobs WHERE id = ?', (job_id,)).fetchone()[0]
+            path = self.path(file_name)
+            os.makedirs(self.export_dir, exist_ok=True)
+            self._heartbeat(conn, job_id, 0)
+            next_beat = [time.monotonic() + HEARTBEAT_SECONDS]
+
+            def progress(count=1):
+                rows[0] += count
+                if time.monotonic() >= next_beat[0]:
+                    self._heartbeat(conn, job_id, rows[0])
+                    next_beat[0] = time.monotonic() + HEARTBEAT_SECONDS
+
+            size = 0
+            with open(path + '.part', 'wb') as out:
+                for chunk in produce(progress):
+                    out.write(chunk)
+                    size += len(chunk)
+            os.replace(path + '.part', path)
+            now = time.time()
+            conn.execute('''
+                UPDATE export_jobs SET status = 'done', rows_written = ?, bytes_written = ?,
+                    updated_at = ?, finished_at = ?
+                WHERE id = ?
+            ''', (rows[0], size, now, now, job_id))
+            conn.commit()
+            with self._lock:
+                self._stats['done'] += 1
+                self._stats['rows'] += rows[0]
+        except Exception as e:
+            conn.rollback()
+            if path is not None:
+                try:
+                    os.remove(path + '.part')
+                except FileNotFoundError:
+                    pass
+            now = time.time()
+            conn.execute('''
+                UPDATE export_jobs SET status = 'failed', error = ?, rows_written = ?, updated_at = ?,
+                    finished_at = ?
+                WHERE id = ?
+            ''', (str(e), rows[0], now, now, job_id))
+            conn.commit()
+            with self._lock:
+                self._stats['failed'] += 1
+            print(f"Warning: export {job_id} failed: {e}")
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Snapshot of export job counters for this worker"""
+        with self._lock:
+            stats = dict(self._stats, running=self._running, workers=self.workers)
+            stats['queued'] = self._queue.qsize() if self._queue_pid == os.getpid() else 0
+        return stats
+
+
+def jobs_from_env(db_path):
+    """ExportJobs configured by SHIKSHA_EXPORT_* environment variables"""
+    return ExportJobs(
+        db_path,
+        export_dir=os.environ.get('SHIKSHA_EXPORT_DIR', DEFAULT_EXPORT_DIR),
+        workers=int(os.environ.get('SHIKSHA_EXPORT_WORKERS', DEFAULT_EXPORT_WORKERS)),
+        ttl_hours=float(os.environ.get('SHIKSHA_EXPORT_TTL_HOURS', DEFAULT_EXPORT_TTL_HOURS)),
+        max_active=int(os.environ.get('SHIKSHA_EXPORT_MAX_ACTIVE', DEFAULT_MAX_ACTIVE_JOBS)),
+    )
@@ -0,0 +1,237 @@
+"""Fast JSON encoding and negotiated compression for API responses
+
+JSONProvider sends every jsonify() through dumps(): orjson when it is
+installed, otherwise the standard library encoder with compact separators
+and without ASCII escaping, so an Odia or Hindi name costs its UTF-8 bytes
+instead of six bytes a character as \\uXXXX. Keys keep insertion order
+(Flask sorted them on every call) and output is never pretty printed.
+
+List endpoints answer ?shape=table with table(): the column names once and
+one list per row, instead of repeating every key in every row. Rows go from
+the cursor to the encoder as tuples without building a dict per row.
+
+Compressor is an after_request hook that gzip- or brotli-encodes (brotli
+when the module is installed) JSON, HTML and other text bodies of at least
+min_bytes for clients that accept it. Smaller bodies gain little over the
+headers and cost CPU on both ends. Strong ETags are weakened on compressed
+responses since the bytes differ by encoding; If-None-Match compares
+weakly, so 304s keep working.
+"""
+import datetime
+import decimal
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+from game_catalog import negotiate_encoding
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_MIN_BYTES = 1024
+DEFAULT_GZIP_LEVEL = 6
+# Dynamic responses: quality 11 is for content compressed once, like bundles
+DEFAULT_BROTLI_QUALITY = 5
+
+COMPRESSIBLE_MIMETYPES = frozenset({
+    'application/json', 'application/javascript', 'application/manifest+json',
+    'application/xml', 'image/svg+xml', 'text/css', 'text/csv', 'text/html',
+    'text/javascript', 'text/plain', 'text/xml',
+})
+# No body, or a body that must stay byte-identical to the ranges asked for
+UNCOMPRESSED_STATUSES = frozenset({204, 206, 304})
+
+
+def _default(value):
+    """Encode the types Flask's provider handles that JSON has no type for"""
+    if isinstance(value, datetime.date):
+        return http_date(value)
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if isinstance(value, sqlite3.Row):
+        return dict(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(obj):
+        """UTF-8 JSON bytes of obj"""
+        try:
+            return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS)
+        except TypeError:
+            # Integers over 64 bits and other values orjson refuses
+            return _stdlib_dumps(obj)
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    dumps = _stdlib_dumps
+    loads = json.loads
+
+
+def encoder_name():
+    return 'orjson' if orjson is not None else 'json'
+
+
+def table(columns, rows):
+    """{'columns': [...], 'rows': [[...], ...]}, the shape of change feed tables"""
+    return {'columns': list(columns), 'rows': list(rows)}
+
+
+def records(columns, rows):
+    """Rows as one dict per row, for clients that did not ask for a table"""
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def wants_table():
+    """Whether the current request asked for ?shape=table"""
+    return request.args.get('shape') == 'table'
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider encoding with dumps() and timing every response body"""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self._lock = threading.Lock()
+        self._stats = {'responses': 0, 'seconds': 0.0, 'bytes': 0}
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        started = time.perf_counter()
+        body = dumps(obj)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats['responses'] += 1
+            self._stats['seconds'] += elapsed
+            self._stats['bytes'] += len(body)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+    def stats(self):
+        """Responses encoded by this process, total encode time and bytes"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['seconds'] = round(stats['seconds'], 6)
+        stats['encoder'] = encoder_name()
+        return stats
+
+
+class Compressor:
+    """after_request hook compressing text responses by Accept-Encoding"""
+
+    def __init__(self, min_bytes=DEFAULT_MIN_BYTES, gzip_level=DEFAULT_GZIP_LEVEL,
+                 brotli_quality=DEFAULT_BROTLI_QUALITY, enabled=True):
+        self.min_bytes = min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.enabled = enabled
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+        self._lock = threading.Lock()
+        self._stats = {'compressed': 0, 'too_small': 0, 'not_accepted': 0, 'incompressible': 0,
+                       'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0}
+
+    def init_app(self, app):
+        app.after_request(self)
+
+    def _count(self, **amounts):
+        with self._lock:
+            for key, amount in amounts.items():
+                self._stats[key] += amount
+
+    def _eligible(self, response):
+        return (self.enabled
+                and response.status_code >= 200
+                and response.status_code not in UNCOMPRESSED_STATUSES
+                and not response.direct_passthrough
+                and not response.is_streamed
+                and 'Content-Encoding' not in response.headers
+                and 'Content-Range' not in response.headers
+                and response.mimetype in COMPRESSIBLE_MIMETYPES
+                and not response.cache_control.no_transform)
+
+    def compress(self, body, encoding):
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    def __call__(self, response):
+        if not self._eligible(response):
+            return response
+        body = response.get_data()
+        # Compressed or not, the body depends on this header from here on
+        response.vary.add('Accept-Encoding')
+        if len(body) < self.min_bytes:
+            self._count(too_small=1)
+            return response
+        encoding = negotiate_encoding(request.accept_encodings, self.encodings)
+        if encoding is None:
+            self._count(not_accepted=1)
+            return response
+
+        started = time.perf_counter()
+        compressed = self.compress(body, encoding)
+        elapsed = time.perf_counter() - started
+        if len(compressed) >= len(body):
+            self._count(incompressible=1, seconds=elapsed)
+            return response
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        self._count(compressed=1, bytes_in=len(body), bytes_out=len(compressed), seconds=elapsed)
+        return response
+
+    def stats(self):
+        """Counters of this process: responses compressed or skipped and bytes saved"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['seconds'] = round(stats['seconds'], 6)
+        stats['encodings'] = list(self.encodings)
+        stats['min_bytes'] = self.min_bytes
+        return stats
+
+
+def compressor_from_env():
+    """Compressor configured by SHIKSHA_COMPRESS_* variables"""
+    return Compressor(
+        min_bytes=int(os.environ.get('SHIKSHA_COMPRESS_MIN_BYTES', DEFAULT_MIN_BYTES)),
+        gzip_level=int(os.environ.get('SHIKSHA_COMPRESS_GZIP_LEVEL', DEFAULT_GZIP_LEVEL)),
+        brotli_quality=int(os.environ.get('SHIKSHA_COMPRESS_BROTLI_QUALITY', DEFAULT_BROTLI_QUALITY)),
+        enabled=os.environ.get('SHIKSHA_COMPRESS', '1') not in ('0', 'false', 'no', 'off'),
+    )
@@ -0,0 +1,117 @@
+"""Incrementally maintained aggregates over game_logs
+
+The teacher dashboard reads per-student and per-school totals from these
+rollup tables instead of scanning game_logs. apply_log_rollups() runs in the
+same transaction as every game_logs insert; rebuild_rollups() recomputes all
+of them from scratch after a bulk load or manual repair.
+"""
+ROLLUP_TABLES = ('student_stats', 'student_subject_stats', 'school_subject_stats')
+
+UPSERT_STUDENT_STATS_SQL = '''
+    INSERT INTO student_stats (student_id, total_games, score_pct_sum, last_activity)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (student_id) DO UPDATE SET
+        total_games = total_games + excluded.total_games,
+        score_pct_sum = score_pct_sum + excluded.score_pct_sum,
+        last_activity = MAX(COALESCE(last_activity, ''), excluded.last_activity)
+'''
+
+UPSERT_STUDENT_SUBJECT_STATS_SQL = '''
+    INSERT INTO student_subject_stats (student_id, subject, total_games, score_pct_sum, last_activity)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (student_id, subject) DO UPDATE SET
+        total_games = total_games + excluded.total_games,
+        score_pct_sum = score_pct_sum + excluded.score_pct_sum,
+        last_activity = MAX(COALESCE(last_activity, ''), excluded.last_activity)
+'''
+
+UPSERT_SCHOOL_SUBJECT_STATS_SQL = '''
+    INSERT INTO school_subject_stats (udise_code, subject, grade, total_attempts, score_pct_sum)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (udise_code, subject, grade) DO UPDATE SET
+        total_attempts = total_attempts + excluded.total_attempts,
+        score_pct_sum = score_pct_sum + excluded.score_pct_sum
+'''
+
+
+def _score_pct(score, max_score):
+    return score * 100.0 / max_score
+
+
+def apply_log_rollups(conn, student_id, rows):
+    """Fold newly inserted game_logs rows into the rollup tables
+
+    rows are validated tuples as produced by ingest.validate_log(). The
+    caller owns the transaction, so rollups commit atomically with the logs.
+    """
+    if not rows:
+        return
+
+    student = conn.execute('SELECT udise_code FROM students WHERE id = ?', (student_id,)).fetchone()
+    udise_code = student[0] if student else None
+
+    total = [0, 0.0, '']
+    by_subject = {}
+    by_school = {}
+    for subject, grade, _game_id, _game_type, _level, score, max_score, _time_spent, played_at, _client_id in rows:
+        pct = _score_pct(score, max_score)
+        total[0] += 1
+        total[1] += pct
+        total[2] = max(total[2], played_at)
+
+        subject_totals = by_subject.setdefault(subject, [0, 0.0, ''])
+        subject_totals[0] += 1
+        subject_totals[1] += pct
+        subject_totals[2] = max(subject_totals[2], played_at)
+
+        school_totals = by_school.setdefault((subject, grade), [0, 0.0])
+        school_totals[0] += 1
+        school_totals[1] += pct
+
+    conn.execute(UPSERT_STUDENT_STATS_SQL, (student_id, total[0], total[1], total[2]))
+    conn.executemany(UPSERT_STUDENT_SUBJECT_STATS_SQL, [
+        (student_id, subject, count, pct_sum, last)
+        for subject, (count, pct_sum, last) in by_subject.items()
+    ])
+    if udise_code is not None:
+        conn.executemany(UPSERT_SCHOOL_SUBJECT_STATS_SQL, [
+            (udise_code, subject, grade, count, pct_sum)
+            for (subject, grade), (count, pct_sum) in by_school.items()
+        ])
+
+
+def recompute_rollups(conn, source='game_logs'):
+    """Recompute every rollup table from game_logs inside the caller's transaction
+
+    source may name a view that also includes archived logs (see cold_storage).
+    """
+    for table in ROLLUP_TABLES:
+        conn.execute(f'DELETE FROM {table}')
+
+    conn.execute(f'''
+        INSERT INTO student_stats (student_id, total_games, score_pct_sum, last_activity)
+        SELECT student_id, COUNT(*), SUM(score * 100.0 / max_score), MAX(played_at)
+        FROM {source}
+        GROUP BY student_id
+    ''')
+    conn.execute(f'''
+        INSERT INTO student_subject_stats (student_id, subject, total_games, score_pct_sum, last_activity)
+        SELECT student_id, subject, COUNT(*), SUM(score * 100.0 / max_score), MAX(played_at)
+        FROM {source}
+        GROUP BY student_id, subject
+    ''')
+    conn.execute(f'''
+        INSERT INTO school_subject_stats (udise_code, subject, grade, total_attempts, score_pct_sum)
+        SELECT s.udise_code, gl.subject, gl.grade, COUNT(*), SUM(gl.score * 100.0 / gl.max_score)
+        FROM {source} gl
+        JOIN students s ON gl.student_id = s.id
+        GROUP BY s.udise_code, gl.subject, gl.grade
+    ''')
+
+
+def rebuild_rollups(conn, source='game_logs'):
+    """Recompute every rollup table from game_logs in one transaction"""
+    with conn:
+        recompute_rollups(conn, source)
+
+    return conn.execute('SELECT COUNT(*) FROM student_stats').fetchone()[0]
@@ -0,0 +1,213 @@
+"""Indexed search over udise_schools for the registration form
+
+Names, districts and blocks are indexed in an FTS5 table with the trigram
+tokenizer, so any substring of three or more characters is an index lookup
+rather than a LIKE '%q%' scan. Numeric queries are treated as UDISE code
+prefixes and served from the unique index on udise_code. Results are
+paginated with opaque keyset cursors.
+"""
+import base64
+import json
+import sqlite3
+
+SEARCH_INDEX_TABLE = 'udise_schools_fts'
+MIN_QUERY_LENGTH = 3
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Typos only make sense to correct in longer queries, and the trigram OR
+# query gets expensive on very short inputs
+MIN_FUZZY_QUERY_LENGTH = 5
+MAX_FUZZY_TRIGRAMS = 16
+
+# bm25 column weights: school_name, district, block
+RANK_EXPRESSION = f'bm25({SEARCH_INDEX_TABLE}, 10.0, 2.0, 1.0)'
+
+# udise_schools columns of each result, in table order
+SCHOOL_COLUMNS = ('id', 'udise_code', 'school_name', 'district', 'block', 'category', 'area', 'management')
+SCHOOL_SELECT = ', '.join('s.' + column for column in SCHOOL_COLUMNS)
+
+
+def create_search_index(cursor, table=SEARCH_INDEX_TABLE):
+    """Create the trigram index table; returns False if SQLite lacks FTS5 trigram"""
+    # Contentless: the index only maps trigrams to udise_schools rowids, so it
+    # can be built beside a shadow table and renamed into place on import
+    try:
+        cursor.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(
+            school_name, district, block,
+            content='',
+            tokenize='trigram'
+        )''')
+    except sqlite3.OperationalError as e:
+        print(f"Warning: school search index unavailable ({e}); falling back to LIKE search.")
+        return False
+    return True
+
+
+def rebuild_search_index(conn, table=SEARCH_INDEX_TABLE, source='udise_schools'):
+    """Re-index every row of the source table"""
+    if has_search_index(conn, table):
+        conn.execute(f"INSERT INTO {table}({table}) VALUES('delete-all')")
+        conn.execute(f'''
+            INSERT INTO {table} (rowid, school_name, district, block)
+            SELECT id, school_name, district, block FROM {source}
+        ''')
+
+
+def has_search_index(conn, table=SEARCH_INDEX_TABLE):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    return row is not None
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode a cursor from a previous page; raises ValueError if malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def _phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _match_expression(query):
+    """All query words must appear as substrings (trigram tokens need 3+ chars)"""
+    words = [w for w in query.split() if len(w) >= MIN_QUERY_LENGTH] or [query]
+    return ' AND '.join(_phrase(w) for w in words)
+
+
+def _fuzzy_expression(query):
+    """Any trigram of the query; bm25 ranks names sharing the most trigrams first"""
+    text = ' '.join(query.split()).upper()
+    trigrams = []
+    for i in range(len(text) - 2):
+        trigram = text[i:i + 3]
+        if trigram not in trigrams:
+            trigrams.append(trigram)
+    return '{school_name} : (' + ' OR '.join(_phrase(t) for t in trigrams[:MAX_FUZZY_TRIGRAMS]) + ')'
+
+
+def _filters(district, block):
+    clauses, params = [], []
+    if district:
+        clauses.append('s.district = ?')
+        params.append(district.strip().upper())
+    if block:
+        clauses.append('s.block = ?')
+        params.append(block.strip().upper())
+    return ''.join(' AND ' + c for c in clauses), params
+
+
+def _search_by_code(conn, prefix, where, params, after, limit):
+    sql = f'''
+        SELECT {SCHOOL_SELECT} FROM udise_schools s
+        WHERE s.udise_code >= ? AND s.udise_code < ?
+    ''' + where
+    # UDISE codes are all digits, and ':' sorts directly after '9'
+    args = [prefix, prefix + ':'] + params
+    if after is not None:
+        sql += ' AND s.udise_code > ?'
+        args.append(str(after[0]))
+    sql += ' ORDER BY s.udise_code LIMIT ?'
+    rows = conn.execute(sql, args + [limit + 1]).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]['udise_code']])
+    return rows, next_cursor
+
+
+def _search_ranked(conn, match, where, params, after, limit, exclude=()):
+    sql = f'''
+        SELECT {SCHOOL_SELECT}, {RANK_EXPRESSION} AS search_rank
+        FROM {SEARCH_INDEX_TABLE}
+        JOIN udise_schools s ON s.id = {SEARCH_INDEX_TABLE}.rowid
+        WHERE {SEARCH_INDEX_TABLE} MATCH ?
+    ''' + where
+    args = [match] + params
+    if after is not None:
+        sql += f' AND ({RANK_EXPRESSION}, s.id) > (?, ?)'
+        args.extend([float(after[0]), int(after[1])])
+    if exclude:
+        sql += f' AND s.id NOT IN ({", ".join("?" * len(exclude))})'
+        args.extend(exclude)
+    sql += ' ORDER BY search_rank, s.id LIMIT ?'
+    rows = conn.execute(sql, args + [limit + 1]).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]['search_rank'], rows[-1]['id']])
+    return rows, next_cursor
+
+
+def _search_like(conn, query, where, params, after, limit):
+    """Unindexed fallback for SQLite builds without the trigram tokenizer"""
+    pattern = f'%{query}%'
+    sql = f'''
+        SELECT {SCHOOL_SELECT} FROM udise_schools s
+        WHERE (s.udise_code LIKE ? OR s.school_name LIKE ? OR s.district LIKE ?)
+    ''' + where
+    args = [pattern, pattern, pattern] + params
+    if after is not None:
+        sql += ' AND s.id > ?'
+        args.append(int(after[0]))
+    sql += ' ORDER BY s.id LIMIT ?'
+    rows = conn.execute(sql, args + [limit + 1]).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]['id']])
+    return rows, next_cursor
+
+
+def search_school_rows(conn, query, district=None, block=None, cursor=None, limit=DEFAULT_LIMIT):
+    """Search schools by UDISE prefix or name/district/block substring
+
+    Returns (rows, next_cursor) with rows as tuples of SCHOOL_COLUMNS. On the
+    first page of a name search with too few exact hits, near matches by
+    trigram similarity are appended.
+    """
+    query = ' '.join(query.split())
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    after = decode_cursor(cursor) if cursor else None
+    where, params = _filters(district, block)
+    width = len(SCHOOL_COLUMNS)
+
+    if len(query) < MIN_QUERY_LENGTH:
+        return [], None
+
+    if query.isdigit():
+        rows, next_cursor = _search_by_code(conn, query, where, params, after, limit)
+        return [tuple(r)[:width] for r in rows], next_cursor
+
+    if not has_search_index(conn):
+        rows, next_cursor = _search_like(conn, query, where, params, after, limit)
+        return [tuple(r)[:width] for r in rows], next_cursor
+
+    rows, next_cursor = _search_ranked(conn, _match_expression(query), where, params, after, limit)
+    schools = [tuple(r)[:width] for r in rows]
+
+    if after is None and len(rows) < limit and len(query) >= MIN_FUZZY_QUERY_LENGTH:
+        exclude = [r['id'] for r in rows]
+        fuzzy, _ = _search_ranked(conn, _fuzzy_expression(query), where, params, None,
+                                  limit - len(rows), exclude)
+        schools.extend(tuple(r)[:width] for r in fuzzy)
+
+    return schools, next_cursor
+
+
+def search_schools(conn, query, district=None, block=None, cursor=None, limit=DEFAULT_LIMIT):
+    """search_school_rows() with each school as a dict; returns (schools, next_cursor)"""
+    rows, next_cursor = search_school_rows(conn, query, district, block, cursor, limit)
+    return [dict(zip(SCHOOL_COLUMNS, row)) for row in rows], next_cursor
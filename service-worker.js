@@ -137,8 +137,9 @@ async function handleApiRequest(request) {
     // Try network first for API requests
     const networkResponse = await fetch(request);
     
-    // Cache successful GET requests
-    if (request.method === 'GET' && networkResponse.ok) {
+    // Cache successful GET requests, except answers that must not be replayed (the change feed)
+    const noStore = (networkResponse.headers.get('Cache-Control') || '').includes('no-store');
+    if (request.method === 'GET' && networkResponse.ok && !noStore) {
       const cache = await caches.open(DYNAMIC_CACHE);
       cache.put(request, networkResponse.clone());
     }
@@ -0,0 +1,649 @@
+"""Horizontal sharding of student data across SQLite files
+
+With SHIKSHA_SHARD_DIR set, students and everything derived from their game
+logs (game_logs, achievements, student_progress, rollups, analytics buckets,
+leaderboards, archive catalog) live in shard files, while users, teachers,
+the UDISE register and OTP state stay in the main database. Every shard
+carries the full schema; a shard connection attaches the main database
+read-only and reads the global tables through temp views (see
+database.connect), so the same queries run on either. Each shard has its own
+write lock, so game logs of students on different shards commit in parallel.
+
+A student's shard follows from their school: a route for the UDISE code,
+else a route for the district, else a CRC32 hash of the district over the
+shards created up front. Shards added by split_shard() only receive routes,
+so adding one never reshuffles the hash. student_directory in the main
+database hands out student ids unique across shards and maps a login to the
+student's school and so their shard.
+
+Reports over a district (or every shard) run one query per shard and merge
+the partial results. With several shards and CPUs, gather() sends the
+queries to a process pool so each shard is read by its own process.
+
+split_shard() moves whole districts (or the schools of a dominant district)
+from a hot shard to a new one while holding the source's write lock. The
+copy is committed on the new shard before the routes change; only then are
+the rows deleted from the source. Inserts for a student that is no longer on
+a shard are refused (STUDENT_FENCE_ERROR), so a worker that has not yet seen
+the new routes fails loudly instead of writing to the old shard. Workers
+notice routing changes by polling the shard_moves table.
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+import urllib.parse
+import zlib
+
+from analytics import bump_versions, district_key, school_district, school_key
+from achievements import recount_buckets
+from database import STUDENT_FENCE_ERROR, connect, migrate
+from db_pool import ConnectionPool
+
+DEFAULT_SHARDS = 4
+DEFAULT_POLL_SECONDS = 2.0
+
+# Tables with one or more rows per student; the id of the first three is a
+# per-file AUTOINCREMENT and is assigned again on the receiving shard
+STUDENT_TABLES = (
+    ('game_logs', True),
+    ('achievements', True),
+    ('student_progress', True),
+    ('student_stats', False),
+    ('student_subject_stats', False),
+    ('student_rewards', False),
+    ('leaderboard_entries', False),
+)
+
+# (udise_code, canonical district) of a shard's students, as the analytics
+# and achievements code derives it
+SCHOOL_GROUPS_SQL = '''
+    SELECT s.udise_code, COALESCE(u.district, s.district), COUNT(*), COALESCE(SUM(st.total_games), 0)
+    FROM main.students s
+    LEFT JOIN udise_schools u ON u.udise_code = s.udise_code
+    LEFT JOIN main.student_stats st ON st.student_id = s.id
+    GROUP BY 1, 2
+'''
+
+MOVING_STUDENTS_SQL = '''
+    INSERT INTO temp.moving_students
+    SELECT s.id FROM {db}.students s
+    LEFT JOIN udise_schools u ON u.udise_code = s.udise_code
+    JOIN temp.moving_schools m ON m.udise_code = s.udise_code AND m.district = COALESCE(u.district, s.district)
+'''
+
+
+def shard_name(index):
+    return f'shard-{index:02d}'
+
+
+def is_fence_error(error):
+    """True for the error raised when writing a student to a shard that no longer holds them"""
+    return STUDENT_FENCE_ERROR in str(error)
+
+
+def route(udise_code, district, routes, hashed):
+    """Shard of a school: its own route, its district's route, or the district hash"""
+    shard = routes.get(f'school:{udise_code}') or routes.get(f'district:{district}')
+    if shard is None:
+        shard = hashed[zlib.crc32((district or '').encode('utf-8')) % len(hashed)]
+    return shard
+
+
+def _read_registry(conn):
+    paths = {}
+    hashed = []
+    for name, path, is_hashed in conn.execute('SELECT name, path, hashed FROM shards ORDER BY name'):
+        paths[name] = path
+        if is_hashed:
+            hashed.append(name)
+    routes = {}
+    route_districts = {}
+    for key, district, shard in conn.execute('SELECT route_key, district, shard FROM shard_routes'):
+        routes[key] = shard
+        route_districts[key] = district
+    epoch = conn.execute('SELECT COALESCE(MAX(id), 0) FROM shard_moves').fetchone()[0]
+    return paths, tuple(hashed), routes, route_districts, epoch
+
+
+# Connections kept by each process of the gather() pool, one per shard
+_worker_connections = {}
+
+
+def _run_on_shard(path, shared_path, fn, args):
+    """fn(conn, *args) on a shard, in a pool process"""
+    conn = _worker_connections.get(path)
+    if conn is None:
+        conn = _worker_connections[path] = connect(path, shared_path=shared_path)
+    return fn(conn, *args)
+
+
+class ShardSet:
+    """Shard registry, routing and connections of one process
+
+    With no shard registered everything resolves to the main database:
+    names() is (None,), shard_for() returns None and connect(None) opens
+    the main database, so callers need no separate unsharded code path.
+    """
+
+    def __init__(self, db_path, poll_interval=DEFAULT_POLL_SECONDS, processes=None):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.processes = processes
+        self._lock = threading.Lock()
+        self._state = ({}, (), {}, {}, 0)
+        self._next_poll = 0.0
+        self._pools = {}
+        self._executor = None
+        self._executor_pid = None
+        self._stats = {'reloads': 0, 'gathers': 0, 'gathered_in_processes': 0}
+
+    def load(self, conn=None):
+        """Read the registry and routes from the main database"""
+        own = conn is None
+        conn = conn or connect(self.db_path)
+        try:
+            state = _read_registry(conn)
+        finally:
+            if own:
+                conn.close()
+        with self._lock:
+            self._state = state
+            self._stats['reloads'] += 1
+        if self.processes is None:
+            self.processes = min(len(state[0]), os.cpu_count() or 1)
+        return self
+
+    def poll(self, conn, force=False):
+        """Reload the routes if a shard move happened since; returns True when they changed"""
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        if not force and now < self._next_poll:
+            return False
+        self._next_poll = now + self.poll_interval
+        epoch = conn.execute('SELECT COALESCE(MAX(id), 0) FROM shard_moves').fetchone()[0]
+        if epoch == self.epoch:
+            return False
+        self.load(conn)
+        return True
+
+    @property
+    def enabled(self):
+        return bool(self._state[1])
+
+    @property
+    def epoch(self):
+        return self._state[4]
+
+    def names(self):
+        paths = self._state[0]
+        return tuple(paths) if paths else (None,)
+
+    def path(self, name):
+        return self.db_path if name is None else self._state[0][name]
+
+    def shard_for(self, udise_code, district):
+        """Shard holding the students of a school, None when not sharded"""
+        _, hashed, routes, _, _ = self._state
+        if not hashed:
+            return None
+        return route(udise_code, district, routes, hashed)
+
+    def shards_for_district(self, district):
+        """Every shard holding students of a district, in name order"""
+        _, hashed, routes, route_districts, _ = self._state
+        if not hashed:
+            return (None,)
+        names = {route(None, district, routes, hashed)}
+        names.update(routes[key] for key, route_district in route_districts.items()
+                     if key.startswith('school:') and route_district == district)
+        return tuple(sorted(names))
+
+    def place_student(self, conn, user_id, udise_code, district):
+        """(student_id, shard) for a registering student, recorded in the directory
+
+        conn is a main database connection; the caller commits it before
+        inserting the student on the shard. Returns (None, None) when not
+        sharded, letting the students table assign the id.
+        """
+        if not self.enabled:
+            return None, None
+        district = school_district(conn, udise_code, district)
+        row = conn.execute('SELECT student_id FROM student_directory WHERE user_id = ?', (user_id,)).fetchone()
+        if row is not None:
+            student_id = row[0]
+            conn.execute('UPDATE student_directory SET udise_code = ?, district = ? WHERE student_id = ?',
+                         (udise_code, district, student_id))
+        else:
+            student_id = conn.execute(
+                'INSERT INTO student_directory (user_id, udise_code, district) VALUES (?, ?, ?)',
+                (user_id, udise_code, district)
+            ).lastrowid
+        return student_id, self.shard_for(udise_code, district)
+
+    def user_shard(self, conn, user_id):
+        """(student_id, shard) of a user's student record, or (None, None)"""
+        row = conn.execute(
+            'SELECT student_id, udise_code, district FROM student_directory WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        if row is None:
+            return None, None
+        return row[0], self.shard_for(row[1], row[2])
+
+    def student_shard(self, conn, student_id):
+        """Shard of a student id, or None if the directory does not know it"""
+        row = conn.execute(
+            'SELECT udise_code, district FROM student_directory WHERE student_id = ?', (student_id,)
+        ).fetchone()
+        return None if row is None else self.shard_for(row[0], row[1])
+
+    def connect(self, name):
+        """New connection to a shard, or to the main database for None"""
+        if name is None:
+            return connect(self.db_path)
+        return connect(self.path(name), shared_path=self.db_path)
+
+    def pool(self, name):
+        """This process's connection pool for a shard"""
+        pool = self._pools.get(name)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(name)
+                if pool is None:
+                    pool = self._pools[name] = ConnectionPool(self.path(name), shared_path=self.db_path)
+        return pool
+
+    def pools(self):
+        with self._lock:
+            return dict(self._pools)
+
+    def _pool_executor(self):
+        """Process pool for gather(), started on first use in each process"""
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                # spawn rather than fork: the caller has threads and open SQLite handles
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=multiprocessing.get_context('spawn')
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def gather(self, fn, args, names, get_conn=None):
+        """[fn(conn, *args) for each shard in names], in parallel processes when there are several
+
+        fn must be a module-level function returning picklable values. In
+        this thread, connections come from get_conn(name) when given.
+        """
+        names = list(names)
+        with self._lock:
+            self._stats['gathers'] += 1
+        if len(names) <= 1 or (self.processes or 1) <= 1:
+            results = []
+            for name in names:
+                if get_conn is not None:
+                    results.append(fn(get_conn(name), *args))
+                    continue
+                conn = self.connect(name)
+                try:
+                    results.append(fn(conn, *args))
+                finally:
+                    conn.close()
+            return results
+        with self._lock:
+            self._stats['gathered_in_processes'] += 1
+        executor = self._pool_executor()
+        futures = [
+            executor.submit(_run_on_shard, self.path(name), None if name is None else self.db_path, fn, args)
+            for name in names
+        ]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """Stop the gather() processes of this process"""
+        with self._lock:
+            executor = self._executor if self._executor_pid == os.getpid() else None
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def stats(self):
+        """Registry, routing and gather counters for monitoring"""
+        paths, hashed, routes, _, epoch = self._state
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(
+            enabled=bool(hashed),
+            shards={name: {'path': path, 'hashed': name in hashed} for name, path in paths.items()},
+            routes=len(routes),
+            epoch=epoch,
+            processes=self.processes,
+        )
+        return stats
+
+
+def shards_from_env(db_path):
+    """ShardSet of the main database, configured by SHIKSHA_SHARD_* variables"""
+    processes = os.environ.get('SHIKSHA_SHARD_PROCESSES')
+    return ShardSet(
+        db_path,
+        poll_interval=float(os.environ.get('SHIKSHA_SHARD_POLL_SECONDS', DEFAULT_POLL_SECONDS)),
+        processes=int(processes) if processes else None,
+    ).load()
+
+
+def _columns(conn, table, skip_id):
+    columns = [row[1] for row in conn.execute(f'PRAGMA main.table_info({table})')]
+    return ', '.join(column for column in columns if not (skip_id and column == 'id'))
+
+
+def _fill_moving(conn, db, groups):
+    """temp.moving_schools and temp.moving_students for (udise_code, district) groups"""
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS moving_schools (udise_code TEXT, district TEXT)')
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS moving_students (id INTEGER PRIMARY KEY)')
+    conn.execute('DELETE FROM temp.moving_schools')
+    conn.execute('DELETE FROM temp.moving_students')
+    conn.executemany('INSERT INTO temp.moving_schools VALUES (?, ?)', [(g[0], g[1]) for g in groups])
+    conn.execute(MOVING_STUDENTS_SQL.format(db=db))
+    return conn.execute('SELECT COUNT(*) FROM temp.moving_students').fetchone()[0]
+
+
+def _delete_students(conn):
+    """Delete the rows of temp.moving_students from the shard"""
+    for table, _ in STUDENT_TABLES:
+        conn.execute(f'DELETE FROM main.{table} WHERE student_id IN (SELECT id FROM temp.moving_students)')
+    conn.execute('DELETE FROM main.students WHERE id IN (SELECT id FROM temp.moving_students)')
+
+
+def _leaderboard_keys(conn):
+    return [row[0] for row in conn.execute('''
+        SELECT DISTINCT scope_key FROM main.leaderboard_entries
+        WHERE student_id IN (SELECT id FROM temp.moving_students)
+    ''')]
+
+
+def rebuild_district_buckets(conn, districts):
+    """Recompute district activity buckets as the sum of the shard's school buckets
+
+    Every logged game lands in its school's and its district's buckets, so
+    on any shard a district's buckets are the sum of its schools' there.
+    """
+    districts = [d for d in districts if d]
+    if not districts:
+        return
+    placeholders = ', '.join('?' * len(districts))
+    conn.execute(f'''
+        DELETE FROM main.activity_buckets WHERE scope = 'district' AND scope_key IN ({placeholders})
+    ''', districts)
+    conn.execute(f'''
+        INSERT INTO main.activity_buckets
+        (scope, scope_key, period, bucket_start, grade, subject, attempts, score_pct_sum, time_spent)
+        SELECT 'district', d.district, b.period, b.bucket_start, b.grade, b.subject,
+               SUM(b.attempts), SUM(b.score_pct_sum), SUM(b.time_spent)
+        FROM (SELECT DISTINCT s.udise_code, COALESCE(u.district, s.district) AS district
+              FROM main.students s LEFT JOIN udise_schools u ON u.udise_code = s.udise_code) d
+        JOIN main.activity_buckets b ON b.scope = 'school' AND b.scope_key = d.udise_code
+        WHERE d.district IN ({placeholders})
+        GROUP BY d.district, b.period, b.bucket_start, b.grade, b.subject
+    ''', districts)
+
+
+def _copy_in(db_path, target_path, source_path, groups):
+    """Copy the students of (udise_code, district) groups from source to target; returns the count
+
+    Rows already on the target for these students and schools (left by an
+    interrupted move) are replaced, so running it again is safe.
+    """
+    conn = connect(target_path, shared_path=db_path)
+    try:
+        conn.execute('ATTACH DATABASE ? AS source',
+                     ('file:' + urllib.parse.quote(os.path.abspath(source_path)) + '?mode=ro',))
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            moved = _fill_moving(conn, 'source', groups)
+            _delete_students(conn)
+            columns = _columns(conn, 'students', False)
+            conn.execute(f'''
+                INSERT INTO main.students ({columns}) SELECT {columns} FROM source.students
+                WHERE id IN (SELECT id FROM temp.moving_students)
+            ''')
+            for table, skip_id in STUDENT_TABLES:
+                columns = _columns(conn, table, skip_id)
+                conn.execute(f'''
+                    INSERT INTO main.{table} ({columns}) SELECT {columns} FROM source.{table}
+                    WHERE student_id IN (SELECT id FROM temp.moving_students)
+                ''')
+            for table, where in (
+                ('school_subject_stats', 'udise_code IN (SELECT udise_code FROM temp.moving_schools)'),
+                ('activity_buckets', "scope = 'school' AND scope_key IN (SELECT udise_code FROM temp.moving_schools)"),
+            ):
+                conn.execute(f'DELETE FROM main.{table} WHERE {where}')
+                conn.execute(f'INSERT INTO main.{table} SELECT * FROM source.{table} WHERE {where}')
+            districts = sorted({group[1] for group in groups if group[1]})
+            rebuild_district_buckets(conn, districts)
+            columns = _columns(conn, 'archive_partitions', True)
+            conn.execute(f'''
+                INSERT OR IGNORE INTO main.archive_partitions ({columns})
+                SELECT {columns} FROM source.archive_partitions
+                WHERE district IN (SELECT district FROM temp.moving_schools)
+            ''')
+            recount_buckets(conn, _leaderboard_keys(conn))
+            bump_versions(conn, [school_key(group[0]) for group in groups] +
+                          [district_key(district) for district in districts])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        conn.execute('DETACH DATABASE source')
+    finally:
+        conn.close()
+    return moved
+
+
+def prune_shard(shards, name, conn=None):
+    """Delete students whose school routes to another shard; returns how many
+
+    Finishes a move whose last step was interrupted. When conn is given the
+    caller has already begun the write transaction; it is committed here.
+    """
+    own = conn is None
+    if own:
+        conn = shards.connect(name)
+    try:
+        stray = [group for group in conn.execute(SCHOOL_GROUPS_SQL).fetchall()
+                 if shards.shard_for(group[0], group[1]) != name]
+        if not stray:
+            if not own:
+                conn.commit()
+            return 0
+        if own:
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            pruned = _fill_moving(conn, 'main', stray)
+            keys = _leaderboard_keys(conn)
+            _delete_students(conn)
+            # School and district rows stay wherever students of them remain
+            remaining = conn.execute(SCHOOL_GROUPS_SQL).fetchall()
+            kept_schools = {group[0] for group in remaining}
+            kept_districts = {group[1] for group in remaining}
+            gone = sorted({group[0] for group in stray} - kept_schools)
+            for start in range(0, len(gone), 500):
+                chunk = gone[start:start + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                conn.execute(f'DELETE FROM main.school_subject_stats WHERE udise_code IN ({placeholders})', chunk)
+                conn.execute(f'''
+                    DELETE FROM main.activity_buckets WHERE scope = 'school' AND scope_key IN ({placeholders})
+                ''', chunk)
+            districts = sorted({group[1] for group in stray if group[1]})
+            rebuild_district_buckets(conn, districts)
+            conn.executemany('DELETE FROM main.archive_partitions WHERE district = ?',
+                             [(district,) for district in districts if district not in kept_districts])
+            recount_buckets(conn, keys)
+            bump_versions(conn, [school_key(group[0]) for group in stray] +
+                          [district_key(district) for district in districts])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return pruned
+    finally:
+        if own:
+            conn.close()
+
+
+def _distribute_main(db_path, shards):
+    """Move students stored in the main database before sharding was enabled to their shards"""
+    conn = connect(db_path)
+    try:
+        if conn.execute('SELECT 1 FROM students LIMIT 1').fetchone() is None:
+            return 0
+        with conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO student_directory (student_id, user_id, udise_code, district)
+                SELECT s.id, s.user_id, s.udise_code, COALESCE(u.district, s.district) FROM students s
+                LEFT JOIN udise_schools u ON u.udise_code = s.udise_code
+            ''')
+        by_shard = {}
+        for group in conn.execute(SCHOOL_GROUPS_SQL):
+            by_shard.setdefault(shards.shard_for(group[0], group[1]), []).append(group)
+    finally:
+        conn.close()
+    moved = 0
+    for name, groups in sorted(by_shard.items()):
+        moved += _copy_in(db_path, shards.path(name), db_path, groups)
+    prune_shard(shards, None)
+    print(f"Moved {moved} students from the main database to {len(by_shard)} shards")
+    return moved
+
+
+def prepare_shards(db_path):
+    """Create, migrate and settle the shard files; called by prepare_database() under its lock
+
+    The first start with SHIKSHA_SHARD_DIR registers SHIKSHA_SHARDS hashed
+    shards and moves any students already in the main database onto them.
+    Returns the shard names, or () when sharding is off.
+    """
+    shard_dir = os.environ.get('SHIKSHA_SHARD_DIR')
+    conn = connect(db_path)
+    try:
+        registered = conn.execute('SELECT 1 FROM shards LIMIT 1').fetchone() is not None
+        if not registered:
+            if not shard_dir:
+                return ()
+            count = int(os.environ.get('SHIKSHA_SHARDS', DEFAULT_SHARDS))
+            if count < 1:
+                raise ValueError('SHIKSHA_SHARDS must be at least 1')
+            with conn:
+                conn.executemany('INSERT INTO shards (name, path, hashed) VALUES (?, ?, 1)', [
+                    (shard_name(i), os.path.join(shard_dir, f'{shard_name(i)}.db')) for i in range(count)
+                ])
+    finally:
+        conn.close()
+
+    shards = ShardSet(db_path, processes=1).load()
+    for name in shards.names():
+        os.makedirs(os.path.dirname(os.path.abspath(shards.path(name))), exist_ok=True)
+        migrate(shards.path(name))
+    _distribute_main(db_path, shards)
+    for name in shards.names():
+        pruned = prune_shard(shards, name)
+        if pruned:
+            print(f"Removed {pruned} students of {name} that had already moved to another shard")
+    return shards.names()
+
+
+def _plan_split(groups):
+    """Route keys moving about half of a shard's weight, with the moved weight
+
+    Whole districts move when no district outweighs the rest; otherwise
+    the schools of the heaviest district are split instead.
+    """
+    total = sum(group[2] + group[3] for group in groups)
+    schools = {}
+    for udise_code, district, students, games in groups:
+        schools.setdefault(district, []).append((udise_code, students + games))
+    weights = {district: sum(w for _, w in entries) for district, entries in schools.items()}
+    heaviest = max(weights, key=lambda district: (weights[district], district or ''))
+    if len(weights) > 1 and weights[heaviest] <= total / 2:
+        candidates = [(f'district:{d}', d, w) for d, w in weights.items()]
+    else:
+        candidates = [(f'school:{u}', heaviest, w) for u, w in schools[heaviest]]
+
+    plan = []
+    moved = 0
+    for key, district, weight in sorted(candidates, key=lambda c: (-c[2], c[0])):
+        if moved + weight <= total / 2:
+            plan.append((key, district))
+            moved += weight
+    return plan, moved, total
+
+
+def _remove_database_files(path):
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def split_shard(db_path, name):
+    """Move about half of a shard's students (by students and games) to a new shard
+
+    Writes to the source shard wait (and may time out) while the move runs.
+    Returns a summary of the move.
+    """
+    shards = ShardSet(db_path, processes=1).load()
+    if not shards.enabled:
+        raise ValueError('sharding is not enabled')
+    if name not in shards.names():
+        raise ValueError(f'unknown shard {name}')
+    started = time.perf_counter()
+    source_path = shards.path(name)
+    source = shards.connect(name)
+    try:
+        plan, weight, total = _plan_split(source.execute(SCHOOL_GROUPS_SQL).fetchall())
+        if not plan:
+            raise ValueError(f'{name} holds a single school and cannot be split')
+
+        index = 0
+        while shard_name(index) in shards.names():
+            index += 1
+        target = shard_name(index)
+        target_path = os.path.join(os.path.dirname(source_path), f'{target}.db')
+        # Left behind by a split that failed before registering it
+        _remove_database_files(target_path)
+        migrate(target_path)
+
+        _, hashed, routes, _, _ = shards._state
+        new_routes = dict(routes, **{key: target for key, _ in plan})
+        source.execute('BEGIN IMMEDIATE')
+        try:
+            groups = [group for group in source.execute(SCHOOL_GROUPS_SQL)
+                      if route(group[0], group[1], new_routes, hashed) == target]
+            moved = _copy_in(db_path, target_path, source_path, groups)
+
+            main = connect(db_path)
+            try:
+                with main:
+                    main.execute('INSERT INTO shards (name, path, hashed) VALUES (?, ?, 0)', (target, target_path))
+                    main.executemany('INSERT OR REPLACE INTO shard_routes (route_key, district, shard) VALUES (?, ?, ?)',
+                                     [(key, district, target) for key, district in plan])
+                    main.execute('''
+                        INSERT INTO shard_moves (source, target, routes, students, seconds) VALUES (?, ?, ?, ?, ?)
+                    ''', (name, target, ','.join(key for key, _ in plan), moved,
+                          round(time.perf_counter() - started, 3)))
+                shards.load(main)
+            finally:
+                main.close()
+            prune_shard(shards, name, source)
+        except Exception:
+            if source.in_transaction:
+                source.rollback()
+            raise
+    finally:
+        source.close()
+    return {
+        'source': name, 'target': target, 'routes': [key for key, _ in plan], 'students': moved,
+        'weight': weight, 'total_weight': total, 'seconds': round(time.perf_counter() - started, 3),
+    }
@@ -4,10 +4,21 @@
 class DatabaseSync {
     constructor() {
         this.dbName = 'ShikshaLeapDB';
-        this.dbVersion = 1;
+        this.dbVersion = 2;
         this.db = null;
         this.isOnline = navigator.onLine;
         this.syncQueue = [];
+        this.syncBatchSize = 1000;
+        // Columnar gzip uploads need CompressionStream; the server inserts them block by block
+        this.columnarSync = typeof CompressionStream !== 'undefined';
+        this.columnarBatchSize = 5000;
+        this.columnarBlockRows = 1000;
+        this.achievementBatchSize = 500;
+        // Server change feed: rows changed on other devices, pulled by long-polling
+        this.changeFeedWait = 25;
+        this.changeFeedPageSize = 500;
+        this.changeFeedRetryDelay = 30000;
+        this.changeFeedRunning = false;
         
         this.init();
     }
@@ -81,6 +92,20 @@ class DatabaseSync {
                     contentStore.createIndex('grade', 'grade', { unique: false });
                 }
                 
+                // Game logs, badges and mastery pulled from the server change feed
+                if (!db.objectStoreNames.contains('serverRecords')) {
+                    const serverStore = db.createObjectStore('serverRecords', {
+                        keyPath: 'key'
+                    });
+                    serverStore.createIndex('studentId', 'studentId', { unique: false });
+                    serverStore.createIndex('table', 'table', { unique: false });
+                }
+                
+                // Change feed cursor
+                if (!db.objectStoreNames.contains('syncState')) {
+                    db.createObjectStore('syncState', { keyPath: 'key' });
+                }
+                
                 console.log('IndexedDB schema created/updated');
             };
         });
@@ -115,6 +140,7 @@ class DatabaseSync {
     async saveGameLog(gameLog) {
         const logEntry = {
             ...gameLog,
+            clientLogId: this.generateClientLogId(),
             timestamp: Date.now(),
             synced: false
         };
@@ -216,31 +242,147 @@ class DatabaseSync {
             
             console.log(`Syncing ${unsyncedLogs.length} game logs...`);
             
-            const response = await fetch('/api/sync-offline-data', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ logs: unsyncedLogs })
-            });
+            let syncedCount = 0;
+            let start = 0;
+            while (start < unsyncedLogs.length) {
+                const columnar = this.columnarSync;
+                const batch = unsyncedLogs.slice(start, start + (columnar ? this.columnarBatchSize : this.syncBatchSize));
+                const response = columnar
+                    ? await this.postColumnarLogs(batch)
+                    : await fetch('/api/sync-offline-data', {
+                        method: 'POST',
+                        headers: {
+                            'Content-Type': 'application/json',
+                        },
+                        body: JSON.stringify({
+                            logs: batch.map(log => ({
+                                ...log,
+                                client_log_id: this.clientLogIdFor(log)
+                            }))
+                        })
+                    });
+                
+                if (columnar && (response.status === 415 || response.status === 400)) {
+                    // Server without the columnar encoding: resend this batch as JSON
+                    console.warn('Columnar sync not accepted, falling back to JSON');
+                    this.columnarSync = false;
+                    continue;
+                }
+                if (!response.ok) {
+                    console.error('Failed to sync game logs:', response.statusText);
+                    break;
+                }
+                
+                // Rejections are validation failures that would repeat on every
+                // retry: keep those logs with the server's error instead of resending
+                const result = await response.json();
+                let rejected;
+                let received;
+                if (columnar) {
+                    rejected = result.rejected_logs || [];
+                    received = batch.slice(0, result.received);
+                } else {
+                    rejected = (result.results || []).filter(item => item.status === 'rejected');
+                    received = batch;
+                }
+                for (const item of rejected) {
+                    batch[item.index].syncError = item.error;
+                }
+                await this.markAsSynced('gameLogs', received);
+                syncedCount += received.length - rejected.length;
+                
+                if (rejected.length) {
+                    console.warn(`${rejected.length} game logs were rejected by the server:`,
+                        rejected.map(item => item.error));
+                }
+                // A partially read columnar upload continues after the last log received
+                start += columnar ? Math.max(result.received, 1) : batch.length;
+            }
             
-            if (response.ok) {
-                // Mark logs as synced
-                await this.markAsSynced('gameLogs', unsyncedLogs);
-                console.log('Game logs synced successfully');
+            if (syncedCount > 0) {
+                console.log(`${syncedCount} game logs synced successfully`);
                 
                 // Dispatch event for UI updates
                 window.dispatchEvent(new CustomEvent('gameLogsSynced', {
-                    detail: { count: unsyncedLogs.length }
+                    detail: { count: syncedCount }
                 }));
-            } else {
-                console.error('Failed to sync game logs:', response.statusText);
             }
         } catch (error) {
             console.error('Error syncing game logs:', error);
         }
     }
     
+    // Column-oriented NDJSON (see sync_codec.py): repeated strings become
+    // dictionary indexes and timestamps are deltas from the previous log
+    encodeColumnarLogs(logs) {
+        const gameTypes = { game: 'g', quiz: 'q' };
+        const levels = { easy: 'e', medium: 'm', hard: 'h' };
+        const dictionaries = { subject: new Map(), game_id: new Map() };
+        const lines = [JSON.stringify({ format: 'shiksha-logs', version: 1 })];
+        
+        for (let start = 0; start < logs.length; start += this.columnarBlockRows) {
+            const blockLogs = logs.slice(start, start + this.columnarBlockRows);
+            const block = { n: blockLogs.length, dict: {} };
+            
+            for (const name of ['subject', 'game_id']) {
+                const known = dictionaries[name];
+                const added = [];
+                block[name] = blockLogs.map(log => {
+                    if (!known.has(log[name])) {
+                        known.set(log[name], known.size);
+                        added.push(log[name]);
+                    }
+                    return known.get(log[name]);
+                });
+                if (added.length) {
+                    block.dict[name] = added;
+                }
+            }
+            block.game_type = blockLogs.map(log => gameTypes[log.game_type || 'game'] || log.game_type);
+            block.level = blockLogs.map(log => levels[log.level || 'medium'] || log.level);
+            block.grade = blockLogs.map(log => log.grade);
+            block.score = blockLogs.map(log => log.score);
+            block.max_score = blockLogs.map(log => log.max_score);
+            block.time_spent = blockLogs.map(log => log.time_spent ?? null);
+            block.client_log_id = blockLogs.map(log => this.clientLogIdFor(log));
+            let previous = 0;
+            block.t = blockLogs.map(log => {
+                const delta = log.timestamp - previous;
+                previous = log.timestamp;
+                return delta;
+            });
+            lines.push(JSON.stringify(block));
+        }
+        return lines.join('\n') + '\n';
+    }
+    
+    async postColumnarLogs(logs) {
+        const body = new Blob([this.encodeColumnarLogs(logs)])
+            .stream()
+            .pipeThrough(new CompressionStream('gzip'));
+        return fetch('/api/sync-offline-data', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/vnd.shiksha.logs+ndjson',
+                'Content-Encoding': 'gzip'
+            },
+            body: await new Response(body).arrayBuffer()
+        });
+    }
+    
+    // Generate the idempotency key the server uses to drop retried uploads
+    generateClientLogId() {
+        if (window.crypto && typeof window.crypto.randomUUID === 'function') {
+            return window.crypto.randomUUID();
+        }
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+    }
+    
+    // Logs saved before client ids existed fall back to a stable local key
+    clientLogIdFor(log) {
+        return log.clientLogId || `idb-${log.id}-${log.timestamp}`;
+    }
+    
     // Sync achievements with server
     async syncAchievements() {
         if (!this.isOnline) return;
@@ -255,21 +397,24 @@ class DatabaseSync {
             
             console.log(`Syncing ${unsyncedAchievements.length} achievements...`);
             
-            for (const achievement of unsyncedAchievements) {
+            // One request per batch; badges the server already has come back as duplicates
+            for (let start = 0; start < unsyncedAchievements.length; start += this.achievementBatchSize) {
+                const batch = unsyncedAchievements.slice(start, start + this.achievementBatchSize);
                 try {
                     const response = await fetch('/api/achievements', {
                         method: 'POST',
                         headers: {
                             'Content-Type': 'application/json',
                         },
-                        body: JSON.stringify(achievement)
+                        body: JSON.stringify({ achievements: batch })
                     });
                     
+                    // Rejected entries are malformed and would fail on every retry
                     if (response.ok) {
-                        await this.markAsSynced('achievements', [achievement]);
+                        await this.markAsSynced('achievements', batch);
                     }
                 } catch (error) {
-                    console.error('Failed to sync achievement:', achievement, error);
+                    console.error('Failed to sync achievements:', error);
                 }
             }
             
@@ -392,13 +537,136 @@ class DatabaseSync {
         });
     }
     
-    // Start periodic sync (every 5 minutes when online)
+    // Pull changes as they happen and push anything still pending after each
+    // long-poll, instead of a full sync on a timer
     startPeriodicSync() {
-        setInterval(() => {
-            if (this.isOnline) {
-                this.syncPendingData();
+        if (this.changeFeedRunning) return;
+        this.changeFeedRunning = true;
+        this.runChangeFeed();
+    }
+    
+    async runChangeFeed() {
+        while (this.changeFeedRunning) {
+            if (!this.isOnline) {
+                await new Promise(resolve => window.addEventListener('online', resolve, { once: true }));
+                continue;
+            }
+            
+            let delay = 0;
+            try {
+                const result = await this.pullChanges(this.changeFeedWait);
+                if (result.stop) {
+                    // Not logged in as a student; the next page load starts again
+                    this.changeFeedRunning = false;
+                    return;
+                }
+                delay = result.retryAfter;
+                
+                const status = await this.getSyncStatus();
+                if (status.totalPending > 0) {
+                    await this.syncPendingData();
+                }
+            } catch (error) {
+                console.error('Change feed failed:', error);
+                delay = this.changeFeedRetryDelay;
+            }
+            if (delay) {
+                await new Promise(resolve => setTimeout(resolve, delay));
+            }
+        }
+    }
+    
+    // Fetch changes after the stored cursor page by page; the first request
+    // waits up to `wait` seconds on the server when nothing is new
+    async pullChanges(wait = 0) {
+        let pulled = 0;
+        while (true) {
+            const state = await this.getFromStore('syncState', 'changeCursor');
+            const params = new URLSearchParams({ limit: this.changeFeedPageSize });
+            if (state) {
+                params.set('cursor', state.cursor);
+                params.set('wait', wait);
+            }
+            const response = await fetch(`/api/sync/changes?${params}`, { cache: 'no-store' });
+            
+            if (response.status === 304) {
+                // Retry-After means the server could not hold the request open
+                const retryAfter = Number(response.headers.get('Retry-After') || 0);
+                return { pulled, retryAfter: retryAfter * 1000 };
+            }
+            if (response.status === 401 || response.status === 403 || response.status === 404) {
+                return { pulled, stop: true };
+            }
+            if (!response.ok) {
+                throw new Error(`Change feed answered ${response.status}`);
+            }
+            
+            const result = await response.json();
+            pulled += await this.applyChanges(result);
+            if (!result.has_more) {
+                if (pulled > 0) {
+                    window.dispatchEvent(new CustomEvent('serverChangesPulled', {
+                        detail: { count: pulled }
+                    }));
+                }
+                return { pulled, retryAfter: 0 };
+            }
+            wait = 0;
+        }
+    }
+    
+    // Store one change feed page and its cursor in one transaction; a reset
+    // (another student on this phone, or data moved on the server) replaces
+    // everything pulled before
+    async applyChanges(result) {
+        const transaction = this.db.transaction(['serverRecords', 'syncState'], 'readwrite');
+        const records = transaction.objectStore('serverRecords');
+        const studentId = result.student_id;
+        const done = new Promise((resolve, reject) => {
+            transaction.oncomplete = () => resolve();
+            transaction.onerror = () => reject(transaction.error);
+        });
+        
+        if (result.reset) {
+            // Requests run in order, so this completes before the puts below
+            records.clear();
+        }
+        
+        let count = 0;
+        for (const [table, { columns, rows }] of Object.entries(result.changes || {})) {
+            for (const row of rows) {
+                const record = { table, studentId };
+                columns.forEach((column, index) => {
+                    record[column] = row[index];
+                });
+                record.key = `${table}:${record.id}`;
+                records.put(record);
+                count++;
             }
-        }, 5 * 60 * 1000); // 5 minutes
+        }
+        transaction.objectStore('syncState').put({ key: 'changeCursor', cursor: result.cursor, studentId });
+        
+        await done;
+        return count;
+    }
+    
+    // Rows pulled from the server: table is 'game_logs', 'achievements' or 'student_progress'
+    async getServerRecords(table) {
+        return new Promise((resolve, reject) => {
+            const transaction = this.db.transaction(['serverRecords'], 'readonly');
+            const request = transaction.objectStore('serverRecords').index('table').getAll(table);
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+    
+    async getFromStore(storeName, key) {
+        return new Promise((resolve, reject) => {
+            const transaction = this.db.transaction([storeName], 'readonly');
+            const request = transaction.objectStore(storeName).get(key);
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
     }
     
     // Show sync notification to user
@@ -454,7 +722,7 @@ class DatabaseSync {
     // Clear all local data (for logout)
     async clearAllData() {
         try {
-            const storeNames = ['gameLogs', 'achievements', 'userProgress', 'cachedContent'];
+            const storeNames = ['gameLogs', 'achievements', 'userProgress', 'cachedContent', 'serverRecords', 'syncState'];
             
             for (const storeName of storeNames) {
                 const transaction = this.db.transaction([storeName], 'readwrite');
@@ -122,11 +122,62 @@ class GameLoader {
         } catch (error) {
             console.error('Error loading game:', error);
             
+            // Offline: use the copy stored by prefetchGrade, if any
+            if (window.dbSync) {
+                const cached = await window.dbSync.getCachedContent(`game_${grade}_${gameFile}`);
+                if (cached) {
+                    return cached;
+                }
+            }
+            
             // Return mock game data as fallback
             return this.getMockGameData(grade, gameFile);
         }
     }
     
+    // Prefetch a whole grade in one request; later calls only download changed games
+    async prefetchGrade(grade, medium = null) {
+        const hashesKey = `gameBundleHashes_${grade}_${medium || 'all'}`;
+        const have = JSON.parse(localStorage.getItem(hashesKey) || 'null');
+        const params = new URLSearchParams();
+        if (medium) params.set('medium', medium);
+        
+        try {
+            // Sending the hashes held lets any server compute the delta
+            const response = have
+                ? await fetch(`/api/games/delta/${grade}?${params}`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ have })
+                })
+                : await fetch(`/api/games/bundle/${grade}?${params}`);
+            if (!response.ok) {
+                throw new Error(`Failed to prefetch grade ${grade}: ${response.statusText}`);
+            }
+            
+            const bundle = await response.json();
+            const hashes = bundle.full ? {} : { ...have };
+            for (const game of bundle.games) {
+                this.gameCache.set(`${grade}_${game.file}`, game.data);
+                hashes[game.file] = game.hash;
+                if (window.dbSync) {
+                    await window.dbSync.cacheContent(`game_${grade}_${game.file}`, game.data, 'game', grade);
+                }
+            }
+            for (const file of bundle.removed) {
+                this.gameCache.delete(`${grade}_${file}`);
+                delete hashes[file];
+            }
+            
+            localStorage.setItem(hashesKey, JSON.stringify(hashes));
+            console.log(`Prefetched ${bundle.games.length} games for grade ${grade}`);
+            return bundle.games.length;
+        } catch (error) {
+            console.error('Error prefetching games:', error);
+            return 0;
+        }
+    }
+    
     // Get mock game data for offline/fallback scenarios
     getMockGameData(grade, gameFile) {
         return {
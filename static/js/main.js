@@ -12,7 +12,12 @@ class ShikshaLeap {
     
     async init() {
         // Load saved language preference
-        this.currentLanguage = localStorage.getItem('shikshaLanguage') || 'en';
+        // Without a saved choice, keep the language the server rendered the page in
+        const savedLanguage = localStorage.getItem('shikshaLanguage');
+        this.currentLanguage = savedLanguage || document.documentElement.lang || 'en';
+        if (savedLanguage) {
+            this.rememberLanguage();
+        }
         
         // Setup event listeners
         this.setupEventListeners();
@@ -73,8 +78,24 @@ class ShikshaLeap {
         });
     }
     
+    rememberLanguage() {
+        // The server renders pages in the language named by this cookie
+        document.cookie = `shikshaLanguage=${this.currentLanguage}; path=/; max-age=31536000; SameSite=Lax`;
+    }
+    
     async loadTranslations() {
         try {
+            // Frozen server catalog with English filled in for missing keys;
+            // revalidated by ETag so an unchanged locale costs a 304
+            try {
+                const merged = await fetch(`/api/locales?lang=${this.currentLanguage}`);
+                if (merged.ok) {
+                    this.translations = (await merged.json()).messages;
+                    return;
+                }
+            } catch (error) {
+                // Offline: fall back to the locale files the service worker cached
+            }
             const response = await fetch(`/static/locales/${this.currentLanguage}.json`);
             if (response.ok) {
                 this.translations = await response.json();
@@ -110,6 +131,7 @@ class ShikshaLeap {
     async changeLanguage(language) {
         this.currentLanguage = language;
         localStorage.setItem('shikshaLanguage', language);
+        this.rememberLanguage();
         
         await this.loadTranslations();
         this.applyTranslations();
@@ -0,0 +1,170 @@
+"""Column-oriented encoding for offline sync uploads
+
+/api/sync-offline-data accepts plain JSON ({"logs": [...]}) and, with
+Content-Type COLUMNAR_CONTENT_TYPE, this compact encoding (normally sent
+with Content-Encoding: gzip). The body is newline-delimited JSON: a header
+line, then blocks of up to MAX_BLOCK_ROWS logs stored column by column:
+
+    {"format": "shiksha-logs", "version": 1}
+    {"n": 2, "dict": {"subject": ["Mathematics"], "game_id": ["maths_game1"]},
+     "subject": [0, 0], "game_id": [0, 0], "grade": [6, 6], "game_type": ["g", "q"],
+     "level": ["e", "h"], "score": [7, 9], "max_score": [10, 10],
+     "time_spent": [120, 95], "t": [1718000000000, 61000], "client_log_id": ["a1", "b2"]}
+
+Strings that repeat from row to row (subject, game_id) are indexes into
+dictionaries that each block may extend; game_type and level use one-letter
+codes. "t" holds Date.now() milliseconds, the first absolute and every
+other one the difference from the previous row. iter_blocks() reads one line
+at a time, so the server holds a single block in memory regardless of the
+upload size and can insert block by block.
+"""
+import gzip
+import json
+
+COLUMNAR_CONTENT_TYPE = 'application/vnd.shiksha.logs+ndjson'
+FORMAT_NAME = 'shiksha-logs'
+FORMAT_VERSION = 1
+
+MAX_BLOCK_ROWS = 1000
+# Upper bound for one decoded line, so a gzip bomb cannot exhaust memory
+MAX_LINE_BYTES = 4 * 1024 * 1024
+
+DICTIONARY_COLUMNS = ('subject', 'game_id')
+GAME_TYPE_CODES = {'game': 'g', 'quiz': 'q'}
+LEVEL_CODES = {'easy': 'e', 'medium': 'm', 'hard': 'h'}
+GAME_TYPES_BY_CODE = {code: name for name, code in GAME_TYPE_CODES.items()}
+LEVELS_BY_CODE = {code: name for name, code in LEVEL_CODES.items()}
+PLAIN_COLUMNS = ('grade', 'score', 'max_score', 'time_spent', 'client_log_id')
+
+
+class SyncFormatError(ValueError):
+    """Raised when a columnar upload cannot be decoded"""
+
+
+def encode_logs(logs, block_rows=MAX_BLOCK_ROWS, compress=True):
+    """Encode log dicts (with a millisecond 'timestamp') the way db_sync.js does"""
+    dictionaries = {name: {} for name in DICTIONARY_COLUMNS}
+    lines = [json.dumps({'format': FORMAT_NAME, 'version': FORMAT_VERSION})]
+    for start in range(0, len(logs), block_rows):
+        block_logs = logs[start:start + block_rows]
+        block = {'n': len(block_logs), 'dict': {}}
+        for name in DICTIONARY_COLUMNS:
+            known = dictionaries[name]
+            added = []
+            codes = []
+            for log in block_logs:
+                value = log.get(name)
+                if value not in known:
+                    known[value] = len(known)
+                    added.append(value)
+                codes.append(known[value])
+            if added:
+                block['dict'][name] = added
+            block[name] = codes
+        block['game_type'] = [GAME_TYPE_CODES.get(log.get('game_type', 'game'), log.get('game_type'))
+                              for log in block_logs]
+        block['level'] = [LEVEL_CODES.get(log.get('level', 'medium'), log.get('level'))
+                          for log in block_logs]
+        for name in PLAIN_COLUMNS:
+            block[name] = [log.get(name) for log in block_logs]
+        previous = 0
+        deltas = []
+        for log in block_logs:
+            deltas.append(log['timestamp'] - previous)
+            previous = log['timestamp']
+        block['t'] = deltas
+        lines.append(json.dumps(block, separators=(',', ':')))
+    body = ('\n'.join(lines) + '\n').encode('utf-8')
+    return gzip.compress(body, 6) if compress else body
+
+
+def _column(block, name, rows):
+    values = block.get(name)
+    if not isinstance(values, list) or len(values) != rows:
+        raise SyncFormatError(f'column {name} must be a list of {rows} values')
+    return values
+
+
+def _decode_block(block, dictionaries):
+    """Log dicts of one block, in the shape /api/sync-offline-data accepts as JSON"""
+    if not isinstance(block, dict):
+        raise SyncFormatError('block must be an object')
+    rows = block.get('n')
+    if not isinstance(rows, int) or not 0 < rows <= MAX_BLOCK_ROWS:
+        raise SyncFormatError(f'block size must be between 1 and {MAX_BLOCK_ROWS}')
+    additions = block.get('dict') or {}
+    if not isinstance(additions, dict):
+        raise SyncFormatError('dict must be an object')
+    for name in DICTIONARY_COLUMNS:
+        added = additions.get(name) or []
+        if not isinstance(added, list):
+            raise SyncFormatError(f'dict.{name} must be a list')
+        dictionaries[name].extend(added)
+
+    columns = {}
+    for name in DICTIONARY_COLUMNS:
+        dictionary = dictionaries[name]
+        try:
+            columns[name] = [dictionary[code] for code in _column(block, name, rows)]
+        except (IndexError, TypeError):
+            raise SyncFormatError(f'{name} refers to an unknown dictionary entry')
+    columns['game_type'] = [GAME_TYPES_BY_CODE.get(code, code) for code in _column(block, 'game_type', rows)]
+    columns['level'] = [LEVELS_BY_CODE.get(code, code) for code in _column(block, 'level', rows)]
+    for name in PLAIN_COLUMNS:
+        columns[name] = _column(block, name, rows)
+    timestamps = []
+    total = 0
+    for delta in _column(block, 't', rows):
+        if isinstance(delta, bool) or not isinstance(delta, int):
+            raise SyncFormatError('t must hold integers')
+        total += delta
+        timestamps.append(total)
+    columns['timestamp'] = timestamps
+
+    names = list(columns)
+    logs = []
+    for values in zip(*(columns[name] for name in names)):
+        log = dict(zip(names, values))
+        if log['time_spent'] is None:
+            del log['time_spent']
+        if log['client_log_id'] is None:
+            del log['client_log_id']
+        logs.append(log)
+    return logs
+
+
+def iter_blocks(stream, content_encoding=None):
+    """Yield the decoded logs of each block of a columnar upload, one block at a time"""
+    if content_encoding == 'gzip':
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    elif content_encoding not in (None, '', 'identity'):
+        raise SyncFormatError(f'Unsupported Content-Encoding {content_encoding}')
+
+    dictionaries = {name: [] for name in DICTIONARY_COLUMNS}
+    header_seen = False
+    try:
+        while True:
+            line = stream.readline(MAX_LINE_BYTES + 1)
+            if not line:
+                break
+            if len(line) > MAX_LINE_BYTES:
+                raise SyncFormatError('block is too large')
+            if not line.strip():
+                continue
+            try:
+                value = json.loads(line)
+            except ValueError:
+                raise SyncFormatError('block is not valid JSON')
+            if not header_seen:
+                if not isinstance(value, dict) or value.get('format') != FORMAT_NAME:
+                    raise SyncFormatError('missing shiksha-logs header')
+                if value.get('version') != FORMAT_VERSION:
+                    raise SyncFormatError(f'unsupported format version {value.get("version")}')
+                header_seen = True
+                continue
+            yield _decode_block(value, dictionaries)
+    except (OSError, EOFError) as e:
+        # Corrupt or truncated gzip data
+        raise SyncFormatError(f'could not decompress upload: {e}')
+    if not header_seen:
+        raise SyncFormatError('empty upload')
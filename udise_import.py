@@ -0,0 +1,198 @@
+"""Streaming, resumable import of UDISE school CSVs
+
+The CSV is streamed in fixed-size chunks into a shadow table
+(udise_schools_import) that carries no secondary indexes, while the live
+udise_schools table keeps serving registrations. Each chunk commits together
+with a checkpoint row, so a crashed import resumes from the last chunk. Once
+the load finishes, the search index is built beside the shadow table and both
+are swapped in with a single short transaction.
+"""
+import csv
+import os
+import time
+
+from analytics import bump_versions
+from database import UDISE_SCHOOLS_COLUMNS, connect
+from school_search import SEARCH_INDEX_TABLE, create_search_index, rebuild_search_index
+from udise_index import REGISTER_VERSION_KEY
+
+SHADOW_TABLE = 'udise_schools_import'
+SHADOW_INDEX_TABLE = 'udise_schools_import_fts'
+CHECKPOINT_TABLE = 'udise_import_checkpoint'
+DEFAULT_CHUNK_SIZE = 10000
+
+INSERT_SHADOW_SQL = f'''
+    INSERT OR REPLACE INTO {SHADOW_TABLE}
+    (udise_code, school_name, district, block, category, area, management)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def _source_fingerprint(csv_path):
+    """Identify the CSV so a checkpoint is only resumed against the same file"""
+    stat = os.stat(csv_path)
+    return f'{os.path.abspath(csv_path)}:{stat.st_size}:{int(stat.st_mtime)}'
+
+
+def _ensure_checkpoint_table(conn):
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        source TEXT NOT NULL,
+        rows_read INTEGER NOT NULL,
+        rows_loaded INTEGER NOT NULL,
+        rows_skipped INTEGER NOT NULL,
+        started_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )''')
+
+
+def _start_or_resume(conn, source, resume):
+    """Return the checkpoint to continue from, resetting the shadow table if needed"""
+    _ensure_checkpoint_table(conn)
+    checkpoint = conn.execute(
+        f'SELECT source, rows_read, rows_loaded, rows_skipped, started_at FROM {CHECKPOINT_TABLE}'
+    ).fetchone()
+    shadow_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (SHADOW_TABLE,)
+    ).fetchone()
+
+    if resume and checkpoint and checkpoint[0] == source and shadow_exists:
+        return {'rows_read': checkpoint[1], 'rows_loaded': checkpoint[2],
+                'rows_skipped': checkpoint[3], 'started_at': checkpoint[4], 'resumed': True}
+
+    now = time.time()
+    with conn:
+        conn.execute(f'DROP TABLE IF EXISTS {SHADOW_TABLE}')
+        conn.execute(f'DROP TABLE IF EXISTS {SHADOW_INDEX_TABLE}')
+        conn.execute(f'CREATE TABLE {SHADOW_TABLE} ({UDISE_SCHOOLS_COLUMNS})')
+        conn.execute(f'DELETE FROM {CHECKPOINT_TABLE}')
+        conn.execute(f'''
+            INSERT INTO {CHECKPOINT_TABLE}
+            (id, source, rows_read, rows_loaded, rows_skipped, started_at, updated_at)
+            VALUES (1, ?, 0, 0, 0, ?, ?)
+        ''', (source, now, now))
+    return {'rows_read': 0, 'rows_loaded': 0, 'rows_skipped': 0, 'started_at': now, 'resumed': False}
+
+
+def _csv_row(row):
+    """Map a UDISE CSV record to a udise_schools row, or None if unusable"""
+    code = (row.get('UDISE_Code') or '').strip()
+    name = (row.get('School_Name') or '').strip()
+    if not code or not name:
+        return None
+    return (
+        code,
+        name,
+        (row.get('District') or '').strip(),
+        (row.get('Block') or '').strip(),
+        row.get('Category') or '',
+        row.get('Area') or '',
+        row.get('Management') or '',
+    )
+
+
+def _load_chunk(conn, rows, state):
+    """Insert one chunk and advance the checkpoint in the same transaction"""
+    with conn:
+        conn.executemany(INSERT_SHADOW_SQL, rows)
+        conn.execute(f'''
+            UPDATE {CHECKPOINT_TABLE}
+            SET rows_read = ?, rows_loaded = ?, rows_skipped = ?, updated_at = ?
+            WHERE id = 1
+        ''', (state['rows_read'], state['rows_loaded'], state['rows_skipped'], time.time()))
+
+
+def _swap_in(conn, has_search_index):
+    """Replace the live table and search index with the shadow copies"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute(f'DROP TABLE IF EXISTS {SEARCH_INDEX_TABLE}')
+        conn.execute('DROP TABLE IF EXISTS udise_schools')
+        conn.execute(f'ALTER TABLE {SHADOW_TABLE} RENAME TO udise_schools')
+        if has_search_index:
+            conn.execute(f'ALTER TABLE {SHADOW_INDEX_TABLE} RENAME TO {SEARCH_INDEX_TABLE}')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_udise_schools_district_block
+            ON udise_schools (district, block)
+        ''')
+        conn.execute(f'DELETE FROM {CHECKPOINT_TABLE}')
+        # Workers reload their in-memory UDISE index when this changes
+        bump_versions(conn, [REGISTER_VERSION_KEY])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def import_udise_csv(csv_path, db_path=None, chunk_size=DEFAULT_CHUNK_SIZE, resume=True, progress=print):
+    """Stream a UDISE CSV into udise_schools without emptying the live table
+
+    Returns a summary dict with row counts, elapsed seconds and rows/second.
+    """
+    source = _source_fingerprint(csv_path)
+    conn = connect(db_path)
+    try:
+        state = _start_or_resume(conn, source, resume)
+        if state['resumed']:
+            progress(f"Resuming UDISE import after {state['rows_read']} rows")
+
+        chunk_started = time.monotonic()
+        load_started = chunk_started
+        loaded_this_run = 0
+        with open(csv_path, 'r', encoding='utf-8', newline='') as file:
+            reader = csv.DictReader(file)
+            # Rows already committed before a crash are parsed but not re-inserted
+            for _ in range(state['rows_read']):
+                if next(reader, None) is None:
+                    break
+
+            chunk = []
+            for record in reader:
+                state['rows_read'] += 1
+                row = _csv_row(record)
+                if row is None:
+                    state['rows_skipped'] += 1
+                else:
+                    chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    state['rows_loaded'] += len(chunk)
+                    loaded_this_run += len(chunk)
+                    _load_chunk(conn, chunk, state)
+                    chunk = []
+                    now = time.monotonic()
+                    progress(f"Loaded {state['rows_loaded']} schools "
+                             f"({chunk_size / max(now - chunk_started, 1e-9):.0f} rows/s)")
+                    chunk_started = now
+            state['rows_loaded'] += len(chunk)
+            loaded_this_run += len(chunk)
+            _load_chunk(conn, chunk, state)
+
+        load_seconds = time.monotonic() - load_started
+
+        # Index the shadow table while the live one keeps serving searches
+        index_started = time.monotonic()
+        with conn:
+            has_search_index = create_search_index(conn, SHADOW_INDEX_TABLE)
+            if has_search_index:
+                rebuild_search_index(conn, SHADOW_INDEX_TABLE, SHADOW_TABLE)
+        index_seconds = time.monotonic() - index_started
+
+        swap_started = time.monotonic()
+        _swap_in(conn, has_search_index)
+        swap_seconds = time.monotonic() - swap_started
+
+        count = conn.execute('SELECT COUNT(*) FROM udise_schools').fetchone()[0]
+    finally:
+        conn.close()
+
+    return {
+        'schools': count,
+        'rows_read': state['rows_read'],
+        'rows_skipped': state['rows_skipped'],
+        'resumed': state['resumed'],
+        'load_seconds': round(load_seconds, 3),
+        'index_seconds': round(index_seconds, 3),
+        'swap_seconds': round(swap_seconds, 3),
+        'rows_per_second': round(loaded_this_run / max(load_seconds, 1e-9)),
+    }
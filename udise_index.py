@@ -0,0 +1,196 @@
+"""Compact in-memory lookup of the UDISE school register
+
+Resolving a UDISE code is the commonest read of the register (registration
+forms, teacher imports), and each one used to be a query. UdiseIndex loads
+the register once into a handful of flat arrays sorted by code:
+
+    codes       array of 11-digit codes as 64-bit integers, binary searched
+    ids         udise_schools row ids
+    names       one UTF-8 blob of school names with an offsets array
+    fields      district, block, category, area and management as indexes
+                into one tuple of interned strings (a few thousand values)
+
+About 26 bytes per school plus its name, so the national register (~1.5
+million schools) takes under 100MB, against gigabytes as a dict of row
+dicts. The arrays
+are a few large objects whose pages are never written after loading, so with
+gunicorn's preload_app the master loads the index during warmup and forked
+workers share it copy-on-write instead of each holding its own copy. Codes
+that are not 11 digits are kept in a small dict.
+
+import_udise_csv() bumps the 'udise:register' version in analytics_versions
+when it swaps a new register in; refresh() checks that version at most every
+poll interval and reloads, so lookups may lag an import by that long.
+"""
+import array
+import bisect
+import threading
+import time
+
+REGISTER_VERSION_KEY = 'udise:register'
+CODE_DIGITS = 11
+DEFAULT_POLL_SECONDS = 30.0
+# Codes resolved by one batch request
+MAX_RESOLVE_CODES = 1000
+
+FIELDS = ('district', 'block', 'category', 'area', 'management')
+COLUMNS = ('id', 'udise_code', 'school_name') + FIELDS
+
+
+def register_version(conn):
+    row = conn.execute(
+        'SELECT version FROM analytics_versions WHERE scope_key = ?', (REGISTER_VERSION_KEY,)
+    ).fetchone()
+    return row[0] if row is not None else 0
+
+
+def _packed_code(code):
+    """Integer of an 11-digit code, None for any other code"""
+    if len(code) == CODE_DIGITS and code.isdigit() and code.isascii():
+        return int(code)
+    return None
+
+
+class _Register:
+    """One loaded copy of the register; never changed after build()"""
+
+    def __init__(self, version):
+        self.version = version
+        self.codes = array.array('Q')
+        self.ids = array.array('I')
+        self.name_offsets = array.array('I', [0])
+        self.names = b''
+        self.fields = None
+        self.strings = ()
+        # Codes that do not fit the packed array: code -> (id, name, field strings)
+        self.extras = {}
+
+    def build(self, rows):
+        interned = {}
+        # Two bytes per field until there are too many distinct strings
+        fields = [array.array('H') for _ in FIELDS]
+        names = bytearray()
+        for row in rows:
+            row = tuple(row)
+            school_id, code, name, values = row[0], str(row[1]), row[2] or '', row[3:]
+            packed = _packed_code(code)
+            if packed is None:
+                self.extras[code] = (school_id, name, tuple(values))
+                continue
+            self.codes.append(packed)
+            self.ids.append(school_id)
+            names += name.encode('utf-8')
+            self.name_offsets.append(len(names))
+            for position, value in enumerate(values):
+                index = interned.get(value)
+                if index is None:
+                    index = interned[value] = len(interned)
+                    if index == 65536:
+                        fields = [array.array('I', field) for field in fields]
+                fields[position].append(index)
+        # Never written again, so forked workers keep sharing its pages
+        self.names = names
+        self.strings = tuple(interned)
+        self.fields = tuple(fields)
+        return self
+
+    def __len__(self):
+        return len(self.codes) + len(self.extras)
+
+    def find(self, code):
+        """udise_schools row of a code as a tuple of COLUMNS, or None"""
+        packed = _packed_code(code)
+        if packed is None:
+            extra = self.extras.get(code)
+            if extra is None:
+                return None
+            school_id, name, values = extra
+        else:
+            index = bisect.bisect_left(self.codes, packed)
+            if index == len(self.codes) or self.codes[index] != packed:
+                return None
+            school_id = self.ids[index]
+            name = self.names[self.name_offsets[index]:self.name_offsets[index + 1]].decode('utf-8')
+            values = tuple(self.strings[column[index]] for column in self.fields)
+        return (school_id, code, name) + values
+
+    def nbytes(self):
+        arrays = (self.codes, self.ids, self.name_offsets) + tuple(self.fields or ())
+        return (sum(a.itemsize * len(a) for a in arrays) + len(self.names)
+                + sum(len(s) for s in self.strings))
+
+
+class UdiseIndex:
+    """Per-process UDISE code lookups from a compact copy of udise_schools"""
+
+    def __init__(self, poll_interval=DEFAULT_POLL_SECONDS):
+        self.poll_interval = poll_interval
+        self._register = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._next_poll = 0.0
+        self._stats = {'loads': 0, 'lookups': 0, 'hits': 0, 'last_load_seconds': 0.0}
+
+    def load(self, conn):
+        """Read the whole register through conn, replacing the loaded copy"""
+        started = time.perf_counter()
+        version = register_version(conn)
+        rows = conn.execute(f'''
+            SELECT id, udise_code, school_name, {', '.join(FIELDS)}
+            FROM udise_schools ORDER BY udise_code
+        ''')
+        register = _Register(version).build(rows)
+        with self._lock:
+            self._register = register
+            self._next_poll = time.monotonic() + self.poll_interval
+            self._stats['loads'] += 1
+            self._stats['last_load_seconds'] = round(time.perf_counter() - started, 3)
+        return self
+
+    def refresh(self, conn, force=False):
+        """Load the register on first use, or again once an import changed its version"""
+        if self._register is not None and not force and time.monotonic() < self._next_poll:
+            return False
+        with self._reload_lock:
+            register = self._register
+            if register is not None and not force:
+                # Another thread may have checked while this one waited
+                if time.monotonic() < self._next_poll:
+                    return False
+                self._next_poll = time.monotonic() + self.poll_interval
+                if register_version(conn) == register.version:
+                    return False
+            self.load(conn)
+            return True
+
+    def get(self, code):
+        """udise_schools row of a code as a dict, or None"""
+        return self.resolve([code]).get(code)
+
+    def resolve(self, codes):
+        """{code: school} for the codes found, in input order"""
+        return {code: dict(zip(COLUMNS, row)) for code, row in self.resolve_rows(codes).items()}
+
+    def resolve_rows(self, codes):
+        """{code: tuple of COLUMNS} for the codes found, in input order"""
+        register = self._register
+        found = {}
+        for code in dict.fromkeys(str(code).strip() for code in codes):
+            row = register.find(code) if register is not None else None
+            if row is not None:
+                found[code] = row
+        with self._lock:
+            self._stats['lookups'] += len(codes)
+            self._stats['hits'] += len(found)
+        return found
+
+    def stats(self):
+        """Snapshot of index size and lookup counters for this process"""
+        register = self._register
+        with self._lock:
+            stats = dict(self._stats)
+        stats['schools'] = len(register) if register is not None else 0
+        stats['bytes'] = register.nbytes() if register is not None else 0
+        stats['strings'] = len(register.strings) if register is not None else 0
+        stats['version'] = register.version if register is not None else None
+        return stats
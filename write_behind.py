@@ -0,0 +1,377 @@
+"""Write-behind queue for /api/game-log with group commit
+
+The endpoint validates a log, hands the row to WriteBehindQueue.submit() and
+returns without touching SQLite. A single writer thread per worker drains the
+queue in batches bounded by max_batch rows and max_delay seconds and stores
+each batch in one transaction, so a classroom finishing a quiz together costs
+one fsync instead of one per student.
+
+When a spool directory is configured every accepted row is also appended to
+a per-process spool file before submit() returns; spool files left behind by
+a crashed worker are replayed by the next writer to start. Rows without a
+client_log_id get a server-generated one so a replay never inserts twice.
+
+With sharded student data (see sharding.py) each row carries the shard its
+student was routed to and a batch commits once per shard. Rows refused by a
+shard the student has just been moved away from are routed again through the
+student directory; replayed rows are always routed from the directory.
+"""
+import atexit
+import glob
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+from database import DB_PATH, connect
+from ingest import store_rows
+from sharding import is_fence_error
+
+DEFAULT_MAX_BATCH = 500
+DEFAULT_MAX_DELAY = 0.05
+DEFAULT_MAX_QUEUE = 10000
+
+SPOOL_PATTERN = 'game_logs.*.spool'
+
+
+class QueueFull(Exception):
+    """Raised by submit() when the queue stays full past the enqueue timeout"""
+
+
+def _spool_pid(path):
+    try:
+        return int(os.path.basename(path).split('.')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WriteBehindQueue:
+    """Bounded in-memory queue drained by one group-committing writer thread"""
+
+    def __init__(self, db_path=None, max_batch=DEFAULT_MAX_BATCH, max_delay=DEFAULT_MAX_DELAY,
+                 max_queue=DEFAULT_MAX_QUEUE, enqueue_timeout=0.1, spool_dir=None,
+                 spool_fsync=False, on_commit=None, shards=None):
+        self.db_path = db_path or DB_PATH
+        self.shards = shards
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.enqueue_timeout = enqueue_timeout
+        self.spool_dir = spool_dir
+        self.spool_fsync = spool_fsync
+        self.on_commit = on_commit
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pid = None
+        self._thread = None
+        self._queue = None
+        self._spool = None
+        self._reset()
+        atexit.register(self.close)
+
+    def _reset(self):
+        """Fresh state for this process; nothing from a parent survives fork"""
+        self._pid = os.getpid()
+        self._queue = queue.Queue(self.max_queue)
+        self._spool = None
+        self._stopping = False
+        self._submitted = 0
+        self._done = 0
+        self._spooled = 0
+        self._stats = {
+            'submitted': 0,
+            'committed': 0,
+            'duplicates': 0,
+            'rejected_full': 0,
+            'replayed': 0,
+            'batches': 0,
+            'commit_retries': 0,
+            'rerouted': 0,
+            'dropped': 0,
+            'last_batch_size': 0,
+            'last_commit_ms': 0.0,
+        }
+
+    def _ensure_running(self):
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+                self._thread = None
+            elif self._thread is not None and self._thread.is_alive():
+                return
+            if self._spool is not None:
+                self._spool.close()
+            if self.spool_dir:
+                os.makedirs(self.spool_dir, exist_ok=True)
+                stale = self._stale_spools()
+                self._spool = open(self._spool_path(), 'a', encoding='utf-8')
+            else:
+                stale = []
+            self._thread = threading.Thread(
+                target=self._run, args=(stale,), name='game-log-writer', daemon=True
+            )
+            self._thread.start()
+
+    def _spool_path(self):
+        return os.path.join(self.spool_dir, f'game_logs.{self._pid}.spool')
+
+    def _stale_spools(self):
+        """Spool files of workers that are gone, including an earlier life of this pid"""
+        stale = []
+        for path in glob.glob(os.path.join(self.spool_dir, SPOOL_PATTERN)):
+            pid = _spool_pid(path)
+            if pid is None or pid == self._pid or not _process_alive(pid):
+                if pid == self._pid:
+                    # Keep our file name free for this process's own spool
+                    replay_path = path + f'.{uuid.uuid4().hex}.replay'
+                    os.rename(path, replay_path)
+                    path = replay_path
+                stale.append(path)
+        return stale + glob.glob(os.path.join(self.spool_dir, SPOOL_PATTERN + '.*.replay'))
+
+    def submit(self, student_id, row, shard=None):
+        """Queue one validated game_logs row; raises QueueFull under backpressure"""
+        self._ensure_running()
+        if row[-1] is None:
+            row = row[:-1] + (f'srv-{uuid.uuid4().hex}',)
+        try:
+            # Only blocks when full, giving the writer a moment to catch up
+            self._queue.put((student_id, row, shard), timeout=self.enqueue_timeout)
+        except queue.Full:
+            with self._lock:
+                self._stats['rejected_full'] += 1
+            raise QueueFull(f'write queue is full ({self.max_queue} logs)')
+        with self._lock:
+            if self._spool is not None:
+                self._spool.write(json.dumps([student_id, list(row)]) + '\n')
+                self._spool.flush()
+                if self.spool_fsync:
+                    os.fsync(self._spool.fileno())
+                self._spooled += 1
+            self._submitted += 1
+            self._stats['submitted'] += 1
+
+    def _next_batch(self):
+        """Block for one row, then gather more until max_batch or max_delay"""
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, conn, batch):
+        """Store a batch in one transaction; returns (inserted, duplicates)"""
+        by_student = {}
+        for student_id, row in batch:
+            rows = by_student.setdefault(student_id, {})
+            rows.setdefault(row[-1], row)
+
+        attempt = 0
+        while True:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    inserted = 0
+                    for student_id, rows in by_student.items():
+                        inserted += len(store_rows(conn, student_id, list(rows.values())))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                return inserted, len(batch) - inserted
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) and 'busy' not in str(e):
+                    raise
+                # Lock contention is transient; never drop rows because of it
+                attempt += 1
+                with self._lock:
+                    self._stats['commit_retries'] += 1
+                time.sleep(min(0.05 * attempt, 1.0))
+
+    def _store(self, main, connections, batch, rerouted=False):
+        """Write (student_id, row, shard) items, one transaction per shard; returns (inserted, duplicates)"""
+        by_shard = {}
+        for student_id, row, shard in batch:
+            by_shard.setdefault(shard, []).append((student_id, row))
+        inserted = 0
+        duplicates = 0
+        for shard, items in by_shard.items():
+            conn = connections.get(shard)
+            if conn is None:
+                conn = connections[shard] = self.shards.connect(shard)
+            try:
+                stored, dup = self._write(conn, items)
+            except sqlite3.IntegrityError as e:
+                if self.shards is None or rerouted or not is_fence_error(e):
+                    stored, dup = self._write_each(conn, items)
+                else:
+                    # The students moved to another shard after the request was routed
+                    self.shards.poll(main, force=True)
+                    with self._lock:
+                        self._stats['rerouted'] += len(items)
+                    stored, dup = self._store(main, connections, [
+                        (student_id, row, self.shards.student_shard(main, student_id)) for student_id, row in items
+                    ], rerouted=True)
+            except sqlite3.Error:
+                stored, dup = self._write_each(conn, items)
+            inserted += stored
+            duplicates += dup
+        return inserted, duplicates
+
+    def _write_each(self, conn, batch):
+        """Fallback after a failed batch: store rows one by one, dropping bad ones"""
+        inserted = 0
+        duplicates = 0
+        for item in batch:
+            try:
+                stored, dup = self._write(conn, [item])
+            except sqlite3.Error as e:
+                print(f"Warning: dropping game log for student {item[0]}: {e}")
+                with self._lock:
+                    self._stats['dropped'] += 1
+                continue
+            inserted += stored
+            duplicates += dup
+        return inserted, duplicates
+
+    def _replay(self, main, connections, paths):
+        for path in paths:
+            batch = []
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            student_id, row = json.loads(line)
+                        except ValueError:
+                            continue  # torn last line of a crashed writer
+                        shard = None if self.shards is None else self.shards.student_shard(main, student_id)
+                        batch.append((student_id, tuple(row), shard))
+            except FileNotFoundError:
+                continue  # another worker replayed it first
+            for start in range(0, len(batch), self.max_batch):
+                inserted, _ = self._store(main, connections, batch[start:start + self.max_batch])
+                with self._lock:
+                    self._stats['replayed'] += inserted
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            if batch:
+                print(f"Replayed {len(batch)} spooled game logs from {path}")
+
+    def _run(self, stale_spools):
+        conn = connect(self.db_path)
+        # Shard connections of this thread; None is the main database
+        connections = {None: conn}
+        try:
+            self._replay(conn, connections, stale_spools)
+            while True:
+                batch = self._next_batch()
+                if not batch:
+                    if self._stopping and self._queue.empty():
+                        return
+                    continue
+                started = time.perf_counter()
+                inserted, duplicates = self._store(conn, connections, batch)
+                seconds = time.perf_counter() - started
+                self._finish(len(batch), inserted, duplicates, seconds)
+                if self.on_commit is not None:
+                    self.on_commit(len(batch), seconds)
+        finally:
+            for shard_conn in connections.values():
+                shard_conn.close()
+
+    def _finish(self, size, inserted, duplicates, seconds):
+        with self._lock:
+            self._done += size
+            self._stats['batches'] += 1
+            self._stats['committed'] += inserted
+            self._stats['duplicates'] += duplicates
+            self._stats['last_batch_size'] = size
+            self._stats['last_commit_ms'] = round(seconds * 1000, 3)
+            # Everything spooled so far is in the database; start the spool over
+            if self._spool is not None and self._done == self._submitted and self._spooled:
+                self._spool.seek(0)
+                self._spool.truncate()
+                self._spooled = 0
+            self._idle.notify_all()
+
+    def flush(self, timeout=10.0):
+        """Wait until every row submitted so far is committed; returns True on success"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            target = self._submitted
+            while self._done < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._thread is None or not self._thread.is_alive():
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def close(self, timeout=10.0):
+        """Drain the queue and stop the writer"""
+        if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+            return
+        self.flush(timeout)
+        self._stopping = True
+        self._thread.join(timeout)
+        with self._lock:
+            if self._spool is not None:
+                self._spool.close()
+                if self._done == self._submitted:
+                    os.remove(self._spool_path())
+                self._spool = None
+
+    def depth(self):
+        return self._queue.qsize() if self._pid == os.getpid() else 0
+
+    def stats(self):
+        """Snapshot of queue counters for monitoring"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = self._submitted - self._done if self._pid == os.getpid() else 0
+        stats['depth'] = self.depth()
+        stats['max_queue'] = self.max_queue
+        stats['spool'] = bool(self.spool_dir)
+        return stats
+
+
+def queue_from_env(db_path=None, on_commit=None, shards=None):
+    """WriteBehindQueue configured by SHIKSHA_WRITE_* variables, or None when disabled"""
+    if os.environ.get('SHIKSHA_WRITE_BEHIND', '1') == '0':
+        return None
+    return WriteBehindQueue(
+        db_path,
+        max_batch=int(os.environ.get('SHIKSHA_WRITE_BATCH', DEFAULT_MAX_BATCH)),
+        max_delay=float(os.environ.get('SHIKSHA_WRITE_DELAY_MS', DEFAULT_MAX_DELAY * 1000)) / 1000.0,
+        max_queue=int(os.environ.get('SHIKSHA_WRITE_QUEUE', DEFAULT_MAX_QUEUE)),
+        spool_dir=os.environ.get('SHIKSHA_SPOOL_DIR') or None,
+        spool_fsync=os.environ.get('SHIKSHA_SPOOL_FSYNC') == '1',
+        on_commit=on_commit,
+        shards=shards,
+    )